@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Booking
+from .models import Booking, Depot, PricingRule
 
 
 @admin.register(Booking)
@@ -17,3 +17,28 @@ class BookingAdmin(admin.ModelAdmin):
 
     list_filter = ('status', 'start_date')
     search_fields = ('customer__username', 'vehicle__license_plate')
+
+
+@admin.register(PricingRule)
+class PricingRuleAdmin(admin.ModelAdmin):
+    list_display = (
+        'id',
+        'name',
+        'kind',
+        'start_date',
+        'end_date',
+        'multiplier',
+        'repeat_yearly',
+        'priority',
+        'is_active',
+    )
+
+    list_filter = ('kind', 'is_active', 'repeat_yearly')
+    search_fields = ('name',)
+
+
+@admin.register(Depot)
+class DepotAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'latitude', 'longitude', 'service_radius_km', 'is_active')
+    list_filter = ('is_active',)
+    search_fields = ('name',)
@@ -0,0 +1,152 @@
+import threading
+import time
+from datetime import date, timedelta
+
+import numpy as np
+from django.utils import timezone
+
+from .models import Booking
+from .utils import ACTIVE_STATUSES
+
+# Số ngày (tính từ hôm nay) mà chỉ mục giữ trong bộ nhớ
+HORIZON_DAYS = 180
+# Các worker khác không nhận được signal của nhau -> tự dựng lại sau khoảng này
+INDEX_TTL_SECONDS = 60
+
+
+class _Snapshot:
+    """Ma trận xe x ngày: busy[row, d] = True nếu xe có booking active vào ngày origin + d."""
+
+    def __init__(self, origin: date, vehicle_ids, busy):
+        self.origin = origin
+        self.vehicle_ids = vehicle_ids
+        self.rows = {vid: i for i, vid in enumerate(vehicle_ids.tolist())}
+        self.busy = busy
+        self.built_at = time.monotonic()
+
+    @property
+    def days(self) -> int:
+        return self.busy.shape[1]
+
+    def columns(self, start: date, end: date):
+        """Cột [a, b) ứng với [start, end] (inclusive), None nếu nằm ngoài chỉ mục."""
+        a = (start - self.origin).days
+        b = (end - self.origin).days + 1
+        if a < 0 or b > self.days:
+            return None
+        return a, b
+
+    def mark(self, row: int, start: date, end: date):
+        a = max((start - self.origin).days, 0)
+        b = min((end - self.origin).days + 1, self.days)
+        if a < b:
+            self.busy[row, a:b] = True
+
+
+class AvailabilityIndex:
+    """
+    Chỉ mục lịch trống của cả đội xe trong bộ nhớ tiến trình.
+    Dựng từ các Booking active, cập nhật từng phần khi booking thay đổi,
+    và dựng lại lười khi bị huỷ, sang ngày mới hoặc quá INDEX_TTL_SECONDS.
+    """
+
+    def __init__(self, horizon_days: int = HORIZON_DAYS):
+        self.horizon_days = horizon_days
+        self._lock = threading.Lock()
+        self._snapshot = None
+
+    def invalidate(self):
+        self._snapshot = None
+
+    def _active_bookings(self, origin: date):
+        last = origin + timedelta(days=self.horizon_days - 1)
+        return Booking.objects.filter(
+            status__in=ACTIVE_STATUSES, start_date__lte=last, end_date__gte=origin
+        )
+
+    def _build(self, today: date) -> _Snapshot:
+        from vehicles.models import Vehicle
+
+        vehicle_ids = np.array(
+            sorted(Vehicle.objects.values_list("id", flat=True)), dtype=np.int64
+        )
+        n = self.horizon_days
+        rows = self._active_bookings(today).values_list("vehicle_id", "start_date", "end_date")
+
+        # Mảng hiệu: +1 tại ngày bắt đầu, -1 sau ngày kết thúc, cộng dồn theo hàng
+        diff = np.zeros((len(vehicle_ids), n + 1), dtype=np.int32)
+        if rows:
+            vids, starts, ends = zip(*rows)
+            idx = np.searchsorted(vehicle_ids, np.array(vids, dtype=np.int64))
+            a = np.clip([(s - today).days for s in starts], 0, n)
+            b = np.clip([(e - today).days + 1 for e in ends], 0, n)
+            np.add.at(diff, (idx, a), 1)
+            np.add.at(diff, (idx, b), -1)
+        busy = np.cumsum(diff, axis=1)[:, :n] > 0
+        return _Snapshot(today, vehicle_ids, busy)
+
+    @staticmethod
+    def _is_stale(snapshot, today: date) -> bool:
+        return (
+            snapshot is None
+            or snapshot.origin != today
+            or time.monotonic() - snapshot.built_at > INDEX_TTL_SECONDS
+        )
+
+    def _current(self) -> _Snapshot:
+        today = timezone.localdate()
+        snapshot = self._snapshot
+        if self._is_stale(snapshot, today):
+            with self._lock:
+                # Kiểm tra lại trong lock: request khác có thể vừa dựng xong trong lúc chờ
+                snapshot = self._snapshot
+                if self._is_stale(snapshot, today):
+                    snapshot = self._snapshot = self._build(today)
+        return snapshot
+
+    def add_booking(self, vehicle_id: int, start: date, end: date):
+        """Booking mới (active): bật các ngày bận, không cần query."""
+        snapshot = self._snapshot
+        if snapshot is None:
+            return
+        row = snapshot.rows.get(vehicle_id)
+        if row is None:
+            self.invalidate()
+            return
+        with self._lock:
+            snapshot.mark(row, start, end)
+
+    def refresh_vehicle(self, vehicle_id: int):
+        """Booking bị huỷ/hoàn thành/sửa: dựng lại một hàng từ các booking active của xe."""
+        snapshot = self._snapshot
+        if snapshot is None:
+            return
+        row = snapshot.rows.get(vehicle_id)
+        if row is None:
+            self.invalidate()
+            return
+        bookings = list(
+            self._active_bookings(snapshot.origin)
+            .filter(vehicle_id=vehicle_id)
+            .values_list("start_date", "end_date")
+        )
+        with self._lock:
+            snapshot.busy[row, :] = False
+            for start, end in bookings:
+                snapshot.mark(row, start, end)
+
+    def free_vehicle_ids(self, start: date, end: date):
+        """
+        Danh sách id xe trống trong [start, end] (inclusive), tính bằng slice + reduce trên ma trận.
+        Trả về None nếu khoảng ngày nằm ngoài chỉ mục (gọi nơi khác tự query DB).
+        """
+        snapshot = self._current()
+        cols = snapshot.columns(start, end)
+        if cols is None:
+            return None
+        a, b = cols
+        taken = snapshot.busy[:, a:b].any(axis=1)
+        return snapshot.vehicle_ids[~taken].tolist()
+
+
+index = AvailabilityIndex()
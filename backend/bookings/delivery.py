@@ -0,0 +1,206 @@
+import json
+import math
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+from decimal import Decimal
+from functools import lru_cache
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from vehicles.geo import cell_centers, geohash
+from vehicles.nearby import KM_PER_DEG, haversine_km
+
+from .models import DeliveryCell, Depot
+
+# Ô lưới của ma trận: geohash 6 ký tự ~ 1.2km x 0.6km
+CELL_PRECISION = 6
+# Quãng đường thực tế ~ đường chim bay x hệ số (đo lại bằng calibrate_road_factor với router thật)
+ROAD_FACTOR = 1.3
+# Phí giao xe theo km đường đi, làm tròn lên tới FEE_ROUNDING đồng
+FEE_PER_KM = Decimal("30000")
+FEE_ROUNDING = Decimal("1000")
+# Ma trận chỉ đổi khi chạy build_delivery_matrix: worker khác tự nạp lại sau khoảng này
+MATRIX_TTL_SECONDS = 600
+
+DEFAULT_ROUTER = {
+    "BACKEND": "bookings.delivery.HaversineRouter",
+    "OPTIONS": {},
+}
+
+
+class RoutingError(Exception):
+    """Router tính quãng đường lỗi/không phản hồi."""
+
+
+class HaversineRouter:
+    """Router mặc định: đường chim bay (haversine) x hệ số đường đi, không gọi dịch vụ ngoài."""
+
+    def __init__(self, road_factor=ROAD_FACTOR):
+        self.road_factor = road_factor
+
+    def distances(self, origin, destinations) -> list:
+        """Quãng đường (km) từ origin (lat, lng) tới từng điểm đích."""
+        if not destinations:
+            return []
+        lats, lngs = (np.array(column, dtype=np.float64) for column in zip(*destinations))
+        return (haversine_km(origin[0], origin[1], lats, lngs) * self.road_factor).tolist()
+
+
+class OsrmRouter:
+    """
+    Quãng đường theo đường thật từ OSRM (dịch vụ table, một nguồn -> nhiều đích mỗi lần gọi).
+    Chỉ dùng khi dựng ma trận (offline), không gọi khi báo giá.
+    """
+
+    def __init__(self, url="https://router.project-osrm.org", profile="driving", batch_size=100, timeout=30):
+        self.url = url.rstrip("/")
+        self.profile = profile
+        self.batch_size = batch_size
+        self.timeout = timeout
+
+    def distances(self, origin, destinations) -> list:
+        result = []
+        for i in range(0, len(destinations), self.batch_size):
+            batch = destinations[i:i + self.batch_size]
+            coords = ";".join(f"{lng:.6f},{lat:.6f}" for lat, lng in [origin, *batch])
+            targets = ";".join(str(j) for j in range(1, len(batch) + 1))
+            url = f"{self.url}/table/v1/{self.profile}/{coords}?sources=0&destinations={targets}&annotations=distance"
+            try:
+                with urllib.request.urlopen(url, timeout=self.timeout) as response:
+                    data = json.load(response)
+                row = data["distances"][0]
+            except (urllib.error.URLError, TimeoutError, ValueError, KeyError, IndexError) as exc:
+                raise RoutingError(f"OSRM lỗi: {exc}") from exc
+            # Không có đường (None) -> vô cực: ô đó không được kho này phục vụ
+            result.extend(meters / 1000 if meters is not None else math.inf for meters in row)
+        return result
+
+
+@lru_cache(maxsize=None)
+def _load_router(backend: str, options: tuple):
+    return import_string(backend)(**dict(options))
+
+
+def get_router():
+    """Router theo settings.DELIVERY_ROUTER ({'BACKEND': dotted path, 'OPTIONS': {...}})."""
+    config = getattr(settings, "DELIVERY_ROUTER", DEFAULT_ROUTER)
+    return _load_router(config["BACKEND"], tuple(sorted(config.get("OPTIONS", {}).items())))
+
+
+def calibrate_road_factor(router, samples: int = 200) -> float:
+    """
+    Hệ số đường đi = trung vị (quãng đường router / đường chim bay) trên các ô mẫu quanh các kho.
+    Dùng kết quả làm OPTIONS road_factor của HaversineRouter.
+    """
+    depots = list(Depot.objects.filter(is_active=True))
+    ratios = []
+    for depot in depots:
+        cells = _cells_in_radius(depot)
+        # Lấy mẫu đều trong bán kính của từng kho, tổng cộng khoảng samples ô
+        points = [(lat, lng) for _, lat, lng in cells[::max(1, len(cells) * len(depots) // samples)]]
+        origin = (depot.latitude, depot.longitude)
+        straight = HaversineRouter(road_factor=1).distances(origin, points)
+        routed = router.distances(origin, points)
+        # Bỏ ô quá gần kho (sai số tương đối lớn) và ô không có đường
+        ratios.extend(r / d for r, d in zip(routed, straight) if d > 0.5 and math.isfinite(r))
+    if not ratios:
+        raise RoutingError("Không có mẫu để hiệu chỉnh")
+    return statistics.median(ratios)
+
+
+def _cells_in_radius(depot):
+    """Các ô (mã, lat, lng) có tâm nằm trong bán kính phục vụ của kho."""
+    radius = depot.service_radius_km
+    dlat = radius / KM_PER_DEG
+    dlng = radius / (KM_PER_DEG * max(math.cos(math.radians(depot.latitude)), 0.01))
+    cells = list(cell_centers(
+        depot.longitude - dlng, depot.latitude - dlat, depot.longitude + dlng, depot.latitude + dlat, CELL_PRECISION,
+    ))
+    if not cells:
+        return []
+    _, lats, lngs = zip(*cells)
+    straight = haversine_km(depot.latitude, depot.longitude, np.array(lats), np.array(lngs))
+    return [cell for cell, km in zip(cells, straight.tolist()) if km <= radius]
+
+
+def build_matrix(router=None) -> int:
+    """
+    Dựng lại toàn bộ ma trận: với mỗi ô trong bán kính của ít nhất một kho đang hoạt động,
+    giữ kho có quãng đường (theo router) ngắn nhất. Ghi thay bảng DeliveryCell trong một transaction.
+    Trả về số ô.
+    """
+    router = router or get_router()
+    best = {}
+    for depot in Depot.objects.filter(is_active=True):
+        cells = _cells_in_radius(depot)
+        distances = router.distances((depot.latitude, depot.longitude), [(lat, lng) for _, lat, lng in cells])
+        for (cell, _, _), km in zip(cells, distances):
+            if math.isfinite(km) and (cell not in best or km < best[cell][1]):
+                best[cell] = (depot.pk, km)
+    with transaction.atomic():
+        DeliveryCell.objects.all().delete()
+        DeliveryCell.objects.bulk_create(
+            [DeliveryCell(cell=cell, depot_id=depot_id, distance_km=round(km, 3)) for cell, (depot_id, km) in best.items()],
+            batch_size=1000,
+        )
+    transaction.on_commit(matrix.invalidate)
+    return len(best)
+
+
+def delivery_fee(distance_km: float) -> Decimal:
+    """Phí giao xe: FEE_PER_KM mỗi km, làm tròn lên FEE_ROUNDING đồng."""
+    fee = Decimal(str(distance_km)) * FEE_PER_KM
+    return (fee / FEE_ROUNDING).to_integral_value(rounding="ROUND_CEILING") * FEE_ROUNDING
+
+
+class DeliveryMatrix:
+    """
+    Ma trận giao xe trong bộ nhớ tiến trình: dict mã ô -> (id kho, tên kho, km), báo giá là
+    một lần tra dict. Nạp lười từ bảng DeliveryCell, nạp lại sau MATRIX_TTL_SECONDS hoặc khi invalidate().
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cells = None
+        self._built_at = 0.0
+
+    def invalidate(self):
+        self._cells = None
+
+    def _build(self) -> dict:
+        names = dict(Depot.objects.values_list("id", "name"))
+        return {
+            cell: (depot_id, names.get(depot_id, ""), km)
+            for cell, depot_id, km in DeliveryCell.objects.values_list("cell", "depot_id", "distance_km")
+        }
+
+    def _current(self) -> dict:
+        cells = self._cells
+        if cells is None or time.monotonic() - self._built_at > MATRIX_TTL_SECONDS:
+            with self._lock:
+                cells = self._cells = self._build()
+                self._built_at = time.monotonic()
+        return cells
+
+    def quote(self, lat: float, lng: float):
+        """Báo giá giao xe tới (lat, lng), None nếu ngoài vùng phục vụ của mọi kho."""
+        cell = geohash(lat, lng, CELL_PRECISION)
+        entry = self._current().get(cell)
+        if entry is None:
+            return None
+        depot_id, depot_name, km = entry
+        return {
+            "depot": {"id": depot_id, "name": depot_name},
+            "distance_km": km,
+            "fee": delivery_fee(km),
+            "cell": cell,
+        }
+
+
+matrix = DeliveryMatrix()
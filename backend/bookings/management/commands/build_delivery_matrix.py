@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from bookings.delivery import RoutingError, build_matrix, calibrate_road_factor, get_router
+
+
+class Command(BaseCommand):
+    help = "Dựng lại ma trận giao xe (ô lưới -> kho gần nhất, quãng đường) từ các kho đang hoạt động. Chạy lại khi thêm/dời kho"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--calibrate", type=int, metavar="N", default=0,
+            help="Chỉ đo hệ số đường đi (router thật / đường chim bay) trên N ô mẫu rồi in ra, không dựng ma trận",
+        )
+
+    def handle(self, *args, **options):
+        router = get_router()
+        try:
+            if options["calibrate"]:
+                factor = calibrate_road_factor(router, options["calibrate"])
+                self.stdout.write(self.style.SUCCESS(f"Hệ số đường đi đo được: {factor:.3f}"))
+                return
+            cells = build_matrix(router)
+        except RoutingError as exc:
+            raise CommandError(str(exc)) from exc
+        self.stdout.write(self.style.SUCCESS(f"Đã dựng ma trận giao xe: {cells} ô."))
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.4 on 2026-10-18 16:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PricingRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('kind', models.CharField(choices=[('holiday', 'Ngày lễ'), ('tet', 'Tết'), ('season', 'Mùa cao điểm')], default='holiday', max_length=20)),
+                ('start_date', models.DateField()),
+                ('end_date', models.DateField()),
+                ('multiplier', models.DecimalField(decimal_places=2, max_digits=4)),
+                ('repeat_yearly', models.BooleanField(default=False)),
+                ('priority', models.IntegerField(default=0)),
+                ('is_active', models.BooleanField(default=True)),
+            ],
+        ),
+    ]
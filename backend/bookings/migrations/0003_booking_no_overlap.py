@@ -0,0 +1,37 @@
+from django.db import migrations
+
+# Chặn trùng lịch ngay trong DB: cùng xe, khoảng ngày (tính cả ngày trả) giao nhau,
+# chỉ xét booking active. Chỉ áp dụng cho PostgreSQL (SQLite dùng khi chạy test local).
+CREATE_SQL = """
+CREATE EXTENSION IF NOT EXISTS btree_gist;
+ALTER TABLE bookings_booking
+    ADD CONSTRAINT booking_no_overlap
+    EXCLUDE USING gist (
+        vehicle_id WITH =,
+        daterange(start_date, end_date, '[]') WITH &&
+    )
+    WHERE (status IN ('pending', 'approved'));
+"""
+
+DROP_SQL = "ALTER TABLE bookings_booking DROP CONSTRAINT IF EXISTS booking_no_overlap;"
+
+
+def add_constraint(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(CREATE_SQL)
+
+
+def drop_constraint(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(DROP_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0002_pricingrule'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_constraint, drop_constraint),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.1.4 on 2026-10-18 17:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0005_booking_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Depot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('latitude', models.FloatField()),
+                ('longitude', models.FloatField()),
+                ('service_radius_km', models.FloatField(default=30)),
+                ('is_active', models.BooleanField(default=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DeliveryCell',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cell', models.CharField(max_length=12, unique=True)),
+                ('distance_km', models.FloatField()),
+                ('depot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cells', to='bookings.depot')),
+            ],
+        ),
+    ]
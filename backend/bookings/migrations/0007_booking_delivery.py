@@ -0,0 +1,28 @@
+# Generated by Django 5.1.4 on 2026-10-18 18:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0006_delivery_matrix'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='booking',
+            name='delivery_fee',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='booking',
+            name='delivery_lat',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='booking',
+            name='delivery_lng',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
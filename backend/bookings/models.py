@@ -38,8 +38,100 @@ class Booking(models.Model):
         default='pending'
     )
 
+    # Giao xe tận nơi (trống = nhận tại kho); phí do server báo giá lúc đặt (bookings/delivery.py), đã gồm trong total_price
+    delivery_lat = models.FloatField(null=True, blank=True)
+    delivery_lng = models.FloatField(null=True, blank=True)
+    delivery_fee = models.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        default=0
+    )
+
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        # Index khớp với các query nóng (kiểm tra bằng EXPLAIN trong bookings/tests.py)
+        indexes = [
+            # is_overlapping / filter_available: vehicle = ? AND status IN (...) AND khoảng ngày
+            models.Index(fields=['vehicle', 'status', 'start_date', 'end_date'], name='booking_vehicle_status_dates'),
+            # my_bookings / order_list: customer = ? ORDER BY id DESC
+            models.Index(fields=['customer', '-id'], name='booking_customer_id_desc'),
+            # admin_stats / admin_dashboard: đếm và doanh thu theo status, theo năm của start_date
+            models.Index(fields=['status', 'start_date'], include=['total_price'], name='booking_status_start'),
+            # admin_dashboard / admin_booking_list: booking mới nhất
+            models.Index(fields=['-created_at'], name='booking_created_desc'),
+        ]
 
     def __str__(self):
         return f"Booking #{self.id} - {self.customer.username}"
 
+
+
+class PricingRule(models.Model):
+    """
+    Quy tắc giá theo ngày (Tết, ngày lễ, mùa cao điểm).
+    Được biên dịch thành lịch hệ số giá trong bookings/pricing.py.
+    """
+
+    KIND_CHOICES = [
+        ('holiday', 'Ngày lễ'),
+        ('tet', 'Tết'),
+        ('season', 'Mùa cao điểm'),
+    ]
+
+    name = models.CharField(max_length=100)
+
+    kind = models.CharField(
+        max_length=20,
+        choices=KIND_CHOICES,
+        default='holiday'
+    )
+
+    # Khoảng áp dụng, tính cả ngày kết thúc
+    start_date = models.DateField()
+    end_date = models.DateField()
+
+    multiplier = models.DecimalField(
+        max_digits=4,
+        decimal_places=2
+    )
+
+    # Lặp lại hằng năm theo cùng ngày dương lịch (VD: 30/4, 2/9)
+    repeat_yearly = models.BooleanField(default=False)
+
+    # Quy tắc priority cao hơn ghi đè quy tắc thấp hơn khi trùng ngày
+    priority = models.IntegerField(default=0)
+
+    is_active = models.BooleanField(default=True)
+
+    def __str__(self):
+        return f"{self.name} (x{self.multiplier})"
+
+
+class Depot(models.Model):
+    """Kho/điểm dịch vụ giao xe tận nơi; phí giao tính từ kho gần nhất (xem bookings/delivery.py)."""
+
+    name = models.CharField(max_length=100)
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+    # Chỉ giao tới các điểm cách kho không quá bán kính này (đường chim bay)
+    service_radius_km = models.FloatField(default=30)
+    is_active = models.BooleanField(default=True)
+
+    def __str__(self):
+        return self.name
+
+
+class DeliveryCell(models.Model):
+    """
+    Ma trận khoảng cách đã tính sẵn: ô lưới geohash -> kho gần nhất theo đường đi và quãng đường (km).
+    Dựng lại bằng lệnh build_delivery_matrix khi thêm/sửa kho.
+    """
+
+    cell = models.CharField(max_length=12, unique=True)
+    depot = models.ForeignKey(Depot, on_delete=models.CASCADE, related_name='cells')
+    distance_km = models.FloatField()
+
+    def __str__(self):
+        return f"{self.cell} -> {self.depot_id} ({self.distance_km:.1f} km)"
@@ -0,0 +1,213 @@
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+import numpy as np
+from django.utils import timezone
+
+# Phụ phí cuối tuần (T7, CN): +20%
+WEEKEND_MULTIPLIER = Decimal("1.20")
+CENT = Decimal("0.01")
+
+# Hệ số giá mỗi ngày lưu dạng số nguyên, đơn vị 1/10000 (cuối tuần x quy tắc giá)
+FACTOR_SCALE = 10000
+# Lịch biên dịch sẵn: từ đầu năm trước tới hết năm hiện tại + CALENDAR_YEARS
+CALENDAR_YEARS = 3
+# Mỗi tiến trình tự biên dịch lại sau khoảng này (các worker khác không nhận được signal)
+CALENDAR_TTL_SECONDS = 300
+
+
+def rental_days(start: date, end: date) -> int:
+    """
+    Số ngày tính tiền của khoảng [start, end): ngày trả xe không tính.
+    Thuê và trả trong cùng ngày vẫn tính 1 ngày; end < start -> 0.
+    """
+    if end < start:
+        return 0
+    return max((end - start).days, 1)
+
+
+def _weekend_days_before(n: int) -> int:
+    """Số ngày T7/CN trong các chỉ số [0, n), với chỉ số % 7 == weekday()."""
+    full_weeks, rest = divmod(n, 7)
+    return full_weeks * 2 + max(rest - 5, 0)
+
+
+def _count_weekend(start: date, days: int) -> int:
+    """Số ngày cuối tuần trong [start, start + days)."""
+    first = start.toordinal() + 6
+    return _weekend_days_before(first + days) - _weekend_days_before(first)
+
+
+def split_days(start: date, end: date) -> tuple:
+    """
+    Đếm (ngày thường, ngày cuối tuần) của khoảng thuê bằng công thức, O(1).
+    toordinal() + 6 là chỉ số ngày có (chỉ số % 7) == weekday().
+    """
+    days = rental_days(start, end)
+    weekend = _count_weekend(start, days)
+    return days - weekend, weekend
+
+
+def _weekend_only_units(start: date, days: int) -> int:
+    """Tổng hệ số (đơn vị FACTOR_SCALE) khi chỉ có phụ phí cuối tuần."""
+    if days <= 0:
+        return 0
+    weekend = _count_weekend(start, days)
+    return (days - weekend) * FACTOR_SCALE + weekend * int(WEEKEND_MULTIPLIER * FACTOR_SCALE)
+
+
+class PricingCalendar:
+    """
+    Lịch hệ số giá theo ngày đã biên dịch sẵn (mảng prefix-sum).
+    Tổng hệ số của một khoảng thuê là hiệu hai phần tử, không cần xét quy tắc từng ngày.
+    """
+
+    def __init__(self, origin: date, daily_units, built_for: date = None):
+        self.origin = origin
+        self.days = len(daily_units)
+        self.prefix = np.concatenate(([0], np.cumsum(daily_units, dtype=np.int64)))
+        self.built_for = built_for
+        self.built_at = time.monotonic()
+
+    def is_stale(self, today: date) -> bool:
+        return self.built_for != today or time.monotonic() - self.built_at > CALENDAR_TTL_SECONDS
+
+    def units(self, start: date, days: int) -> int:
+        """Tổng hệ số của [start, start + days); phần ngoài lịch chỉ tính phụ phí cuối tuần."""
+        if days <= 0:
+            return 0
+        lo = (start - self.origin).days
+        hi = lo + days
+        a, b = min(max(lo, 0), self.days), min(max(hi, 0), self.days)
+        total = int(self.prefix[b] - self.prefix[a])
+        if lo < a:
+            total += _weekend_only_units(start, min(a, hi) - lo)
+        if hi > b:
+            tail = max(lo, b)
+            total += _weekend_only_units(self.origin + timedelta(days=tail), hi - tail)
+        return total
+
+
+def _rule_spans(start: date, end: date, repeat_yearly: bool, years):
+    """Các khoảng [start, end] (inclusive) của một quy tắc, lặp theo từng năm nếu cần."""
+    if not repeat_yearly:
+        yield start, end
+        return
+    length = end - start
+    for year in years:
+        try:
+            s = start.replace(year=year)
+        except ValueError:  # 29/02 ở năm không nhuận
+            s = date(year, 2, 28)
+        yield s, s + length
+
+
+def compile_calendar(rules, today: date) -> PricingCalendar:
+    """
+    Biên dịch quy tắc giá thành mảng hệ số theo ngày.
+    rules: dãy (start_date, end_date, multiplier, repeat_yearly, priority);
+    quy tắc có priority cao hơn ghi đè quy tắc thấp hơn trên cùng ngày,
+    phụ phí cuối tuần nhân thêm lên hệ số của quy tắc.
+    """
+    origin = date(today.year - 1, 1, 1)
+    end = date(today.year + CALENDAR_YEARS + 1, 1, 1)
+    n = (end - origin).days
+
+    weekday = (origin.weekday() + np.arange(n)) % 7
+    base = np.where(weekday >= 5, int(WEEKEND_MULTIPLIER * 100), 100).astype(np.int64)
+    rule_pct = np.full(n, 100, dtype=np.int64)
+
+    years = range(origin.year - 1, end.year)
+    for start, stop, multiplier, repeat_yearly, _priority in sorted(rules, key=lambda r: r[4]):
+        pct = int(Decimal(str(multiplier)) * 100)
+        for s, e in _rule_spans(start, stop, repeat_yearly, years):
+            a = max((s - origin).days, 0)
+            b = min((e - origin).days + 1, n)
+            if a < b:
+                rule_pct[a:b] = pct
+
+    return PricingCalendar(origin, base * rule_pct, built_for=today)
+
+
+_calendar = None
+
+
+def get_calendar() -> PricingCalendar:
+    """Lịch giá của tiến trình hiện tại, biên dịch lại khi bị huỷ hoặc quá hạn."""
+    global _calendar
+    today = timezone.localdate()
+    calendar = _calendar
+    if calendar is None or calendar.is_stale(today):
+        from .models import PricingRule
+        rules = PricingRule.objects.filter(is_active=True).values_list(
+            "start_date", "end_date", "multiplier", "repeat_yearly", "priority"
+        )
+        calendar = _calendar = compile_calendar(list(rules), today)
+    return calendar
+
+
+def invalidate_calendar():
+    """Huỷ lịch giá đã biên dịch (gọi khi quy tắc giá thay đổi)."""
+    global _calendar
+    _calendar = None
+
+
+def factor_units(start: date, end: date) -> int:
+    """Tổng hệ số (đơn vị FACTOR_SCALE) của khoảng thuê."""
+    return get_calendar().units(start, rental_days(start, end))
+
+
+def price_factor(start: date, end: date) -> Decimal:
+    """Hệ số nhân với giá/ngày: tổng hệ số các ngày tính tiền."""
+    return Decimal(factor_units(start, end)) / FACTOR_SCALE
+
+
+def quote(price_per_day, start: date, end: date) -> dict:
+    """
+    Báo giá chi tiết cho một xe: dùng chung cho API, model và trang thanh toán.
+    Mọi số tiền đều là Decimal, làm tròn tới 0.01.
+    """
+    unit = Decimal(str(price_per_day or 0))
+    weekday_count, weekend_count = split_days(start, end)
+    weekend_rate = (unit * WEEKEND_MULTIPLIER).quantize(CENT)
+    weekday_total = (unit * weekday_count).quantize(CENT)
+    weekend_total = (unit * WEEKEND_MULTIPLIER * weekend_count).quantize(CENT)
+    total = (unit * price_factor(start, end)).quantize(CENT)
+    return {
+        "days": weekday_count + weekend_count,
+        "weekday_count": weekday_count,
+        "weekend_count": weekend_count,
+        "unit_price": unit,
+        "weekend_rate": weekend_rate,
+        "weekday_total": weekday_total,
+        "weekend_total": weekend_total,
+        # Phụ phí lễ/Tết/mùa cao điểm theo lịch giá
+        "rule_surcharge": total - weekday_total - weekend_total,
+        "total": total,
+    }
+
+
+def total_price(price_per_day, start: date, end: date) -> Decimal:
+    """Tổng tiền thuê (chưa gồm thuế/phí)."""
+    return quote(price_per_day, start, end)["total"]
+
+
+def batch_totals(prices, ranges) -> np.ndarray:
+    """
+    Tính tổng tiền cho nhiều xe x nhiều khoảng ngày trong một phép tính vector.
+    prices: dãy giá/ngày (Decimal), ranges: dãy (start, end).
+    Trả về ma trận số xu (int64) kích thước (số xe, số khoảng ngày),
+    làm tròn giống hệt quote() (ROUND_HALF_EVEN tới 0.01).
+    """
+    cents = np.rint(np.asarray(prices, dtype=np.float64) * 100).astype(np.int64)
+    factors = np.array([factor_units(s, e) for s, e in ranges], dtype=np.int64)
+    raw = np.outer(cents, factors)
+    q, r = np.divmod(raw, FACTOR_SCALE)
+    half = FACTOR_SCALE // 2
+    return q + ((r > half) | ((r == half) & (q % 2 == 1)))
+
+
+def cents_to_decimal(value) -> Decimal:
+    """Đổi số xu (int) về Decimal 2 chữ số thập phân."""
+    return Decimal(int(value)).scaleb(-2)
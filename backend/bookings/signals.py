@@ -0,0 +1,53 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from vehicles.models import Vehicle
+from .models import Booking, Depot, PricingRule
+from .utils import ACTIVE_STATUSES
+from . import delivery, pricing
+from .availability import index as availability_index
+
+
+@receiver([post_save, post_delete], sender=PricingRule)
+def invalidate_pricing_calendar(sender, **kwargs):
+    """Quy tắc giá thay đổi -> biên dịch lại lịch giá ở lần báo giá tiếp theo."""
+    pricing.invalidate_calendar()
+
+
+@receiver([post_save, post_delete], sender=Depot)
+def reload_delivery_matrix(sender, **kwargs):
+    """Kho đổi tên/bị xoá -> nạp lại ma trận giao xe (thêm/dời kho cần chạy build_delivery_matrix)."""
+    transaction.on_commit(delivery.matrix.invalidate)
+
+
+@receiver(post_save, sender=Booking)
+def update_availability_on_save(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Booking mới hoặc được duyệt (vẫn active, chỉ đổi status) -> bật ngày bận, không query;
+    huỷ/hoàn thành/sửa ngày -> dựng lại hàng của xe.
+    """
+    status_only = update_fields is not None and set(update_fields) == {"status"}
+    if instance.status in ACTIVE_STATUSES and (created or status_only):
+        transaction.on_commit(lambda: availability_index.add_booking(
+            instance.vehicle_id, instance.start_date, instance.end_date
+        ))
+    else:
+        transaction.on_commit(lambda: availability_index.refresh_vehicle(instance.vehicle_id))
+
+
+@receiver(post_delete, sender=Booking)
+def update_availability_on_delete(sender, instance, **kwargs):
+    transaction.on_commit(lambda: availability_index.refresh_vehicle(instance.vehicle_id))
+
+
+@receiver(post_save, sender=Vehicle)
+def invalidate_availability_on_vehicle_created(sender, created, **kwargs):
+    """Thêm xe làm thay đổi số hàng của ma trận -> dựng lại lười."""
+    if created:
+        transaction.on_commit(availability_index.invalidate)
+
+
+@receiver(post_delete, sender=Vehicle)
+def invalidate_availability_on_vehicle_deleted(sender, **kwargs):
+    transaction.on_commit(availability_index.invalidate)
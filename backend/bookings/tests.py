@@ -1,4 +1,766 @@
+from datetime import date, timedelta
+from decimal import Decimal
+
+from unittest import skipUnless
+
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from users.models import User
+from vehicles.models import Vehicle
+from .models import Booking, PricingRule
+from .utils import filter_available, is_overlapping, overlapping_bookings
+from . import pricing
+from .availability import index as availability_index
+
+
+class PricingTest(TestCase):
+    """Test cho bộ tính giá dùng chung (bookings/pricing.py)"""
+
+    def setUp(self):
+        pricing.invalidate_calendar()
+
+    def brute_force_split(self, start, end):
+        """Đếm từng ngày trong [start, end) để đối chiếu"""
+        weekday = weekend = 0
+        cur = start
+        while cur < max(end, start + timedelta(days=1)):
+            if cur.weekday() >= 5:
+                weekend += 1
+            else:
+                weekday += 1
+            cur += timedelta(days=1)
+        return weekday, weekend
+
+    def test_split_days_matches_day_by_day_count(self):
+        """Test công thức O(1) khớp với cách duyệt từng ngày"""
+        base = date(2026, 1, 1)
+        for offset in range(14):
+            start = base + timedelta(days=offset)
+            for length in range(0, 45):
+                end = start + timedelta(days=length)
+                self.assertEqual(
+                    pricing.split_days(start, end),
+                    self.brute_force_split(start, end),
+                )
+
+    def test_same_day_rental_counts_one_day(self):
+        """Test thuê và trả trong ngày vẫn tính 1 ngày"""
+        saturday = date(2026, 1, 3)
+        self.assertEqual(pricing.split_days(saturday, saturday), (0, 1))
+
+    def test_end_before_start_is_free(self):
+        """Test ngày trả trước ngày nhận -> 0 ngày"""
+        self.assertEqual(pricing.rental_days(date(2026, 1, 5), date(2026, 1, 1)), 0)
+        self.assertEqual(pricing.total_price(100, date(2026, 1, 5), date(2026, 1, 1)), Decimal("0.00"))
+
+    def test_quote_applies_weekend_surcharge(self):
+        """Test Thứ 6 -> Thứ 2: 1 ngày thường + 2 ngày cuối tuần"""
+        result = pricing.quote(Decimal("500000"), date(2026, 1, 2), date(2026, 1, 5))
+        self.assertEqual(result["weekday_count"], 1)
+        self.assertEqual(result["weekend_count"], 2)
+        self.assertEqual(result["weekend_rate"], Decimal("600000.00"))
+        self.assertEqual(result["total"], Decimal("1700000.00"))
+
+    def test_long_lease(self):
+        """Test thuê dài hạn 364 ngày = 52 tuần"""
+        result = pricing.quote(Decimal("100"), date(2026, 3, 1), date(2027, 2, 28))
+        self.assertEqual(result["weekend_count"], 104)
+        self.assertEqual(result["total"], Decimal("100") * 260 + Decimal("120") * 104)
+
+
+class PricingCalendarTest(TestCase):
+    """Test cho lịch giá biên dịch từ PricingRule"""
+
+    def setUp(self):
+        pricing.invalidate_calendar()
+
+    def test_rule_multiplies_days_in_range(self):
+        """Test Tết x2 (tính cả ngày kết thúc), cuối tuần trong Tết x2.4"""
+        PricingRule.objects.create(name="Tết", kind="tet", start_date=date(2026, 2, 16), end_date=date(2026, 2, 17), multiplier=Decimal("2.00"))
+        # T7 14/2 -> T4 18/2: T7, CN, T2 (Tết), T3 (Tết)
+        self.assertEqual(pricing.price_factor(date(2026, 2, 14), date(2026, 2, 18)), Decimal("6.4"))
+        result = pricing.quote(Decimal("100"), date(2026, 2, 14), date(2026, 2, 18))
+        self.assertEqual(result["total"], Decimal("640.00"))
+        self.assertEqual(result["rule_surcharge"], Decimal("200.00"))
+
+    def test_repeat_yearly_and_priority(self):
+        """Test quy tắc lặp hằng năm và quy tắc priority cao ghi đè"""
+        PricingRule.objects.create(name="Hè", kind="season", start_date=date(2020, 4, 1), end_date=date(2020, 5, 31), multiplier=Decimal("1.10"), repeat_yearly=True)
+        PricingRule.objects.create(name="30/4", start_date=date(2020, 4, 30), end_date=date(2020, 4, 30), multiplier=Decimal("1.50"), repeat_yearly=True, priority=10)
+        # T4 29/4/2026 -> T6 1/5/2026: 29/4 mùa hè, 30/4 lễ
+        self.assertEqual(pricing.price_factor(date(2026, 4, 29), date(2026, 5, 1)), Decimal("2.6"))
+
+    def test_calendar_invalidated_when_rule_changes(self):
+        """Test sửa/xoá quy tắc làm lịch được biên dịch lại"""
+        start, end = date(2026, 6, 1), date(2026, 6, 2)
+        self.assertEqual(pricing.price_factor(start, end), Decimal("1"))
+        rule = PricingRule.objects.create(name="Cao điểm", start_date=start, end_date=start, multiplier=Decimal("1.30"))
+        self.assertEqual(pricing.price_factor(start, end), Decimal("1.3"))
+        rule.delete()
+        self.assertEqual(pricing.price_factor(start, end), Decimal("1"))
+
+    def test_payment_page_labels_discount(self):
+        """Test quy tắc giảm giá (hệ số < 1) hiển thị là giảm giá, không phải phụ phí"""
+        PricingRule.objects.create(name="Thấp điểm", kind="season", start_date=date(2026, 6, 3), end_date=date(2026, 6, 4), multiplier=Decimal("0.80"))
+        vehicle = Vehicle.objects.create(name="Vios", license_plate="51P-300.01", price_per_day=500000)
+        User.objects.create_user(username="khach", password="testpass123")
+        self.client.login(username="khach", password="testpass123")
+        response = self.client.get(
+            reverse("frontend:vehicle_payment", args=[vehicle.id]), {"pickup_date": "2026-06-03", "return_date": "2026-06-04"}
+        )
+        self.assertLess(response.context["rule_surcharge"], 0)
+        self.assertContains(response, "Giảm giá mùa thấp điểm")
+        self.assertNotContains(response, "Phụ phí lễ, Tết")
+
+    def test_dates_outside_calendar_use_weekend_rule(self):
+        """Test ngày ngoài lịch biên dịch vẫn tính phụ phí cuối tuần"""
+        start = date(2000, 1, 1)
+        for length in (1, 7, 30):
+            end = start + timedelta(days=length)
+            weekday, weekend = pricing.split_days(start, end)
+            self.assertEqual(pricing.price_factor(start, end), weekday + pricing.WEEKEND_MULTIPLIER * weekend)
+
+
+class QuotePricesAPITest(TestCase):
+    """Test cho API báo giá hàng loạt"""
+
+    def setUp(self):
+        pricing.invalidate_calendar()
+        self.cheap = Vehicle.objects.create(name="Wave", license_plate="59A-111.11", price_per_day=Decimal("150000"))
+        self.car = Vehicle.objects.create(name="Vios", license_plate="51H-222.22", vehicle_type="car_4", price_per_day=Decimal("800000.55"))
+
+    def test_quote_matches_single_vehicle_pricing(self):
+        """Test tổng tiền hàng loạt khớp với pricing.total_price"""
+        response = self.client.get(reverse("bookings:quote_prices"), {
+            "start_date": "2026-01-02",
+            "end_date": "2026-01-05",
+            "range": "2026-01-01:2026-01-31",
+        })
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([r["days"] for r in data["ranges"]], [3, 30])
+        for item in data["quotes"]:
+            vehicle = Vehicle.objects.get(pk=item["vehicle_id"])
+            self.assertEqual(item["totals"], [
+                str(pricing.total_price(vehicle.price_per_day, date(2026, 1, 2), date(2026, 1, 5))),
+                str(pricing.total_price(vehicle.price_per_day, date(2026, 1, 1), date(2026, 1, 31))),
+            ])
+
+    def test_quote_filters(self):
+        """Test lọc theo ids và loại xe"""
+        url = reverse("bookings:quote_prices")
+        data = self.client.get(url, {"start_date": "2026-01-01", "end_date": "2026-01-02", "ids": str(self.cheap.pk)}).json()
+        self.assertEqual([q["vehicle_id"] for q in data["quotes"]], [self.cheap.pk])
+        data = self.client.get(url, {"start_date": "2026-01-01", "end_date": "2026-01-02", "vehicle_type": "car_4"}).json()
+        self.assertEqual([q["vehicle_id"] for q in data["quotes"]], [self.car.pk])
+
+    def test_quote_invalid_range(self):
+        """Test khoảng ngày sai -> 400"""
+        url = reverse("bookings:quote_prices")
+        self.assertEqual(self.client.get(url).status_code, 400)
+        self.assertEqual(self.client.get(url, {"start_date": "2026-01-05", "end_date": "2026-01-01"}).status_code, 400)
+        self.assertEqual(self.client.get(url, {"range": "abc"}).status_code, 400)
+
+
+class AvailabilityFilterTest(TestCase):
+    """Test cho lọc xe trống lịch bằng NOT EXISTS"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="khach", password="testpass123")
+        self.busy = Vehicle.objects.create(name="Xe A", license_plate="51A-000.01", price_per_day=300000)
+        self.free = Vehicle.objects.create(name="Xe B", license_plate="51A-000.02", price_per_day=900000)
+        self.cancelled = Vehicle.objects.create(name="Xe C", license_plate="51A-000.03", price_per_day=500000)
+        Booking.objects.create(customer=self.user, vehicle=self.busy, start_date=date(2026, 3, 10), end_date=date(2026, 3, 12), total_price=0)
+        Booking.objects.create(customer=self.user, vehicle=self.cancelled, start_date=date(2026, 3, 10), end_date=date(2026, 3, 12), total_price=0, status="cancelled")
+
+    def test_filter_matches_is_overlapping(self):
+        """Test kết quả giống với gọi is_overlapping từng xe"""
+        for start, end in [(date(2026, 3, 1), date(2026, 3, 9)), (date(2026, 3, 12), date(2026, 3, 15)), (date(2026, 3, 11), date(2026, 3, 11))]:
+            expected = {v.pk for v in Vehicle.objects.all() if not is_overlapping(v, start, end)}
+            self.assertEqual(set(filter_available(Vehicle.objects.all(), start, end).values_list("pk", flat=True)), expected)
+
+    def test_list_api_date_range(self):
+        """Test API danh sách xe nhận start_date/end_date, ghép với lọc giá"""
+        url = reverse("vehicles:vehicle_list_api")
+        # validators ETag (xe + booking) + COUNT của Paginator + trang dữ liệu
+        with self.assertNumQueries(4):
+            data = self.client.get(url, {"start_date": "2026-03-11", "end_date": "2026-03-14"}).json()
+        self.assertEqual({v["id"] for v in data["vehicles"]}, {self.free.pk, self.cancelled.pk})
+        data = self.client.get(url, {"start_date": "2026-03-11", "end_date": "2026-03-14", "max_price": 600000}).json()
+        self.assertEqual([v["id"] for v in data["vehicles"]], [self.cancelled.pk])
+        self.assertEqual(self.client.get(url, {"start_date": "2026-03-11"}).status_code, 400)
+
+
+class AvailabilityIndexTest(TestCase):
+    """Test cho chỉ mục lịch trống trong bộ nhớ"""
+
+    def setUp(self):
+        availability_index.invalidate()
+        self.today = timezone.localdate()
+        self.user = User.objects.create_user(username="khach", password="testpass123")
+        self.vehicles = [
+            Vehicle.objects.create(name=f"Xe {i}", license_plate=f"51B-000.0{i}", price_per_day=300000)
+            for i in range(4)
+        ]
+        self.booking = Booking.objects.create(
+            customer=self.user, vehicle=self.vehicles[0], total_price=0,
+            start_date=self.today + timedelta(days=3), end_date=self.today + timedelta(days=5),
+        )
+        Booking.objects.create(
+            customer=self.user, vehicle=self.vehicles[1], total_price=0,
+            start_date=self.today - timedelta(days=2), end_date=self.today + timedelta(days=1),
+        )
+
+    def assert_matches_database(self):
+        for a, b in [(0, 0), (0, 3), (2, 2), (5, 9), (6, 30)]:
+            start, end = self.today + timedelta(days=a), self.today + timedelta(days=b)
+            expected = list(filter_available(Vehicle.objects.order_by("id"), start, end).values_list("id", flat=True))
+            self.assertEqual(availability_index.free_vehicle_ids(start, end), expected)
+
+    def test_matches_database_query(self):
+        """Test kết quả khớp với query NOT EXISTS"""
+        self.assert_matches_database()
+
+    def test_incremental_updates(self):
+        """Test tạo/duyệt/huỷ booking cập nhật chỉ mục mà không dựng lại"""
+        availability_index.free_vehicle_ids(self.today, self.today)
+        snapshot = availability_index._snapshot
+        with self.captureOnCommitCallbacks(execute=True):
+            Booking.objects.create(
+                customer=self.user, vehicle=self.vehicles[2], total_price=0,
+                start_date=self.today + timedelta(days=8), end_date=self.today + timedelta(days=8),
+            )
+        self.assert_matches_database()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.booking.status = "approved"
+            self.booking.save(update_fields=["status"])
+        self.assert_matches_database()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.booking.status = "cancelled"
+            self.booking.save(update_fields=["status"])
+        self.assert_matches_database()
+        self.assertIs(availability_index._snapshot, snapshot)
+
+    def test_api_hot_path_skips_database(self):
+        """Test API trả lời từ bộ nhớ, không query DB sau khi đã dựng chỉ mục"""
+        url = reverse("bookings:free_vehicles")
+        params = {"start_date": str(self.today + timedelta(days=4)), "end_date": str(self.today + timedelta(days=6))}
+        self.client.get(url, params)
+        with self.assertNumQueries(0):
+            data = self.client.get(url, params).json()
+        self.assertEqual(data["source"], "memory")
+        self.assertNotIn(self.vehicles[0].pk, data["vehicle_ids"])
+        far = {"start_date": str(self.today + timedelta(days=400)), "end_date": str(self.today + timedelta(days=401))}
+        self.assertEqual(self.client.get(url, far).json()["source"], "database")
+
+
+    def test_expired_index_rebuilt_once_under_concurrency(self):
+        """Test chỉ mục hết hạn: các request đồng thời chờ lock rồi dùng bản vừa dựng, chỉ dựng lại một lần"""
+        import threading
+        import time
+        from unittest import mock
+
+        import numpy as np
+
+        from .availability import AvailabilityIndex, _Snapshot
+
+        availability = AvailabilityIndex()
+        builds = []
+
+        def slow_build(today):
+            builds.append(today)
+            time.sleep(0.1)
+            return _Snapshot(today, np.array([], dtype=np.int64), np.zeros((0, 1), dtype=bool))
+
+        with mock.patch.object(availability, "_build", side_effect=slow_build):
+            threads = [threading.Thread(target=availability._current) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len(builds), 1)
+
+class CreateBookingAPITest(TestCase):
+    """Test cho API tạo booking chống trùng lịch"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="khach", password="testpass123")
+        self.vehicle = Vehicle.objects.create(name="Vios", license_plate="51H-333.33", price_per_day=Decimal("800000"))
+        self.client.login(username="khach", password="testpass123")
+        self.url = reverse("bookings:create_booking")
+
+    def post(self, start, end):
+        return self.client.post(self.url, {"vehicle_id": self.vehicle.pk, "start_date": start, "end_date": end}, content_type="application/json")
+
+    def test_create_and_reject_overlap(self):
+        """Test tạo booking rồi từ chối booking trùng lịch với 400"""
+        response = self.post("2026-05-04", "2026-05-06")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()["total_price"], "1600000.00")
+
+        response = self.post("2026-05-06", "2026-05-08")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["detail"], "Xe bị trùng lịch")
+        self.assertEqual(Booking.objects.count(), 1)
+
+    def test_cancelled_booking_does_not_block(self):
+        """Test booking đã huỷ không chặn lịch"""
+        self.assertEqual(self.post("2026-05-04", "2026-05-06").status_code, 201)
+        Booking.objects.update(status="cancelled")
+        self.assertEqual(self.post("2026-05-04", "2026-05-06").status_code, 201)
+
+
+class KeysetPaginationTest(TestCase):
+    """Test cho phân trang cursor của API danh sách xe và booking"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="khach", password="testpass123")
+        for i in range(20):
+            # Giá và tên trùng nhau để kiểm tra khoá phụ id
+            vehicle = Vehicle.objects.create(name=f"Xe {i % 7}", license_plate=f"51C-{i:03d}.00", price_per_day=100000 * (i % 4 + 1))
+            Booking.objects.create(customer=self.user, vehicle=vehicle, start_date=date(2026, 1, 1), end_date=date(2026, 1, 1), total_price=0, status="completed")
+
+    def walk(self, url, params, key):
+        items, cursor, pages = [], "", 0
+        while True:
+            response = self.client.get(url, {**params, "cursor": cursor})
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            items += [item["id"] for item in data[key]]
+            pages += 1
+            cursor = data["pagination"]["next_cursor"]
+            if not cursor:
+                return items, pages
+
+    def test_vehicle_cursor_walk_matches_ordering(self):
+        """Test duyệt hết các trang cursor ra đúng thứ tự, không trùng/thiếu"""
+        url = reverse("vehicles:vehicle_list_api")
+        orderings = {
+            "name": ["name", "id"],
+            "price_asc": ["price_per_day", "id"],
+            "price_desc": ["-price_per_day", "-id"],
+        }
+        for sort, ordering in orderings.items():
+            expected = list(Vehicle.objects.order_by(*ordering).values_list("id", flat=True))
+            items, pages = self.walk(url, {"sort": sort}, "vehicles")
+            self.assertEqual(items, expected, sort)
+            self.assertEqual(pages, 3)
+        items, _ = self.walk(url, {"sort": "rating"}, "vehicles")
+        self.assertEqual(sorted(items), sorted(expected))
+
+    def test_cursor_mode_skips_count(self):
+        """Test chế độ cursor chỉ chạy một query, đếm tổng khi có ?count=1"""
+        url = reverse("vehicles:vehicle_list_api")
+        with self.assertNumQueries(2):  # validators ETag (một lần cho mọi trang) + trang dữ liệu
+            data = self.client.get(url, {"cursor": ""}).json()
+        self.assertNotIn("total", data["pagination"])
+        with self.assertNumQueries(1):
+            self.client.get(url, {"cursor": data["pagination"]["next_cursor"]})
+        data = self.client.get(url, {"cursor": "", "count": "1"}).json()
+        self.assertEqual(data["pagination"]["total"], 20)
+        self.assertEqual(self.client.get(url, {"cursor": "khong-hop-le"}).status_code, 400)
+        # Cursor giải mã được nhưng giá trị sai kiểu trường sắp xếp -> 400, không phải 500
+        from vehicles.pagination import encode_cursor
+
+        for sort, values in [("price_asc", ["abc", 1]), ("price_asc", [100, "x"]), ("name", [None, 1]), ("rating", [[1], 1])]:
+            response = self.client.get(url, {"cursor": encode_cursor(values), "sort": sort})
+            self.assertEqual(response.status_code, 400, (sort, values))
+
+    def test_my_bookings_cursor(self):
+        """Test API booking của tôi: cursor theo -id, mặc định vẫn trả về danh sách"""
+        self.client.login(username="khach", password="testpass123")
+        url = reverse("bookings:my_bookings")
+        expected = list(Booking.objects.order_by("-id").values_list("id", flat=True))
+        self.assertEqual([b["id"] for b in self.client.get(url).json()], expected)
+        items, pages = self.walk(url, {}, "bookings")
+        self.assertEqual(items, expected)
+        self.assertEqual(pages, 1)
+
+
+class ConditionalGetTest(TestCase):
+    """Test cho ETag/Last-Modified của API xe và booking"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="khach", password="testpass123")
+        self.vehicle = Vehicle.objects.create(name="Vios", license_plate="51L-000.01", price_per_day=500000)
+
+    def test_list_304_and_change(self):
+        """Test If-None-Match khớp -> 304 rỗng; sửa xe -> ETag mới"""
+        url = reverse("vehicles:vehicle_list_api")
+        first = self.client.get(url, {"sort": "name"})
+        etag = first["ETag"]
+        self.assertIn("Last-Modified", first)
+        not_modified = self.client.get(url, {"sort": "name"}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.content, b"")
+        self.assertNotEqual(self.client.get(url, {"sort": "price_asc"})["ETag"], etag)
+
+        self.vehicle.price_per_day = 550000
+        self.vehicle.save()
+        response = self.client.get(url, {"sort": "name"}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(self.client.get(url, {"start_date": "x"}).status_code, 400)
+
+    def test_detail_changes_with_review(self):
+        """Test ETag chi tiết đổi khi có đánh giá mới; If-Modified-Since -> 304"""
+        from reviews.models import Review
+
+        url = reverse("vehicles:vehicle_detail_api", kwargs={"pk": self.vehicle.pk})
+        first = self.client.get(url)
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=first["Last-Modified"]).status_code, 304)
+        Review.objects.create(vehicle=self.vehicle, user=self.user, rating=4)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=first["ETag"]).status_code, 200)
+        self.assertEqual(self.client.get(reverse("vehicles:vehicle_detail_api", kwargs={"pk": 999})).status_code, 404)
+
+    def test_my_bookings_per_user(self):
+        """Test ETag booking của tôi đổi theo trạng thái booking và theo người dùng"""
+        booking = Booking.objects.create(customer=self.user, vehicle=self.vehicle, start_date=date(2026, 1, 1), end_date=date(2026, 1, 2), total_price=0)
+        url = reverse("bookings:my_bookings")
+        self.client.login(username="khach", password="testpass123")
+        etag = self.client.get(url)["ETag"]
+        with self.assertNumQueries(3):  # session, user, validators
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        booking.status = "approved"
+        booking.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        User.objects.create_user(username="khach2", password="testpass123")
+        self.client.login(username="khach2", password="testpass123")
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+@skipUnless(connection.vendor == "postgresql", "EXPLAIN plan chỉ kiểm tra trên PostgreSQL")
+class IndexPlanTest(TestCase):
+    """Test các query nóng dùng đúng index trên dữ liệu mẫu (chống hồi quy plan)"""
+
+    @classmethod
+    def setUpTestData(cls):
+        users = User.objects.bulk_create([User(username=f"khach{i}") for i in range(1000)])
+        statuses = ["booked"] * 19 + ["available"]
+        vehicles = Vehicle.objects.bulk_create([
+            Vehicle(
+                name=f"Xe {i}", license_plate=f"51P-{i:05d}", price_per_day=100000 + i * 100,
+                vehicle_type=["bike", "car_4", "car_7"][i % 3], status=statuses[i % 20],
+                latitude=10 + (i % 100) / 100 if i % 4 else None, longitude=106 + (i // 100) / 100 if i % 4 else None,
+            )
+            for i in range(2000)
+        ])
+        booking_statuses = ["pending", "approved", "cancelled", "completed", "completed"]
+        base = date(2025, 1, 1)
+        Booking.objects.bulk_create([
+            Booking(
+                customer=users[i % 1000], vehicle=vehicles[i % 2000],
+                # Mỗi xe 10 booking cách nhau 10 ngày: không vi phạm ràng buộc chống trùng lịch
+                start_date=base + timedelta(days=(i // 2000) * 10 + i % 7),
+                end_date=base + timedelta(days=(i // 2000) * 10 + i % 7 + 3),
+                total_price=100000, status=booking_statuses[i % 5],
+            )
+            for i in range(20000)
+        ])
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+        cls.vehicle = vehicles[7]
+        cls.customer = users[3]
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan, plan)
+
+    def test_overlap_check(self):
+        """Test is_overlapping / filter_available: index (vehicle, status, start_date, end_date)"""
+        qs = overlapping_bookings(date(2025, 6, 1), date(2025, 6, 5)).filter(vehicle=self.vehicle)
+        self.assertUsesIndex(qs, "booking_vehicle_status_dates")
+
+    def test_customer_bookings(self):
+        """Test my_bookings / order_list: index (customer, -id)"""
+        qs = Booking.objects.filter(customer=self.customer).order_by("-id")[:20]
+        self.assertUsesIndex(qs, "booking_customer_id_desc")
+
+    def test_admin_stats(self):
+        """Test doanh thu theo năm của admin_stats: index (status, start_date)"""
+        qs = Booking.objects.filter(status="pending", start_date__year=2025).values("status")
+        self.assertUsesIndex(qs, "booking_status_start")
+
+    def test_recent_bookings(self):
+        """Test booking mới nhất ở dashboard: index (-created_at)"""
+        self.assertUsesIndex(Booking.objects.order_by("-created_at")[:10], "booking_created_desc")
+
+    def test_available_vehicles_by_price(self):
+        """Test danh sách xe còn trống sắp theo giá: partial index"""
+        qs = Vehicle.objects.filter(status__in=Vehicle.STATUS_ALIASES["available"]).order_by("price_per_day")[:9]
+        self.assertUsesIndex(qs, "vehicle_available_price")
+
+    def test_map_bbox(self):
+        """Test lọc xe trong khung bản đồ: partial index toạ độ"""
+        qs = Vehicle.objects.filter(
+            latitude__isnull=False, longitude__isnull=False,
+            latitude__range=(10.10, 10.12), longitude__range=(106.0, 106.05),
+        )
+        self.assertUsesIndex(qs, "vehicle_located_lat_lng")
+
+
+class DeliveryQuoteTest(TestCase):
+    """Test cho báo giá giao xe từ ma trận kho -> ô lưới dựng sẵn"""
+
+    def setUp(self):
+        from .delivery import matrix
+        from .models import Depot
+
+        self.central = Depot.objects.create(name="Quận 1", latitude=10.7769, longitude=106.7009, service_radius_km=6)
+        self.east = Depot.objects.create(name="Thủ Đức", latitude=10.8500, longitude=106.7700, service_radius_km=6)
+        self.matrix = matrix
+        self.addCleanup(matrix.invalidate)
+
+    def build(self, router=None):
+        from .delivery import build_matrix
+
+        with self.captureOnCommitCallbacks(execute=True):
+            return build_matrix(router)
+
+    def test_quote_picks_nearest_depot(self):
+        """Test mỗi ô được gán kho gần nhất; phí = km x FEE_PER_KM làm tròn lên 1.000đ"""
+        from .delivery import FEE_PER_KM, ROAD_FACTOR, delivery_fee
+        from vehicles.nearby import haversine_km
+
+        self.assertGreater(self.build(), 0)
+        near_central = self.matrix.quote(10.7800, 106.7050)
+        near_east = self.matrix.quote(10.8450, 106.7650)
+        self.assertEqual(near_central["depot"]["id"], self.central.id)
+        self.assertEqual(near_east["depot"]["id"], self.east.id)
+
+        # Khoảng cách tính tới tâm ô (geohash 6 ký tự), lệch điểm thật không quá ~1km
+        straight = float(haversine_km(self.central.latitude, self.central.longitude, 10.7800, 106.7050))
+        self.assertAlmostEqual(near_central["distance_km"], straight * ROAD_FACTOR, delta=1.0)
+        self.assertEqual(delivery_fee(1.2345), Decimal("38000"))
+        self.assertEqual(delivery_fee(2), 2 * FEE_PER_KM)
+        self.assertEqual(near_central["fee"], delivery_fee(near_central["distance_km"]))
+
+    def test_api_and_zero_queries_when_warm(self):
+        """Test API trả phí dạng chuỗi; khi ma trận đã nạp, báo giá không chạm DB; ngoài vùng 404; sai 400"""
+        self.build()
+        url = reverse("bookings:delivery_quote")
+        self.client.get(url, {"to": "10.7800,106.7050"})
+        with self.assertNumQueries(0):
+            response = self.client.get(url, {"to": "10.7800,106.7050"})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["depot"], {"id": self.central.id, "name": "Quận 1"})
+        self.assertEqual(Decimal(data["fee"]), self.matrix.quote(10.7800, 106.7050)["fee"])
+
+        self.assertEqual(self.client.get(url, {"to": "21.0285,105.8542"}).status_code, 404)
+        self.assertEqual(self.client.get(url, {"to": "abc"}).status_code, 400)
+        self.assertEqual(self.client.get(url).status_code, 400)
+
+    def test_pluggable_router_and_calibration(self):
+        """Test build_matrix dùng router truyền vào; calibrate_road_factor đo lại hệ số của router"""
+        from .delivery import HaversineRouter, calibrate_road_factor
+
+        self.assertAlmostEqual(calibrate_road_factor(HaversineRouter(road_factor=1.5), samples=50), 1.5)
+        self.build(HaversineRouter(road_factor=2))
+        doubled = self.matrix.quote(10.7800, 106.7050)["distance_km"]
+        self.build(HaversineRouter(road_factor=1))
+        self.assertAlmostEqual(doubled, 2 * self.matrix.quote(10.7800, 106.7050)["distance_km"], places=2)
+
+    def test_depot_change_reloads_matrix(self):
+        """Test sửa kho làm ma trận trong bộ nhớ nạp lại (sau commit)"""
+        self.build()
+        self.assertEqual(self.matrix.quote(10.7800, 106.7050)["depot"]["name"], "Quận 1")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.central.name = "Bến Thành"
+            self.central.save()
+        self.assertEqual(self.matrix.quote(10.7800, 106.7050)["depot"]["name"], "Bến Thành")
+
+    def test_payment_total_includes_delivery_fee(self):
+        """Test trang thanh toán cộng phí giao xe do server tính; điểm ngoài vùng không tính phí"""
+        self.build()
+        vehicle = Vehicle.objects.create(name="Vios", license_plate="51P-100.01", price_per_day=500000)
+        User.objects.create_user(username="khach", password="testpass123")
+        self.client.login(username="khach", password="testpass123")
+        url = reverse("frontend:vehicle_payment", args=[vehicle.id])
+        dates = {"pickup_date": "2026-06-03", "return_date": "2026-06-04"}
+
+        without = self.client.get(url, dates).context["final_total"]
+        response = self.client.get(url, {**dates, "delivery": "10.7800,106.7050"})
+        fee = self.matrix.quote(10.7800, 106.7050)["fee"]
+        self.assertEqual(response.context["delivery_fee"], fee)
+        self.assertEqual(response.context["final_total"], without + fee)
+
+        response = self.client.post(url, {**dates, "delivery": "10.7800,106.7050", "payment_method": "credit_card"})
+        self.assertEqual(response.status_code, 302)
+        booking = Booking.objects.get(vehicle=vehicle)
+        self.assertEqual(booking.total_price, without + fee)
+        self.assertEqual((booking.delivery_lat, booking.delivery_lng, booking.delivery_fee), (10.78, 106.705, fee))
+
+        outside = self.client.get(url, {**dates, "delivery": "21.0285,105.8542"})
+        self.assertEqual(outside.context["delivery_fee"], 0)
+        self.assertEqual(outside.context["final_total"], without)
+
+    def test_payment_without_quote_does_not_book(self):
+        """Test xác nhận thanh toán với điểm giao ngoài vùng: hiển thị lại trang (nhận tại kho), không đặt xe"""
+        self.build()
+        vehicle = Vehicle.objects.create(name="Vios", license_plate="51P-100.02", price_per_day=500000)
+        User.objects.create_user(username="khach", password="testpass123")
+        self.client.login(username="khach", password="testpass123")
+        url = reverse("frontend:vehicle_payment", args=[vehicle.id])
+        dates = {"pickup_date": "2026-06-03", "return_date": "2026-06-04"}
+
+        for delivery in ("21.0285,105.8542", "abc"):
+            response = self.client.post(url, {**dates, "delivery": delivery, "payment_method": "credit_card"})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.context["delivery"], "")
+            self.assertEqual(response.context["delivery_fee"], 0)
+            self.assertFalse(Booking.objects.filter(vehicle=vehicle).exists())
+
+        # Khách xác nhận lại (không giao xe) -> đặt, nhận tại kho
+        self.assertEqual(self.client.post(url, {**dates, "delivery": "", "payment_method": "credit_card"}).status_code, 302)
+        booking = Booking.objects.get(vehicle=vehicle)
+        self.assertEqual((booking.delivery_lat, booking.delivery_lng, booking.delivery_fee), (None, None, 0))
+
+
+class BulkTransitionTest(TestCase):
+    """Test cho API chuyển trạng thái nhiều booking trong một transaction"""
+
+    def setUp(self):
+        availability_index.invalidate()
+        self.today = timezone.localdate()
+        self.admin = User.objects.create_user(username="admin", password="testpass123", is_staff=True)
+        self.customer = User.objects.create_user(username="khach", password="testpass123")
+        self.vehicles = [
+            Vehicle.objects.create(name=f"Xe {i}", license_plate=f"51C-000.0{i}", price_per_day=300000, status="available")
+            for i in range(6)
+        ]
+        self.url = reverse("bookings:bulk_transition")
+        self.client.login(username="admin", password="testpass123")
+
+    def book(self, vehicle, status="pending", offset=0):
+        start = self.today + timedelta(days=offset)
+        return Booking.objects.create(
+            customer=self.customer, vehicle=vehicle, start_date=start, end_date=start + timedelta(days=1),
+            total_price=0, status=status,
+        )
+
+    def post(self, ids, status):
+        return self.client.post(self.url, {"ids": ids, "status": status}, content_type="application/json")
+
+    def test_per_id_results_and_constant_queries(self):
+        """Test kết quả từng id (chuyển được / sai trạng thái / không tồn tại); số query không tăng theo số booking"""
+        done = self.book(self.vehicles[0], status="completed")
+        small = [self.book(v).id for v in self.vehicles[1:3]]
+        large = [self.book(v, offset=5).id for v in self.vehicles]
+
+        with self.captureOnCommitCallbacks():
+            response = self.post([*small, done.id, 999999], "approved")
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["updated"], 2)
+        self.assertEqual(
+            [(r["id"], r["ok"], r["status"]) for r in data["results"]],
+            [(small[0], True, "approved"), (small[1], True, "approved"), (done.id, False, "completed"), (999999, False, None)],
+        )
+        self.assertEqual(set(Booking.objects.filter(pk__in=small).values_list("status", flat=True)), {"approved"})
+        self.assertEqual(Vehicle.objects.get(pk=self.vehicles[1].pk).status, "rented")
+
+        from django.db import connection as db_connection
+        from django.test.utils import CaptureQueriesContext
+
+        with CaptureQueriesContext(db_connection) as few, self.captureOnCommitCallbacks():
+            self.post(small, "cancelled")
+        with CaptureQueriesContext(db_connection) as many, self.captureOnCommitCallbacks():
+            self.post(large, "cancelled")
+        self.assertEqual(len(few), len(many))
+        # Gửi lại: đã huỷ hết, không id nào chuyển được nữa
+        self.assertEqual(self.post(large, "cancelled").json()["updated"], 0)
+
+    def test_complete_updates_vehicles_stats_and_index(self):
+        """Test hoàn thành hàng loạt: trả xe, cộng số chuyến, lịch trống và bản đồ trực tiếp được làm mới sau commit"""
+        from vehicles.cache import fleet_version
+        from vehicles.live import hub
+
+        bookings = [self.book(v, status="approved") for v in self.vehicles[:3]]
+        second = self.book(self.vehicles[0], status="approved", offset=3)
+        Vehicle.objects.update(status="rented")
+        availability_index.free_vehicle_ids(self.today, self.today)
+        self.assertNotIn(self.vehicles[1].pk, availability_index.free_vehicle_ids(self.today, self.today))
+        version, last_event = fleet_version(), hub.last_id
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.post([b.id for b in bookings], "completed")
+        self.assertEqual(response.json()["updated"], 3)
+        statuses = dict(Vehicle.objects.values_list("pk", "status"))
+        # Xe 0 còn booking approved khác -> vẫn đang thuê
+        self.assertEqual(statuses[self.vehicles[0].pk], "rented")
+        self.assertEqual(statuses[self.vehicles[1].pk], "available")
+        self.assertEqual(statuses[self.vehicles[2].pk], "available")
+        self.assertEqual(list(Vehicle.objects.filter(pk__in=[v.pk for v in self.vehicles[:3]]).values_list("trip_count", flat=True)), [1, 1, 1])
+        self.assertIn(self.vehicles[1].pk, availability_index.free_vehicle_ids(self.today, self.today))
+        self.assertNotEqual(fleet_version(), version)
+        events = [event for event in hub.since(last_event)[0] if event[1] == "vehicle"]
+        self.assertEqual(sorted(data["id"] for _, _, data in events), sorted(v.pk for v in self.vehicles[:3]))
+        second.refresh_from_db()
+        self.assertEqual(second.status, "approved")
+
+    def test_vehicle_status_guard(self):
+        """Test xe đang bảo dưỡng giữ nguyên trạng thái khi huỷ / hoàn thành booking của nó; không duyệt booking của xe đó"""
+        pending = self.book(self.vehicles[0])
+        approved = self.book(self.vehicles[1], status="approved")
+        finished = self.book(self.vehicles[2], status="approved")
+        Vehicle.objects.filter(pk__in=[v.pk for v in self.vehicles[:3]]).update(status="maintenance")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            data = self.post([pending.id], "approved").json()
+            self.assertEqual(data["updated"], 0)
+            self.assertEqual(
+                data["results"],
+                [{"id": pending.id, "ok": False, "status": "pending", "detail": "Xe không sẵn sàng (đang maintenance)"}],
+            )
+            self.assertEqual(self.post([approved.id], "cancelled").json()["updated"], 1)
+            self.assertEqual(self.post([finished.id], "completed").json()["updated"], 1)
+        self.assertEqual(
+            set(Vehicle.objects.filter(pk__in=[v.pk for v in self.vehicles[:3]]).values_list("status", flat=True)),
+            {"maintenance"},
+        )
+
+        # Mã cũ vẫn được chuyển: 'Available' -> rented
+        other = self.book(self.vehicles[3])
+        Vehicle.objects.filter(pk=self.vehicles[3].pk).update(status="Available")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post([other.id], "approved")
+        self.assertEqual(Vehicle.objects.get(pk=self.vehicles[3].pk).status, "rented")
+
+    def test_validation_and_permissions(self):
+        """Test trạng thái đích/body sai -> 400; người không phải admin bị chặn"""
+        booking = self.book(self.vehicles[0])
+        self.assertEqual(self.post([booking.id], "pending").status_code, 400)
+        self.assertEqual(self.post([], "approved").status_code, 400)
+        self.assertEqual(self.post(["x"], "approved").status_code, 400)
+        self.assertEqual(self.post([booking.id], ["approved"]).status_code, 400)
+        # ids phải là danh sách: chuỗi "123" không bị tách thành 1, 2, 3
+        self.assertEqual(self.post(str(booking.id), "approved").status_code, 400)
+        self.assertEqual(self.client.post(self.url, {"ids": booking.id, "status": "approved"}).status_code, 415)
+
+        from django.test import Client
+
+        csrf_client = Client(enforce_csrf_checks=True)
+        csrf_client.login(username="admin", password="testpass123")
+        response = csrf_client.post(self.url, {"ids": [booking.id], "status": "approved"}, content_type="application/json")
+        self.assertEqual(response.status_code, 403)
 
-# Create your tests here.
+        self.client.login(username="khach", password="testpass123")
+        self.assertNotEqual(self.post([booking.id], "approved").status_code, 200)
+        booking.refresh_from_db()
+        self.assertEqual(booking.status, "pending")
 
+    def test_customer_can_cancel_own_booking(self):
+        """Test khách tự huỷ booking của mình qua API huỷ từng booking"""
+        booking = self.book(self.vehicles[0])
+        self.client.login(username="khach", password="testpass123")
+        response = self.client.post(reverse("bookings:cancel_booking", args=[booking.id]))
+        self.assertEqual(response.status_code, 200)
+        booking.refresh_from_db()
+        self.assertEqual(booking.status, "cancelled")
@@ -0,0 +1,115 @@
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from vehicles import live
+from vehicles.cache import bump_fleet_version
+from vehicles.models import Vehicle
+from vehicles.stats import record_trips
+
+from .availability import index as availability_index
+from .models import Booking
+
+# Mã trạng thái xe khi booking được duyệt / khi trả xe (giống các API duyệt/huỷ/hoàn thành từng booking)
+VEHICLE_BOOKED = "rented"
+VEHICLE_AVAILABLE = "available"
+
+# Trạng thái xe được đổi khi trả xe (kể cả mã cũ); xe đang bảo dưỡng không bị đụng tới
+_VEHICLE_IN_RENTAL = Vehicle.STATUS_ALIASES["booked"] + Vehicle.STATUS_ALIASES["in_use"]
+
+# Trạng thái đích -> (các trạng thái booking được phép chuyển từ đó,
+#                     các trạng thái xe được phép đổi, trạng thái xe sau khi chuyển)
+TRANSITIONS = {
+    "approved": (("pending",), Vehicle.STATUS_ALIASES["available"], VEHICLE_BOOKED),
+    "completed": (("approved",), _VEHICLE_IN_RENTAL, VEHICLE_AVAILABLE),
+    "cancelled": (("pending", "approved"), _VEHICLE_IN_RENTAL, VEHICLE_AVAILABLE),
+}
+# Số booking tối đa trong một lần chuyển hàng loạt
+MAX_BULK_IDS = 500
+
+
+def complete_booking(booking) -> bool:
+    """
+    Hoàn thành một booking approved qua bulk_transition: UPDATE có điều kiện (WHERE status = 'approved')
+    nên hai request hoàn thành cùng lúc thì chỉ request đổi được dòng mới cộng chuyến; xe chỉ được trả về
+    available khi đang cho thuê và không còn booking approved nào khác (xe bảo dưỡng giữ nguyên).
+    Trả về False nếu booking không còn ở trạng thái approved.
+    """
+    if not bulk_transition([booking.pk], "completed")[0]["ok"]:
+        return False
+    booking.status = "completed"
+    return True
+
+
+def bulk_transition(ids, target: str) -> list:
+    """
+    Chuyển nhiều booking sang trạng thái target trong một transaction, bằng vài câu UPDATE theo tập
+    (không save() từng dòng): booking chỉ đổi khi đang ở trạng thái hợp lệ (WHERE status IN ...),
+    xe chỉ đổi khi đang ở trạng thái hợp lệ (VD: không đụng xe đang bảo dưỡng) và chỉ được trả về
+    available khi không còn booking approved nào khác. Duyệt thì bỏ qua booking có xe không sẵn sàng.
+    Trả về kết quả từng id theo thứ tự đầu vào: {'id', 'ok', 'status'} (+ 'detail' nếu không chuyển được).
+    Raise ValueError nếu target không hỗ trợ.
+    """
+    if target not in TRANSITIONS:
+        raise ValueError(f"Trạng thái đích phải là một trong: {', '.join(TRANSITIONS)}")
+    expected, vehicle_from, vehicle_status = TRANSITIONS[target]
+    ids = list(dict.fromkeys(ids))
+    now = timezone.now()
+
+    with transaction.atomic():
+        # Khoá các booking hợp lệ: UPDATE ngay sau đó đổi đúng tập này (request khác phải chờ)
+        candidates = Booking.objects.select_for_update().filter(pk__in=ids, status__in=expected)
+        if target == "approved":
+            # Xe đang bảo dưỡng / đã cho thuê: không duyệt (booking giữ pending, báo lý do)
+            candidates = candidates.filter(vehicle__status__in=vehicle_from)
+        rows = list(candidates.order_by("pk").values_list("pk", "vehicle_id", "end_date"))
+        moved = {pk for pk, _, _ in rows}
+        vehicle_ids = sorted({vehicle_id for _, vehicle_id, _ in rows})
+        if rows:
+            Booking.objects.filter(pk__in=moved, status__in=expected).update(status=target, updated_at=now)
+            vehicles = Vehicle.objects.filter(pk__in=vehicle_ids, status__in=vehicle_from)
+            if vehicle_status == VEHICLE_AVAILABLE:
+                # Xe còn booking approved khác (VD: duyệt trước cho chuyến sau) vẫn giữ trạng thái đã thuê
+                vehicles = vehicles.exclude(
+                    Exists(Booking.objects.filter(vehicle=OuterRef("pk"), status="approved"))
+                )
+            vehicles.update(status=vehicle_status, updated_at=now)
+            if target == "completed":
+                record_trips(Vehicle, [(vehicle_id, end_date) for _, vehicle_id, end_date in rows])
+        # Lý do không chuyển được: một query cho các id còn lại
+        current = {
+            pk: (status, vehicle_status)
+            for pk, status, vehicle_status in Booking.objects.filter(pk__in=set(ids) - moved)
+            .values_list("pk", "status", "vehicle__status")
+        }
+
+        # UPDATE không phát signal: tự làm mới cache đội xe, lịch trống, bản đồ trực tiếp
+        if rows:
+            changed = list(Vehicle.objects.filter(pk__in=vehicle_ids).only("pk", "status", "latitude", "longitude"))
+            bump_fleet_version()
+
+            def after_commit():
+                bump_fleet_version()
+                # Duyệt không đổi ngày bận (pending/approved đều active); huỷ/hoàn thành thì dựng lại hàng của xe
+                if target != "approved":
+                    for vehicle_id in vehicle_ids:
+                        availability_index.refresh_vehicle(vehicle_id)
+                for vehicle in changed:
+                    live.publish_vehicle(vehicle)
+
+            transaction.on_commit(after_commit)
+
+    results = []
+    for pk in ids:
+        if pk in moved:
+            results.append({"id": pk, "ok": True, "status": target})
+        elif pk in current:
+            status, vehicle_status = current[pk]
+            if status in expected:
+                detail = f"Xe không sẵn sàng (đang {vehicle_status})"
+            else:
+                detail = f"Không thể chuyển từ {status} sang {target}"
+            results.append({"id": pk, "ok": False, "status": status, "detail": detail})
+        else:
+            results.append({"id": pk, "ok": False, "status": None, "detail": "Không tìm thấy booking"})
+    return results
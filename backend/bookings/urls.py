@@ -5,8 +5,13 @@ app_name = 'bookings'
 
 urlpatterns = [
     path("api/create/", views.create_booking, name="create_booking"),
+    path("api/quote/", views.quote_prices, name="quote_prices"),
+    path("api/availability/", views.free_vehicles, name="free_vehicles"),
+    path("api/delivery-quote/", views.delivery_quote, name="delivery_quote"),
     path("api/my/", views.my_bookings, name="my_bookings"),
+    path("api/bulk-transition/", views.bulk_transition, name="bulk_transition"),
     path("api/<int:booking_id>/cancel/", views.cancel_booking, name="cancel_booking"),
     path("api/<int:booking_id>/approve/", views.approve_booking, name="approve_booking"),
     path("api/<int:booking_id>/complete/", views.complete_booking, name="complete_booking"),
+    path("api/<int:booking_id>/track/", views.booking_track, name="booking_track"),
 ]
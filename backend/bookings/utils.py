@@ -1,9 +1,20 @@
 from datetime import date, timedelta
 from decimal import Decimal
-from django.db.models import Q
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Q, Exists, OuterRef
+
+from . import pricing
+from .models import Booking
 
 ACTIVE_STATUSES = ("pending", "approved")
 
+# Exclusion constraint chống trùng lịch trên PostgreSQL (migration 0003)
+OVERLAP_CONSTRAINT = "booking_no_overlap"
+
+
+class BookingOverlapError(Exception):
+    """Xe đã có booking active trùng khoảng ngày."""
+
 
 def dates_in_range(start: date, end: date):
     """Yield từng ngày từ start -> end (inclusive)."""
@@ -33,18 +44,9 @@ def get_unit_price_per_day(vehicle) -> Decimal:
 def calc_total_price(vehicle, start_date: date, end_date: date) -> Decimal:
     """
     Dynamic Pricing: cuối tuần +20% (T7, CN).
-    Tính theo từng ngày để đúng logic 
+    Dùng chung bộ tính giá trong pricing.py (đếm ngày bằng công thức, không duyệt từng ngày).
     """
-    base = get_unit_price_per_day(vehicle)
-    if end_date < start_date:
-        return Decimal("0.00")
-
-    total = Decimal("0.00")
-    for d in dates_in_range(start_date, end_date):
-        multiplier = Decimal("1.20") if is_weekend(d) else Decimal("1.00")
-        total += (base * multiplier)
-
-    return total.quantize(Decimal("0.01"))
+    return pricing.total_price(get_unit_price_per_day(vehicle), start_date, end_date)
 
 
 def is_overlapping(vehicle, start_date: date, end_date: date) -> bool:
@@ -52,6 +54,91 @@ def is_overlapping(vehicle, start_date: date, end_date: date) -> bool:
     Check trùng lịch: existing.start <= new.end AND existing.end >= new.start
     Chỉ xét booking còn active (pending/approved).
     """
-    return vehicle.bookings.filter(status__in=ACTIVE_STATUSES).filter(
+    return overlapping_bookings(start_date, end_date).filter(vehicle=vehicle).exists()
+
+
+def overlapping_bookings(start_date: date, end_date: date):
+    """Booking active trùng với khoảng [start_date, end_date] (cùng điều kiện với is_overlapping)."""
+    return Booking.objects.filter(status__in=ACTIVE_STATUSES).filter(
         Q(start_date__lte=end_date) & Q(end_date__gte=start_date)
-    ).exists()
+    )
+
+
+def filter_available(vehicles, start_date: date, end_date: date):
+    """
+    Lọc queryset xe còn trống trong [start_date, end_date] bằng một subquery NOT EXISTS,
+    vẫn ghép được với các filter/sắp xếp/phân trang khác trong cùng một query.
+    """
+    return vehicles.filter(
+        ~Exists(overlapping_bookings(start_date, end_date).filter(vehicle=OuterRef("pk")))
+    )
+
+
+def busy_intervals(vehicle, start_date: date, end_date: date) -> list:
+    """
+    Các khoảng bận của xe trong [start_date, end_date] (inclusive), đã gộp và cắt theo biên.
+    Một query theo (vehicle, status, start_date) + một lượt duyệt tuyến tính.
+    """
+    rows = (
+        overlapping_bookings(start_date, end_date)
+        .filter(vehicle=vehicle)
+        .order_by("start_date")
+        .values_list("start_date", "end_date")
+    )
+    merged = []
+    for s, e in rows:
+        s, e = max(s, start_date), min(e, end_date)
+        if merged and s <= merged[-1][1] + timedelta(days=1):
+            merged[-1][1] = max(merged[-1][1], e)
+        else:
+            merged.append([s, e])
+    return [tuple(interval) for interval in merged]
+
+
+def free_intervals(busy: list, start_date: date, end_date: date) -> list:
+    """Phần bù của các khoảng bận (đã gộp, đã sắp xếp) trong [start_date, end_date]."""
+    free = []
+    cur = start_date
+    for s, e in busy:
+        if s > cur:
+            free.append((cur, s - timedelta(days=1)))
+        cur = max(cur, e + timedelta(days=1))
+    if cur <= end_date:
+        free.append((cur, end_date))
+    return free
+
+
+def earliest_window(free: list, length: int):
+    """Khoảng trống sớm nhất có ít nhất `length` ngày liên tiếp, None nếu không có."""
+    for s, e in free:
+        if (e - s).days + 1 >= length:
+            return s, s + timedelta(days=length - 1)
+    return None
+
+
+def _is_overlap_violation(exc: IntegrityError) -> bool:
+    cause = exc.__cause__
+    diag = getattr(cause, "diag", None)
+    return getattr(cause, "pgcode", None) == "23P01" and getattr(diag, "constraint_name", None) == OVERLAP_CONSTRAINT
+
+
+def create_booking_atomic(vehicle, start_date: date, end_date: date, **fields) -> Booking:
+    """
+    Tạo booking không bị trùng lịch, an toàn khi có nhiều request đồng thời.
+    PostgreSQL: một câu INSERT, exclusion constraint tự chặn trùng lịch.
+    DB khác (SQLite khi chạy local): kiểm tra is_overlapping rồi insert trong cùng transaction.
+    Raise BookingOverlapError nếu trùng lịch.
+    """
+    if connection.vendor == "postgresql":
+        try:
+            with transaction.atomic():
+                return Booking.objects.create(vehicle=vehicle, start_date=start_date, end_date=end_date, **fields)
+        except IntegrityError as exc:
+            if _is_overlap_violation(exc):
+                raise BookingOverlapError() from exc
+            raise
+
+    with transaction.atomic():
+        if is_overlapping(vehicle, start_date, end_date):
+            raise BookingOverlapError()
+        return Booking.objects.create(vehicle=vehicle, start_date=start_date, end_date=end_date, **fields)
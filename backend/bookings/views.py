@@ -2,11 +2,26 @@ import json
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth.decorators import login_required, user_passes_test
+from datetime import date, datetime, time, timedelta
+from django.utils import timezone
 from django.shortcuts import get_object_or_404
+from django.views.decorators.http import require_GET
+from django.db.models import Count, Max
 
 from .models import Booking
 from vehicles.models import Vehicle
-from .utils import is_overlapping, calc_total_price
+from vehicles import history
+from vehicles.geo import parse_point
+from vehicles.pagination import keyset_page
+from vehicles.conditional import conditional_view, make_etag
+from .utils import calc_total_price, filter_available, create_booking_atomic, BookingOverlapError
+from . import delivery, pricing, transitions
+from .availability import index as availability_index
+
+# Giới hạn số khoảng ngày trong một lần báo giá hàng loạt
+MAX_QUOTE_RANGES = 20
+# Số booking mỗi trang ở chế độ cursor
+BOOKINGS_PAGE_SIZE = 20
 
 
 def is_admin(user):
@@ -14,7 +29,7 @@ def is_admin(user):
 
 
 def _vehicle_booked_code():
-    return "rented"
+    return transitions.VEHICLE_BOOKED
 
 
 @csrf_exempt
@@ -33,7 +48,6 @@ def create_booking(request):
 
     vehicle = get_object_or_404(Vehicle, id=vehicle_id)
 
-    from datetime import date
     try:
         s = date.fromisoformat(start_date)
         e = date.fromisoformat(end_date)
@@ -44,7 +58,7 @@ def create_booking(request):
         return JsonResponse({"detail": "end_date phải >= start_date"}, status=400)
 
     # SỬA: Cho phép đặt xe nếu trạng thái là 'available' HOẶC nếu đặt cho tương lai (status khác nhưng không trùng lịch)
-    # Chúng ta bỏ qua check status cứng nhắc này, vì hàm is_overlapping bên dưới sẽ lo việc kiểm tra trùng lịch.
+    # Chúng ta bỏ qua check status cứng nhắc này, vì create_booking_atomic bên dưới sẽ lo việc chặn trùng lịch.
     
     # if getattr(vehicle, "status", "") != "available":
     #    return JsonResponse({"detail": "Xe không sẵn sàng"}, status=400)
@@ -53,19 +67,20 @@ def create_booking(request):
     if str(getattr(vehicle, "status", "")).lower() in ["maintenance", "bao tri"]:
          return JsonResponse({"detail": "Xe đang bảo trì, không thể đặt lúc này"}, status=400)
 
-    if is_overlapping(vehicle, s, e):
-        return JsonResponse({"detail": "Xe bị trùng lịch"}, status=400)
-
     total = calc_total_price(vehicle, s, e)
 
-    booking = Booking.objects.create(
-        user=request.user,
-        vehicle=vehicle,
-        start_date=s,
-        end_date=e,
-        total_price=total,
-        status="pending",
-    )
+    # Trùng lịch được chặn ngay trong câu INSERT (exclusion constraint), không check trước
+    try:
+        booking = create_booking_atomic(
+            vehicle,
+            s,
+            e,
+            customer=request.user,
+            total_price=total,
+            status="pending",
+        )
+    except BookingOverlapError:
+        return JsonResponse({"detail": "Xe bị trùng lịch"}, status=400)
 
     return JsonResponse({
         "id": booking.id,
@@ -77,9 +92,165 @@ def create_booking(request):
     }, status=201)
 
 
+def _parse_quote_ranges(request):
+    """
+    Đọc các khoảng ngày từ query: start_date/end_date và/hoặc
+    range=YYYY-MM-DD:YYYY-MM-DD (lặp lại được).
+    """
+    raw = []
+    if request.GET.get("start_date") or request.GET.get("end_date"):
+        raw.append((request.GET.get("start_date", ""), request.GET.get("end_date", "")))
+    for item in request.GET.getlist("range"):
+        raw.append(tuple(item.split(":", 1)) if ":" in item else (item, ""))
+
+    ranges = []
+    for start, end in raw:
+        s = date.fromisoformat(start)
+        e = date.fromisoformat(end)
+        if e < s:
+            raise ValueError("end_date phải >= start_date")
+        ranges.append((s, e))
+    return ranges
+
+
+@require_GET
+def quote_prices(request):
+    """
+    API: Báo giá hàng loạt cho nhiều xe x nhiều khoảng ngày trong một request.
+    Chọn xe theo ids=1,2,3 hoặc theo bộ lọc (vehicle_type, min_price, max_price, availability).
+    """
+    try:
+        ranges = _parse_quote_ranges(request)
+    except ValueError:
+        return JsonResponse({"detail": "Khoảng ngày phải dạng YYYY-MM-DD và end_date >= start_date"}, status=400)
+    if not ranges:
+        return JsonResponse({"detail": "Thiếu start_date/end_date hoặc range"}, status=400)
+    if len(ranges) > MAX_QUOTE_RANGES:
+        return JsonResponse({"detail": f"Tối đa {MAX_QUOTE_RANGES} khoảng ngày mỗi lần"}, status=400)
+
+    vehicles = Vehicle.objects.all()
+    ids = request.GET.get("ids")
+    if ids:
+        try:
+            vehicles = vehicles.filter(id__in=[int(x) for x in ids.split(",") if x.strip()])
+        except ValueError:
+            return JsonResponse({"detail": "ids phải là danh sách số nguyên"}, status=400)
+
+    vehicle_type = request.GET.get("vehicle_type")
+    if vehicle_type:
+        vehicles = vehicles.filter(vehicle_type=vehicle_type)
+    availability = request.GET.get("availability")
+    if availability == "available":
+        vehicles = vehicles.filter(status__iexact="available")
+    elif availability == "unavailable":
+        vehicles = vehicles.exclude(status__iexact="available")
+    min_price = request.GET.get("min_price")
+    max_price = request.GET.get("max_price")
+    if min_price:
+        vehicles = vehicles.filter(price_per_day__gte=min_price)
+    if max_price:
+        vehicles = vehicles.filter(price_per_day__lte=max_price)
+
+    # Một query duy nhất lấy cột giá, phần tính toán chạy vector trên NumPy
+    rows = list(vehicles.order_by("id").values_list("id", "price_per_day"))
+    totals = pricing.batch_totals([price for _, price in rows], ranges)
+
+    return JsonResponse({
+        "ranges": [
+            {
+                "start_date": str(s),
+                "end_date": str(e),
+                "days": pricing.rental_days(s, e),
+            }
+            for s, e in ranges
+        ],
+        "quotes": [
+            {
+                "vehicle_id": vehicle_id,
+                "price_per_day": str(price),
+                "totals": [str(pricing.cents_to_decimal(c)) for c in row_totals],
+            }
+            for (vehicle_id, price), row_totals in zip(rows, totals)
+        ],
+    })
+
+
+@require_GET
+def delivery_quote(request):
+    """
+    API: Phí giao xe tận nơi tới ?to=lat,lng, tính ở server từ ma trận kho x ô lưới dựng sẵn
+    (bookings/delivery.py): một lần tra trong bộ nhớ, không gọi dịch vụ chỉ đường.
+    """
+    try:
+        lat, lng = parse_point(request.GET.get("to", ""))
+    except ValueError:
+        return JsonResponse({"detail": "to phải dạng lat,lng trong phạm vi toạ độ"}, status=400)
+
+    result = delivery.matrix.quote(lat, lng)
+    if result is None:
+        return JsonResponse({"detail": "Địa điểm nằm ngoài khu vực giao xe"}, status=404)
+    return JsonResponse({
+        "to": [lat, lng],
+        "depot": result["depot"],
+        "distance_km": result["distance_km"],
+        "fee": str(result["fee"]),
+    })
+
+
+@require_GET
+def free_vehicles(request):
+    """
+    API: Danh sách id xe trống lịch trong [start_date, end_date].
+    Trả lời từ chỉ mục trong bộ nhớ; ngoài phạm vi chỉ mục thì query NOT EXISTS.
+    """
+    try:
+        s = date.fromisoformat(request.GET.get("start_date", ""))
+        e = date.fromisoformat(request.GET.get("end_date", ""))
+    except ValueError:
+        return JsonResponse({"detail": "start_date/end_date phải dạng YYYY-MM-DD"}, status=400)
+    if e < s:
+        return JsonResponse({"detail": "end_date phải >= start_date"}, status=400)
+
+    vehicle_ids = availability_index.free_vehicle_ids(s, e)
+    source = "memory"
+    if vehicle_ids is None:
+        vehicle_ids = list(filter_available(Vehicle.objects.order_by("id"), s, e).values_list("id", flat=True))
+        source = "database"
+
+    return JsonResponse({
+        "start_date": str(s),
+        "end_date": str(e),
+        "vehicle_ids": vehicle_ids,
+        "source": source,
+    })
+
+
+def _my_bookings_validators(request):
+    """ETag/Last-Modified: max(updated_at) + số booking của khách, tính cả xe (tên/biển số nằm trong payload)."""
+    stats = Booking.objects.filter(customer=request.user).aggregate(
+        last=Max("updated_at"), vehicle_last=Max("vehicle__updated_at"), total=Count("id"),
+    )
+    last = max(filter(None, (stats["last"], stats["vehicle_last"])), default=None)
+    etag = make_etag("my_bookings", request.user.pk, sorted(request.GET.lists()), stats["total"], last)
+    return etag, last
+
+
 @login_required
+@conditional_view(_my_bookings_validators)
 def my_bookings(request):
-    qs = Booking.objects.filter(user=request.user).select_related("vehicle").order_by("-id")
+    qs = Booking.objects.filter(customer=request.user).select_related("vehicle")
+
+    # Chế độ cursor (?cursor=, để trống cho trang đầu): phân trang keyset theo -id
+    cursor_mode = "cursor" in request.GET
+    next_cursor = None
+    if cursor_mode:
+        try:
+            qs, next_cursor = keyset_page(qs, "id", True, request.GET["cursor"], BOOKINGS_PAGE_SIZE)
+        except ValueError:
+            return JsonResponse({"detail": "Cursor không hợp lệ"}, status=400)
+    else:
+        qs = qs.order_by("-id")
+
     data = []
     for b in qs:
         data.append({
@@ -94,7 +265,14 @@ def my_bookings(request):
             "start_date": str(b.start_date),
             "end_date": str(b.end_date),
         })
-    return JsonResponse(data, safe=False)
+
+    if not cursor_mode:
+        return JsonResponse(data, safe=False)
+
+    pagination = {"next_cursor": next_cursor, "has_next": next_cursor is not None}
+    if request.GET.get("count") == "1":
+        pagination["total"] = Booking.objects.filter(customer=request.user).count()
+    return JsonResponse({"bookings": data, "pagination": pagination})
 
 
 @csrf_exempt
@@ -105,7 +283,7 @@ def cancel_booking(request, booking_id: int):
 
     b = get_object_or_404(Booking, id=booking_id)
 
-    if (not request.user.is_staff) and b.user_id != request.user.id:
+    if (not request.user.is_staff) and b.customer_id != request.user.id:
         return JsonResponse({"detail": "Không có quyền huỷ booking này"}, status=403)
 
     if b.status not in ("pending", "approved"):
@@ -150,14 +328,73 @@ def complete_booking(request, booking_id: int):
 
     b = get_object_or_404(Booking, id=booking_id)
 
-    if b.status != "approved":
+    # Kiểm tra trạng thái ngay trong UPDATE: request hoàn thành đồng thời không cộng chuyến hai lần
+    if not transitions.complete_booking(b):
         return JsonResponse({"detail": "Chỉ complete booking approved"}, status=400)
 
-    b.status = "completed"
-    b.save(update_fields=["status"])
+    return JsonResponse({"id": b.id, "status": b.status})
 
-    v = b.vehicle
-    v.status = "available"
-    v.save(update_fields=["status"])
 
-    return JsonResponse({"id": b.id, "status": b.status})
+@user_passes_test(is_admin)
+def bulk_transition(request):
+    """
+    API admin: chuyển nhiều booking cùng lúc. Body JSON: {"ids": [...], "status": "approved|completed|cancelled"}.
+    Kiểm tra trạng thái hợp lệ và cập nhật booking + xe trong SQL, một transaction
+    (bookings/transitions.py); trả về kết quả từng id.
+    Thao tác hàng loạt nên không miễn CSRF, và chỉ nhận application/json.
+    """
+    if request.method != "POST":
+        return JsonResponse({"detail": "Method not allowed"}, status=405)
+    if request.content_type != "application/json":
+        return JsonResponse({"detail": "Content-Type phải là application/json"}, status=415)
+
+    try:
+        payload = json.loads(request.body.decode("utf-8"))
+        if not isinstance(payload["ids"], list):
+            raise TypeError("ids phải là danh sách")
+        ids = [int(pk) for pk in payload["ids"]]
+        target = str(payload["status"])
+    except Exception:
+        return JsonResponse({"detail": "Body phải dạng {\"ids\": [...], \"status\": ...}"}, status=400)
+
+    if not ids:
+        return JsonResponse({"detail": "ids không được rỗng"}, status=400)
+    if len(ids) > transitions.MAX_BULK_IDS:
+        return JsonResponse({"detail": f"Tối đa {transitions.MAX_BULK_IDS} booking mỗi lần"}, status=400)
+
+    try:
+        results = transitions.bulk_transition(ids, target)
+    except ValueError as exc:
+        return JsonResponse({"detail": str(exc)}, status=400)
+
+    return JsonResponse({
+        "status": target,
+        "updated": sum(result["ok"] for result in results),
+        "results": results,
+    })
+
+
+@require_GET
+@login_required
+def booking_track(request, booking_id: int):
+    """
+    Lộ trình xe trong thời gian thuê (từ 0h ngày nhận tới hết ngày trả, giờ địa phương),
+    dạng cột: t (epoch giây), lat, lng. Điểm cũ đã được gộp theo phút/giờ (vehicles/history.py).
+    """
+    b = get_object_or_404(Booking, id=booking_id)
+
+    if (not request.user.is_staff) and b.customer_id != request.user.id:
+        return JsonResponse({"detail": "Không có quyền xem lộ trình booking này"}, status=403)
+
+    start = timezone.make_aware(datetime.combine(b.start_date, time.min))
+    end = timezone.make_aware(datetime.combine(b.end_date + timedelta(days=1), time.min))
+    points = list(history.track(b.vehicle_id, start, end))
+    times, lats, lngs = (list(column) for column in zip(*points)) if points else ([], [], [])
+
+    return JsonResponse({
+        "booking": b.id,
+        "vehicle": b.vehicle_id,
+        "t": [int(moment.timestamp()) for moment in times],
+        "lat": lats,
+        "lng": lngs,
+    })
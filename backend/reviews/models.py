@@ -19,6 +19,17 @@ class Review(models.Model):
     rating = models.IntegerField(choices=RATING_CHOICES, default=5, verbose_name="Điểm đánh giá")
     comment = models.TextField(blank=True, null=True, verbose_name="Nhận xét")
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Ngày tạo")
+    updated_at = models.DateTimeField(auto_now=True, db_index=True, verbose_name="Ngày cập nhật")
+
+    # Giá trị (vehicle_id, rating) đã lưu trong DB, để signal tính phần chênh lệch khi sửa/xoá
+    _loaded_values = (None, None)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        loaded = dict(zip(field_names, values))
+        instance._loaded_values = (loaded.get('vehicle_id'), loaded.get('rating'))
+        return instance
 
     def __str__(self):
         return f"{self.user.username} đánh giá {self.vehicle.name}"
\ No newline at end of file
@@ -0,0 +1,61 @@
+from django.db.models import F, FloatField
+from django.db.models.functions import Cast, NullIf, Coalesce
+from django.db.models.signals import post_save, post_delete, pre_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from vehicles.models import Vehicle
+from .models import Review
+
+
+def apply_rating_delta(vehicle_id, rating_delta: int, count_delta: int):
+    """
+    Cộng dồn thống kê đánh giá của xe trong một câu UPDATE (F-expression, không race).
+    Vế phải của UPDATE đọc giá trị cũ của hàng nên rating_avg tính từ tổng/số mới.
+    """
+    new_sum = F('rating_sum') + rating_delta
+    new_count = F('review_count') + count_delta
+    Vehicle.objects.filter(pk=vehicle_id).update(
+        rating_sum=new_sum,
+        review_count=new_count,
+        rating_avg=Coalesce(
+            Cast(new_sum, FloatField()) / NullIf(Cast(new_count, FloatField()), 0.0),
+            0.0,
+            output_field=FloatField(),
+        ),
+        # UPDATE không qua save() nên phải tự cập nhật auto_now
+        updated_at=timezone.now(),
+    )
+
+
+@receiver([pre_save, pre_delete], sender=Review)
+def load_stored_rating(sender, instance, **kwargs):
+    """
+    Review nạp bằng .only()/.defer() không có đủ (vehicle_id, rating) đã lưu: đọc lại từ DB trước khi
+    ghi/xoá, để lần lưu sau không bị coi là tạo mới (cộng điểm hai lần).
+    """
+    if instance._state.adding or None not in instance._loaded_values:
+        return
+    stored = Review.objects.filter(pk=instance.pk).values_list('vehicle_id', 'rating').first()
+    if stored is not None:
+        instance._loaded_values = stored
+
+
+@receiver(post_save, sender=Review)
+def update_vehicle_rating_on_save(sender, instance, created, **kwargs):
+    old_vehicle_id, old_rating = instance._loaded_values
+    if created or old_vehicle_id is None:
+        apply_rating_delta(instance.vehicle_id, instance.rating, 1)
+    elif old_vehicle_id != instance.vehicle_id:
+        apply_rating_delta(old_vehicle_id, -old_rating, -1)
+        apply_rating_delta(instance.vehicle_id, instance.rating, 1)
+    elif old_rating != instance.rating:
+        apply_rating_delta(instance.vehicle_id, instance.rating - old_rating, 0)
+    instance._loaded_values = (instance.vehicle_id, instance.rating)
+
+
+@receiver(post_delete, sender=Review)
+def update_vehicle_rating_on_delete(sender, instance, **kwargs):
+    old_vehicle_id, old_rating = instance._loaded_values
+    if old_vehicle_id is not None:
+        apply_rating_delta(old_vehicle_id, -old_rating, -1)
@@ -1,3 +1,75 @@
+from io import StringIO
+from datetime import date
+
+from django.core.management import call_command
 from django.test import TestCase
+from django.urls import reverse
+
+from bookings.models import Booking
+from users.models import User
+from vehicles.models import Vehicle
+from .models import Review
+
+
+class VehicleRatingStatsTest(TestCase):
+    """Test cho thống kê đánh giá lưu sẵn trên Vehicle"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="khach", password="testpass123")
+        self.other = User.objects.create_user(username="khach2", password="testpass123")
+        self.vehicle = Vehicle.objects.create(name="Vios", license_plate="51H-555.55", price_per_day=500000)
+        Booking.objects.create(customer=self.user, vehicle=self.vehicle, start_date=date(2026, 1, 1), end_date=date(2026, 1, 2), total_price=0, status="completed")
+
+    def assert_stats(self, rating_sum, review_count, avg):
+        self.vehicle.refresh_from_db()
+        self.assertEqual(self.vehicle.rating_sum, rating_sum)
+        self.assertEqual(self.vehicle.review_count, review_count)
+        self.assertEqual(self.vehicle.avg_rating, avg)
+
+    def test_create_update_delete(self):
+        """Test thêm, sửa (qua add_review) và xoá (qua delete_review) đánh giá"""
+        Review.objects.create(vehicle=self.vehicle, user=self.other, rating=3)
+        self.assert_stats(3, 1, 3.0)
+
+        self.client.login(username="khach", password="testpass123")
+        url = reverse("vehicles:add_review", kwargs={"vehicle_pk": self.vehicle.pk})
+        self.client.post(url, {"rating": 4, "comment": "Tốt"})
+        self.assert_stats(7, 2, 3.5)
+        self.client.post(url, {"rating": 5, "comment": "Rất tốt"})
+        self.assert_stats(8, 2, 4.0)
+
+        review = Review.objects.get(user=self.user)
+        self.client.post(reverse("vehicles:delete_review", kwargs={"review_pk": review.pk}))
+        self.assert_stats(3, 1, 3.0)
+        Review.objects.all().delete()
+        self.assert_stats(0, 0, None)
+
+    def test_deferred_fields_do_not_double_count(self):
+        """Test review nạp bằng .only()/.defer() rồi lưu/xoá không bị tính như đánh giá mới"""
+        review = Review.objects.create(vehicle=self.vehicle, user=self.user, rating=4)
+        partial = Review.objects.only("comment").get(pk=review.pk)
+        partial.comment = "Sửa nhận xét"
+        partial.save()
+        self.assert_stats(4, 1, 4.0)
+
+        partial = Review.objects.defer("vehicle").get(pk=review.pk)
+        partial.rating = 2
+        partial.save()
+        self.assert_stats(2, 1, 2.0)
+        Review.objects.only("comment").get(pk=review.pk).delete()
+        self.assert_stats(0, 0, None)
+
+    def test_rating_api_reads_stored_stats(self):
+        """Test API rating đọc cột lưu sẵn, không aggregate"""
+        Review.objects.create(vehicle=self.vehicle, user=self.user, rating=4)
+        Review.objects.create(vehicle=self.vehicle, user=self.other, rating=5)
+        with self.assertNumQueries(1):
+            data = self.client.get(reverse("vehicles:get_vehicle_rating", kwargs={"vehicle_pk": self.vehicle.pk})).json()
+        self.assertEqual(data, {"avg_rating": 4.5, "review_count": 2})
 
-# Create your tests here.
+    def test_rebuild_command(self):
+        """Test lệnh rebuild_rating_stats sửa lại số liệu bị lệch"""
+        Review.objects.create(vehicle=self.vehicle, user=self.user, rating=2)
+        Vehicle.objects.filter(pk=self.vehicle.pk).update(rating_sum=99, review_count=7, rating_avg=1.0)
+        call_command("rebuild_rating_stats", stdout=StringIO())
+        self.assert_stats(2, 1, 2.0)
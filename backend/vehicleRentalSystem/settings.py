@@ -1,6 +1,7 @@
 from pathlib import Path
 import os
 import sys
+import tempfile
 import dj_database_url
 
 # Định nghĩa thư mục gốc (Trỏ đến thư mục chứa manage.py)
@@ -82,6 +83,21 @@ DATABASES = {
 db_from_env = dj_database_url.config(conn_max_age=600)
 DATABASES['default'].update(db_from_env)
 
+# Cache (response API đội xe, phiên bản đội xe, giới hạn geocoding): phải DÙNG CHUNG giữa các worker,
+# nếu không worker khác vẫn trả dữ liệu cũ sau khi xe đổi trạng thái. Mặc định là file cache trong
+# thư mục tạm của máy (chung cho mọi worker trên cùng máy, không cần dịch vụ ngoài); nhiều máy thì
+# đặt CACHE_DIR trỏ tới thư mục dùng chung
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('CACHE_DIR') or os.path.join(tempfile.gettempdir(), 'vehicle-rental-cache'),
+    }
+}
+
+# Token của gateway GPS gửi vị trí xe (POST /vehicles/api/telemetry/gateway/, header
+# Authorization: Bearer <token>); nhiều token cách nhau bởi dấu phẩy
+TELEMETRY_TOKENS = [token for token in os.environ.get('TELEMETRY_TOKENS', '').split(',') if token]
+
 # 8. Ngôn ngữ và Thời gian
 LANGUAGE_CODE = 'vi'
 TIME_ZONE = 'Asia/Ho_Chi_Minh'
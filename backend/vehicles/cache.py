@@ -0,0 +1,112 @@
+import hashlib
+import time
+from functools import wraps
+
+from django.core.cache import cache
+from django.http import HttpResponse
+
+# Phiên bản dữ liệu đội xe: mọi key cache đều chứa số này, ghi DB chỉ cần tăng nó (O(1))
+VERSION_KEY = 'fleet:version'
+HITS_KEY = 'fleet:cache:hits'
+MISSES_KEY = 'fleet:cache:misses'
+# Bản ghi cũ (phiên bản trước) không bị xoá, chỉ tự hết hạn sau khoảng này
+RESPONSE_CACHE_TIMEOUT = 300
+
+
+def _initial_version() -> int:
+    # Khởi tạo theo thời gian (ms) để key cũ không bị dùng lại nếu VERSION_KEY bị evict
+    return int(time.time() * 1000)
+
+
+def fleet_version() -> int:
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, _initial_version(), timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_fleet_version():
+    """Vô hiệu hoá toàn bộ response đã cache (gọi từ signal khi Vehicle/ảnh/đánh giá/booking thay đổi)."""
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, _initial_version(), timeout=None)
+
+
+def _count(key: str):
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+
+
+def cache_stats() -> dict:
+    hits = cache.get(HITS_KEY, 0)
+    misses = cache.get(MISSES_KEY, 0)
+    total = hits + misses
+    return {
+        'version': fleet_version(),
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': round(hits / total, 4) if total else None,
+    }
+
+
+def reset_cache_stats():
+    cache.delete_many([HITS_KEY, MISSES_KEY])
+
+
+def cache_key(namespace: str, params=(), *args) -> str:
+    """
+    Key = namespace + phiên bản + tham số đã chuẩn hoá.
+    params: QueryDict hoặc dãy (tên, giá trị); sắp theo tên, bỏ khoảng trắng thừa.
+    """
+    if hasattr(params, 'lists'):
+        params = params.lists()
+    normalized = sorted(
+        (name, [str(v).strip() for v in (values if isinstance(values, list) else [values])])
+        for name, values in params
+    )
+    digest = hashlib.md5(repr((args, normalized)).encode('utf-8')).hexdigest()
+    return f'fleet:{namespace}:v{fleet_version()}:{digest}'
+
+
+def get_or_build(key: str, build, timeout: int = RESPONSE_CACHE_TIMEOUT):
+    """Lấy giá trị đã cache, nếu chưa có thì gọi build() và lưu lại; đếm hit/miss."""
+    value = cache.get(key)
+    if value is not None:
+        _count(HITS_KEY)
+        return value
+    _count(MISSES_KEY)
+    value = build()
+    cache.set(key, value, timeout)
+    return value
+
+
+def cached_json_response(namespace: str, timeout: int = RESPONSE_CACHE_TIMEOUT):
+    """
+    Decorator cho API JSON công khai: cache nội dung response 200 theo
+    (tham số GET, tham số URL, phiên bản đội xe). Response lỗi không được cache.
+    Header X-Cache cho biết HIT/MISS.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            key = cache_key(namespace, request.GET, *args, *sorted(kwargs.items()))
+            cached = cache.get(key)
+            if cached is not None:
+                _count(HITS_KEY)
+                content, content_type = cached
+                response = HttpResponse(content, content_type=content_type)
+                response['X-Cache'] = 'HIT'
+                return response
+            _count(MISSES_KEY)
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200 and not response.streaming:
+                cache.set(key, (response.content, response['Content-Type']), timeout)
+            response['X-Cache'] = 'MISS'
+            return response
+        return wrapper
+    return decorator
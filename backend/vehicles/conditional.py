@@ -0,0 +1,26 @@
+import hashlib
+
+from django.views.decorators.http import condition
+
+
+def make_etag(*parts) -> str:
+    """ETag từ các validator rẻ (max updated_at, số dòng, tham số...), không cần dựng payload."""
+    return hashlib.md5(repr(parts).encode('utf-8')).hexdigest()
+
+
+def conditional_view(validators):
+    """
+    Như @condition của Django nhưng chỉ tính validators một lần cho cả ETag và Last-Modified.
+    validators(request, *args, **kwargs) trả về (etag, last_modified) hoặc (None, None)
+    khi không xác định được (VD: tham số sai, để view tự trả lỗi).
+    Khớp If-None-Match/If-Modified-Since -> 304, view không được gọi.
+    """
+    def get(request, *args, **kwargs):
+        if not hasattr(request, '_conditional_validators'):
+            request._conditional_validators = validators(request, *args, **kwargs)
+        return request._conditional_validators
+
+    return condition(
+        etag_func=lambda request, *args, **kwargs: get(request, *args, **kwargs)[0],
+        last_modified_func=lambda request, *args, **kwargs: get(request, *args, **kwargs)[1],
+    )
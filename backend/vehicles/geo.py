@@ -0,0 +1,117 @@
+from django.db.models import Q
+
+# Độ chính xác geohash lưu trên Vehicle.geo_cell: 7 ký tự ~ 153m x 153m
+GEOHASH_PRECISION = 7
+# Số ô tối đa để phủ một khung nhìn; khung càng lớn thì dùng tiền tố càng ngắn (ô càng to)
+MAX_COVER_CELLS = 32
+
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def geohash(lat: float, lng: float, precision: int = GEOHASH_PRECISION) -> str:
+    """Mã geohash của một điểm: các điểm gần nhau có chung tiền tố (index B-tree dùng được cho LIKE 'tiền tố%')."""
+    lat_lo, lat_hi, lng_lo, lng_hi = -90.0, 90.0, -180.0, 180.0
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < precision:
+        if even:
+            mid = (lng_lo + lng_hi) / 2
+            bit = lng >= mid
+            lng_lo, lng_hi = (mid, lng_hi) if bit else (lng_lo, mid)
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            bit = lat >= mid
+            lat_lo, lat_hi = (mid, lat_hi) if bit else (lat_lo, mid)
+        value = (value << 1) | bit
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(_BASE32[value])
+            bits, value = 0, 0
+    return ''.join(chars)
+
+
+def cell_size(precision: int) -> tuple:
+    """Kích thước (độ vĩ, độ kinh) của một ô geohash ở độ dài precision."""
+    total = precision * 5
+    lng_bits = (total + 1) // 2
+    lat_bits = total // 2
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lng_bits)
+
+
+def _frange(lo: float, hi: float, step: float):
+    # Bắt đầu từ mép ô chứa lo để không sót ô nào
+    start = (lo // step) * step
+    value = start
+    while value <= hi:
+        yield value + step / 2
+        value += step
+
+
+def cover_bbox(west: float, south: float, east: float, north: float) -> list:
+    """
+    Danh sách tiền tố geohash phủ khung nhìn, dài nhất có thể mà không quá MAX_COVER_CELLS ô.
+    Ô có thể tràn ra ngoài khung: kết hợp thêm điều kiện lat/lng chính xác khi lọc.
+    """
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        lat_step, lng_step = cell_size(precision)
+        rows = int((north - south) / lat_step) + 2
+        cols = int((east - west) / lng_step) + 2
+        if rows * cols > MAX_COVER_CELLS and precision > 1:
+            continue
+        return sorted({
+            geohash(min(lat, 90.0), min(lng, 180.0), precision)
+            for lat in _frange(south, north, lat_step)
+            for lng in _frange(west, east, lng_step)
+        })
+    return []
+
+
+def cell_centers(west: float, south: float, east: float, north: float, precision: int):
+    """Tâm của mọi ô geohash độ dài precision phủ khung: sinh ra (mã ô, lat, lng)."""
+    lat_step, lng_step = cell_size(precision)
+    for lat in _frange(south, north, lat_step):
+        for lng in _frange(west, east, lng_step):
+            if -90 < lat < 90 and -180 < lng < 180:
+                yield geohash(lat, lng, precision), lat, lng
+
+
+def cluster_precision(zoom: int) -> int:
+    """
+    Độ dài tiền tố geohash để gom cụm ở mức zoom: ô rộng cỡ 1/4 tile bản đồ (~64px),
+    tức 360 / 2^(zoom+2) độ kinh. Không vượt quá GEOHASH_PRECISION.
+    """
+    target = 360.0 / (1 << (zoom + 2))
+    precision = 1
+    while precision < GEOHASH_PRECISION and cell_size(precision + 1)[1] >= target:
+        precision += 1
+    return precision
+
+
+def parse_bbox(value: str) -> tuple:
+    """'west,south,east,north' (như Leaflet toBBoxString) -> tuple float; raise ValueError nếu sai."""
+    try:
+        west, south, east, north = (float(part) for part in value.split(','))
+    except (AttributeError, ValueError):
+        raise ValueError('bbox phải dạng west,south,east,north') from None
+    if not (-180 <= west < east <= 180 and -90 <= south < north <= 90):
+        raise ValueError('bbox không hợp lệ (cần west < east, south < north trong phạm vi toạ độ)')
+    return west, south, east, north
+
+
+def parse_point(value: str) -> tuple:
+    """'lat,lng' -> tuple float; raise ValueError nếu sai."""
+    try:
+        lat, lng = (float(part) for part in value.split(','))
+    except (AttributeError, ValueError):
+        raise ValueError('near phải dạng lat,lng') from None
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        raise ValueError('near nằm ngoài phạm vi toạ độ')
+    return lat, lng
+
+
+def bbox_filter(west: float, south: float, east: float, north: float) -> Q:
+    """Điều kiện lọc xe trong khung: tiền tố geo_cell (dùng index) + khoảng lat/lng chính xác."""
+    cells = Q()
+    for prefix in cover_bbox(west, south, east, north):
+        cells |= Q(geo_cell__startswith=prefix)
+    return cells & Q(latitude__range=(south, north), longitude__range=(west, east))
@@ -0,0 +1,249 @@
+import itertools
+import json
+import re
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import timedelta
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .search import fold
+
+# Kết quả tìm thấy dùng lại trong 30 ngày; "không tìm thấy" chỉ 1 ngày (địa chỉ mới có thể được bổ sung)
+FOUND_TTL = timedelta(days=30)
+NOT_FOUND_TTL = timedelta(days=1)
+# Số câu truy vấn tối đa giữ trong cache; vượt thì xoá các câu lâu không dùng nhất (LRU).
+# Chỉ kiểm tra sau mỗi EVICT_EVERY câu mới của tiến trình (không quét index ở mỗi lần trượt cache)
+MAX_ENTRIES = 50000
+EVICT_EVERY = 500
+# Cập nhật last_used_at tối đa một lần trong khoảng này cho mỗi câu (lần trúng cache không phải ghi DB)
+TOUCH_INTERVAL = timedelta(hours=1)
+# Chờ lượt gọi nhà cung cấp của request khác (cùng câu truy vấn) tối đa bấy nhiêu giây
+COALESCE_TIMEOUT = 15
+MAX_QUERY_LENGTH = 255
+# Mỗi client (user hoặc IP) gây tối đa bấy nhiêu lượt trượt cache mỗi cửa sổ; trúng cache không giới hạn
+MISS_RATE_LIMIT = 10
+MISS_RATE_WINDOW = 60
+
+_WORD_RE = re.compile(r'[a-z0-9]+')
+
+DEFAULT_GEOCODER = {
+    'BACKEND': 'vehicles.geocoding.NominatimGeocoder',
+    'OPTIONS': {},
+}
+
+
+class GeocodingError(Exception):
+    """Nhà cung cấp geocoding lỗi/không phản hồi."""
+
+
+class GeocodingBusy(GeocodingError):
+    """Hàng đợi giãn cách lượt gọi nhà cung cấp đã đầy: thử lại sau."""
+
+
+class GeocodingRateLimited(GeocodingError):
+    """Client đã dùng hết lượt tra địa chỉ mới (trượt cache) trong cửa sổ hiện tại."""
+
+
+def normalize_query(query) -> str:
+    """Khoá cache của câu truy vấn: bỏ dấu, chữ thường, chỉ giữ chữ/số: '12 Lê Lợi, Q.1' -> '12 le loi q 1'."""
+    return ' '.join(_WORD_RE.findall(fold(query)))[:MAX_QUERY_LENGTH]
+
+
+class NominatimGeocoder:
+    """
+    Nhà cung cấp mặc định: Nominatim (OpenStreetMap). Chính sách sử dụng yêu cầu User-Agent riêng
+    và tối đa 1 request/giây -> các lần gọi trong tiến trình được giãn cách min_interval giây.
+    Mỗi lần gọi giữ chỗ một lượt rồi mới ngủ (ngoài lock); lượt phải chờ quá max_wait giây -> GeocodingBusy.
+    """
+
+    def __init__(self, url='https://nominatim.openstreetmap.org/search', user_agent='vehicle-rental-system',
+                 country_codes='vn', timeout=5, min_interval=1.0, max_wait=2.0):
+        self.url = url
+        self.user_agent = user_agent
+        self.country_codes = country_codes
+        self.timeout = timeout
+        self.min_interval = min_interval
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._last_call = 0.0
+
+    def geocode(self, query: str):
+        """(lat, lng, tên hiển thị) của kết quả tốt nhất, None nếu không tìm thấy; raise GeocodingError nếu lỗi."""
+        params = {'format': 'jsonv2', 'limit': 1, 'q': query}
+        if self.country_codes:
+            params['countrycodes'] = self.country_codes
+        request = urllib.request.Request(
+            f'{self.url}?{urllib.parse.urlencode(params)}', headers={'User-Agent': self.user_agent},
+        )
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._last_call + self.min_interval)
+            if slot - now > self.max_wait:
+                raise GeocodingBusy('Nominatim: quá nhiều lượt gọi đang chờ')
+            self._last_call = slot
+        if slot > now:
+            time.sleep(slot - now)
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                results = json.load(response)
+        except (urllib.error.URLError, TimeoutError, ValueError) as exc:
+            raise GeocodingError(f'Nominatim lỗi: {exc}') from exc
+        if not results:
+            return None
+        try:
+            best = results[0]
+            return float(best['lat']), float(best['lon']), best.get('display_name', '')
+        except (KeyError, TypeError, ValueError) as exc:
+            raise GeocodingError(f'Nominatim trả dữ liệu không hợp lệ: {exc}') from exc
+
+
+@lru_cache(maxsize=None)
+def _load_provider(backend: str, options: tuple):
+    return import_string(backend)(**dict(options))
+
+
+def get_provider():
+    """Nhà cung cấp theo settings.GEOCODER ({'BACKEND': dotted path, 'OPTIONS': {...}}), dùng chung trong tiến trình."""
+    config = getattr(settings, 'GEOCODER', DEFAULT_GEOCODER)
+    return _load_provider(config['BACKEND'], tuple(sorted(config.get('OPTIONS', {}).items())))
+
+
+class _Call:
+    """Một lượt gọi nhà cung cấp đang chạy: các request cùng câu truy vấn chờ và dùng chung kết quả."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+_calls = {}
+_calls_lock = threading.Lock()
+# Đếm số câu mới lưu trong tiến trình (next() trên itertools.count an toàn giữa các luồng)
+_inserts = itertools.count(1)
+
+
+def _is_fresh(entry, now) -> bool:
+    ttl = FOUND_TTL if entry.found else NOT_FOUND_TTL
+    return entry.fetched_at > now - ttl
+
+
+def _touch(entry, now):
+    """Ghi nhận lần dùng (cho LRU), giãn cách TOUCH_INTERVAL để lần trúng cache thường không phải ghi."""
+    from .models import GeocodeResult
+
+    if entry.last_used_at <= now - TOUCH_INTERVAL:
+        GeocodeResult.objects.filter(pk=entry.pk).update(last_used_at=now)
+        entry.last_used_at = now
+
+
+def _store(key, hit, now):
+    from .models import GeocodeResult
+
+    lat, lng, display_name = hit if hit is not None else (None, None, '')
+    values = {
+        'latitude': lat, 'longitude': lng, 'display_name': display_name,
+        'fetched_at': now, 'last_used_at': now,
+    }
+    try:
+        with transaction.atomic():
+            entry, created = GeocodeResult.objects.update_or_create(query=key, defaults=values)
+    except IntegrityError:
+        # Tiến trình khác vừa lưu cùng câu truy vấn
+        return GeocodeResult.objects.get(query=key)
+    if created and next(_inserts) % EVICT_EVERY == 0:
+        evict()
+    return entry
+
+
+def evict(max_entries: int = MAX_ENTRIES) -> int:
+    """Xoá các câu truy vấn lâu không dùng nhất khi cache vượt max_entries (đọc index last_used_at)."""
+    from .models import GeocodeResult
+
+    cutoff = list(
+        GeocodeResult.objects.order_by('-last_used_at')
+        .values_list('last_used_at', flat=True)[max_entries:max_entries + 1]
+    )
+    if not cutoff:
+        return 0
+    deleted, _ = GeocodeResult.objects.filter(last_used_at__lte=cutoff[0]).delete()
+    return deleted
+
+
+def _take_miss(client) -> bool:
+    """Trừ một lượt trượt cache của client (đếm trong cache dùng chung); False nếu đã hết lượt."""
+    if client is None:
+        return True
+    key = f'geocode-miss:{client}:{int(time.time() // MISS_RATE_WINDOW)}'
+    cache.add(key, 0, MISS_RATE_WINDOW)
+    try:
+        return cache.incr(key) <= MISS_RATE_LIMIT
+    except ValueError:
+        # Khoá vừa hết hạn giữa add và incr
+        return True
+
+
+def geocode(query: str, client=None):
+    """
+    Toạ độ của một địa chỉ, qua cache DB: trả về (GeocodeResult, có phải trúng cache hay không).
+    Trượt cache: chỉ MỘT lượt gọi nhà cung cấp cho mỗi câu truy vấn trong tiến trình, các request
+    đồng thời cùng câu chờ kết quả của lượt đó. Nhà cung cấp lỗi: dùng kết quả cũ (quá TTL) nếu có.
+    client (nếu có) bị giới hạn MISS_RATE_LIMIT lượt trượt cache mỗi MISS_RATE_WINDOW giây.
+    Raise ValueError nếu câu truy vấn rỗng, GeocodingError nếu lỗi và không có kết quả cũ.
+    """
+    from .models import GeocodeResult
+
+    key = normalize_query(query)
+    if not key:
+        raise ValueError('Thiếu địa chỉ cần tìm (q)')
+    now = timezone.now()
+    entry = GeocodeResult.objects.filter(query=key).first()
+    if entry is not None and _is_fresh(entry, now):
+        _touch(entry, now)
+        return entry, True
+    if not _take_miss(client):
+        if entry is not None:
+            return entry, True
+        raise GeocodingRateLimited('Tra quá nhiều địa chỉ mới, thử lại sau')
+
+    with _calls_lock:
+        call = _calls.get(key)
+        leader = call is None
+        if leader:
+            call = _calls[key] = _Call()
+
+    if not leader:
+        if not call.done.wait(COALESCE_TIMEOUT):
+            raise GeocodingError('Hết thời gian chờ nhà cung cấp geocoding')
+        if call.error is not None:
+            if entry is not None:
+                return entry, True
+            raise call.error
+        return call.result, False
+
+    try:
+        hit = get_provider().geocode(' '.join(str(query).split()))
+        call.result = _store(key, hit, timezone.now())
+        return call.result, False
+    except GeocodingError as exc:
+        call.error = exc
+        if entry is not None:
+            return entry, True
+        raise
+    except Exception as exc:
+        # Lỗi khác (DB...): request đang chờ cũng nhận lỗi thay vì kết quả rỗng
+        call.error = GeocodingError(str(exc))
+        raise
+    finally:
+        with _calls_lock:
+            _calls.pop(key, None)
+        call.done.set()
@@ -0,0 +1,239 @@
+import datetime
+from datetime import timedelta
+
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Avg
+from django.db.models.functions import TruncHour, TruncMinute
+from django.utils import timezone
+
+# Các tầng lưu trữ lịch sử vị trí (tính theo ngày UTC đã kết thúc):
+# điểm thô giữ 1 ngày, sau đó gộp theo phút; quá 30 ngày gộp theo giờ; quá 365 ngày xoá
+RAW_RETENTION = timedelta(days=1)
+MINUTE_RETENTION = timedelta(days=30)
+HISTORY_RETENTION = timedelta(days=365)
+# Điểm có ts lệch quá xa giờ server (đồng hồ thiết bị sai, điểm quá cũ) bị bỏ, không ghi vào lịch sử
+MAX_CLOCK_SKEW = timedelta(minutes=5)
+# Số partition tạo sẵn cho các ngày tới (job gộp điểm chạy định kỳ)
+PARTITIONS_AHEAD = 2
+
+UTC = datetime.timezone.utc
+
+def _table() -> str:
+    from .models import LocationPoint
+
+    return LocationPoint._meta.db_table
+
+
+def _day_start(day: datetime.date) -> datetime.datetime:
+    return datetime.datetime.combine(day, datetime.time.min, tzinfo=UTC)
+
+
+def _partition_name(day: datetime.date) -> str:
+    return f'{_table()}_p{day:%Y%m%d}'
+
+
+def ensure_partitions(days) -> None:
+    """PostgreSQL: tạo partition cho các ngày (UTC) chưa có; vendor khác không cần."""
+    if connection.vendor != 'postgresql':
+        return
+    names = {_partition_name(day): day for day in days}
+    with connection.cursor() as cursor:
+        # Một query kiểm tra catalog cho cả lô ngày
+        cursor.execute('SELECT name FROM unnest(%s::text[]) AS name WHERE to_regclass(name) IS NULL', [list(names)])
+        missing = [names[name] for (name,) in cursor.fetchall()]
+    quote = connection.ops.quote_name
+    for day in sorted(missing):
+        name = _partition_name(day)
+        start, end = _day_start(day), _day_start(day + timedelta(days=1))
+        try:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(
+                    f'CREATE TABLE IF NOT EXISTS {quote(name)} PARTITION OF {quote(_table())} '
+                    f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+                )
+        except DatabaseError:
+            # Tiến trình khác tạo cùng partition cùng lúc (IF NOT EXISTS vẫn có thể va chạm): bỏ qua
+            # nếu partition giờ đã có; lỗi khác (quyền, khoảng giá trị chồng lấn...) vẫn báo lên
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT to_regclass(%s) IS NOT NULL', [name])
+                if not cursor.fetchone()[0]:
+                    raise
+
+
+# Một câu INSERT ... SELECT FROM unnest(mảng) cho cả lô; bỏ điểm của xe không tồn tại
+_INSERT_POINTS_SQL = """
+INSERT INTO {table} (vehicle_id, recorded_at, latitude, longitude, resolution)
+SELECT d.id, d.recorded_at, d.lat, d.lng, %s
+FROM unnest(%s::bigint[], %s::timestamptz[], %s::double precision[], %s::double precision[])
+    AS d(id, recorded_at, lat, lng)
+WHERE EXISTS (SELECT 1 FROM {vehicles} v WHERE v.id = d.id)
+"""
+
+
+def record_positions(points, now=None) -> int:
+    """
+    Ghi lô điểm [(vehicle_id, lat, lng, ts)] (ts: epoch giây của thiết bị) vào lịch sử
+    với độ phân giải thô; trả về số điểm đã ghi.
+    """
+    from .models import LocationPoint, Vehicle
+
+    if not points:
+        return 0
+    now = now or timezone.now()
+    rows = []
+    for vehicle_id, lat, lng, ts in points:
+        try:
+            recorded_at = datetime.datetime.fromtimestamp(ts, UTC)
+        except (OverflowError, OSError, ValueError):
+            continue
+        # Không để điểm rơi vào ngày đã được gộp, hoặc vào tương lai
+        if now - RAW_RETENTION < recorded_at <= now + MAX_CLOCK_SKEW:
+            rows.append((vehicle_id, recorded_at, lat, lng))
+    if not rows:
+        return 0
+
+    if connection.vendor != 'postgresql':
+        existing = set(Vehicle.objects.filter(pk__in={row[0] for row in rows}).values_list('pk', flat=True))
+        return len(LocationPoint.objects.bulk_create([
+            LocationPoint(vehicle_id=vehicle_id, recorded_at=recorded_at, latitude=lat, longitude=lng)
+            for vehicle_id, recorded_at, lat, lng in rows
+            if vehicle_id in existing
+        ], batch_size=500))
+
+    ensure_partitions({recorded_at.date() for _, recorded_at, _, _ in rows})
+    quote = connection.ops.quote_name
+    sql = _INSERT_POINTS_SQL.format(table=quote(_table()), vehicles=quote(Vehicle._meta.db_table))
+    ids, times, lats, lngs = (list(column) for column in zip(*rows))
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [LocationPoint.RAW, ids, times, lats, lngs])
+        return cursor.rowcount
+
+
+def track(vehicle_id: int, start, end):
+    """
+    Lộ trình của một xe trong [start, end): (recorded_at, lat, lng) theo thời gian tăng dần.
+    Chỉ đọc các cột nằm trong index location_vehicle_time -> index-only scan trên từng partition.
+    """
+    from .models import LocationPoint
+
+    return (
+        LocationPoint.objects.filter(vehicle_id=vehicle_id, recorded_at__gte=start, recorded_at__lt=end)
+        .order_by('recorded_at')
+        .values_list('recorded_at', 'latitude', 'longitude')
+    )
+
+
+def _history_days() -> list:
+    """Các ngày (UTC) đang có lịch sử: trên PostgreSQL là các partition hiện có."""
+    from .models import LocationPoint
+
+    if connection.vendor == 'postgresql':
+        prefix = f'{_table()}_p'
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+                'WHERE i.inhparent = %s::regclass',
+                [_table()],
+            )
+            names = [name for (name,) in cursor.fetchall() if name.startswith(prefix)]
+        return sorted(datetime.datetime.strptime(name[len(prefix):], '%Y%m%d').date() for name in names)
+    return [moment.date() for moment in LocationPoint.objects.datetimes('recorded_at', 'day', tzinfo=UTC)]
+
+
+def _day_resolution(day: datetime.date):
+    """
+    Độ phân giải hiện tại của một ngày, None nếu ngày rỗng. Mỗi ngày chỉ có một độ phân giải:
+    điểm thô chỉ ghi vào ngày chưa gộp (xem record_positions) và việc gộp chạy trong một
+    transaction, nên đọc một dòng bất kỳ là đủ (không quét cả partition).
+    """
+    from .models import LocationPoint
+
+    start, end = _day_start(day), _day_start(day + timedelta(days=1))
+    return LocationPoint.objects.filter(recorded_at__gte=start, recorded_at__lt=end).values_list('resolution', flat=True).first()
+
+
+# Điều kiện theo khoảng recorded_at -> chỉ chạm partition của ngày đó
+_COMPACT_SQL = """
+INSERT INTO {table} (vehicle_id, recorded_at, latitude, longitude, resolution)
+SELECT vehicle_id, date_trunc(%s, recorded_at), avg(latitude), avg(longitude), %s
+FROM {table}
+WHERE recorded_at >= %s AND recorded_at < %s AND resolution < %s
+GROUP BY 1, 2
+"""
+_DELETE_COMPACTED_SQL = "DELETE FROM {table} WHERE recorded_at >= %s AND recorded_at < %s AND resolution < %s"
+
+
+def _compact_day(day: datetime.date, resolution: int) -> None:
+    """Gộp các điểm của một ngày về độ phân giải resolution (trung bình toạ độ theo xe, theo bucket)."""
+    from .models import LocationPoint
+
+    start, end = _day_start(day), _day_start(day + timedelta(days=1))
+    unit = 'minute' if resolution == LocationPoint.MINUTE else 'hour'
+    if connection.vendor == 'postgresql':
+        table = connection.ops.quote_name(_table())
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(_COMPACT_SQL.format(table=table), [unit, resolution, start, end, resolution])
+            cursor.execute(_DELETE_COMPACTED_SQL.format(table=table), [start, end, resolution])
+        if not connection.in_atomic_block:
+            # Cập nhật visibility map để truy vấn lộ trình tiếp tục là index-only scan
+            with connection.cursor() as cursor:
+                cursor.execute(f'VACUUM (ANALYZE) {connection.ops.quote_name(_partition_name(day))}')
+        return
+
+    trunc = TruncMinute if resolution == LocationPoint.MINUTE else TruncHour
+    old = LocationPoint.objects.filter(recorded_at__gte=start, recorded_at__lt=end, resolution__lt=resolution)
+    buckets = (
+        old.annotate(bucket=trunc('recorded_at', tzinfo=UTC))
+        .values('vehicle_id', 'bucket')
+        .annotate(lat=Avg('latitude'), lng=Avg('longitude'))
+        .order_by()
+    )
+    with transaction.atomic():
+        points = [
+            LocationPoint(vehicle_id=b['vehicle_id'], recorded_at=b['bucket'], latitude=b['lat'], longitude=b['lng'], resolution=resolution)
+            for b in buckets
+        ]
+        old.delete()
+        LocationPoint.objects.bulk_create(points, batch_size=500)
+
+
+def _drop_day(day: datetime.date) -> None:
+    from .models import LocationPoint
+
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS {connection.ops.quote_name(_partition_name(day))}')
+        return
+    start, end = _day_start(day), _day_start(day + timedelta(days=1))
+    LocationPoint.objects.filter(recorded_at__gte=start, recorded_at__lt=end).delete()
+
+
+def downsample(now=None) -> dict:
+    """
+    Job định kỳ (manage.py downsample_locations): tạo sẵn partition cho các ngày tới,
+    gộp các ngày đã qua theo tầng lưu trữ và xoá ngày quá HISTORY_RETENTION.
+    Trả về số ngày đã gộp theo phút / theo giờ và số ngày đã xoá.
+    """
+    from .models import LocationPoint
+
+    now = now or timezone.now()
+    today = now.astimezone(UTC).date()
+    ensure_partitions(today + timedelta(days=i) for i in range(PARTITIONS_AHEAD + 1))
+    result = {'minute': 0, 'hour': 0, 'dropped': 0}
+    for day in _history_days():
+        end = _day_start(day + timedelta(days=1))
+        if end <= now - HISTORY_RETENTION:
+            _drop_day(day)
+            result['dropped'] += 1
+            continue
+        if end <= now - MINUTE_RETENTION:
+            target, key = LocationPoint.HOUR, 'hour'
+        elif end <= now - RAW_RETENTION:
+            target, key = LocationPoint.MINUTE, 'minute'
+        else:
+            continue
+        current = _day_resolution(day)
+        if current is not None and current < target:
+            _compact_day(day, target)
+            result[key] += 1
+    return result
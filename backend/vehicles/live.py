@@ -0,0 +1,112 @@
+import itertools
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Max
+
+# Số sự kiện gần nhất giữ lại để client kết nối lại (Last-Event-ID) nhận bù
+HISTORY_SIZE = 1000
+# Xoá sự kiện cũ sau mỗi bấy nhiêu lần publish của tiến trình (không xoá ở mỗi lần ghi)
+PRUNE_EVERY = 100
+# Số sự kiện tối đa trả về mỗi lần poll (phần còn lại nhận ở lần poll sau)
+MAX_EVENTS_PER_POLL = 500
+# Mỗi kết nối chỉ nhận các sự kiện đang có rồi đóng (không giữ worker WSGI);
+# EventSource tự kết nối lại sau khoảng này (ms): short polling, thay đổi tới client chậm tối đa chừng đó
+RETRY_MS = 3000
+
+
+def format_event(event_type: str, data, event_id=None) -> str:
+    """Một sự kiện theo định dạng text/event-stream."""
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'event: {event_type}')
+    lines.append('data: ' + json.dumps(data, cls=DjangoJSONEncoder, separators=(',', ':')))
+    return '\n'.join(lines) + '\n\n'
+
+
+class EventHub:
+    """
+    Nhật ký sự kiện bản đồ trực tiếp trong bảng LiveEvent, dùng chung cho mọi worker: publish() ghi
+    một dòng (gọi được từ mọi luồng: signal, bộ đệm telemetry), id tự tăng là Last-Event-ID.
+    Client đọc bằng poll(): mỗi request SSE trả ngay các sự kiện mới hơn Last-Event-ID rồi đóng,
+    nên poll rơi vào worker nào cũng nhận tiếp đúng chỗ, và không chiếm worker WSGI.
+    """
+
+    def __init__(self, history_size: int = HISTORY_SIZE, prune_every: int = PRUNE_EVERY):
+        self.history_size = history_size
+        self.prune_every = prune_every
+        # next() trên itertools.count an toàn giữa các luồng
+        self._published = itertools.count(1)
+
+    @property
+    def last_id(self) -> int:
+        from .models import LiveEvent
+
+        return LiveEvent.objects.aggregate(last=Max('id'))['last'] or 0
+
+    def publish(self, event_type: str, data) -> int:
+        from .models import LiveEvent
+
+        event_id = LiveEvent.objects.create(event_type=event_type, data=data).id
+        if next(self._published) % self.prune_every == 0:
+            LiveEvent.objects.filter(id__lte=event_id - self.history_size).delete()
+        return event_id
+
+    def since(self, last_id: int):
+        """(các sự kiện có id > last_id, có bị mất sự kiện do lịch sử đã bị xoá hay không)."""
+        from .models import LiveEvent
+
+        if last_id and not LiveEvent.objects.filter(id=last_id).exists():
+            # Sự kiện client thấy cuối cùng đã bị xoá: không biết đã lỡ những gì
+            return [], True
+        events = (
+            LiveEvent.objects.filter(id__gt=last_id).order_by('id')
+            .values_list('id', 'event_type', 'data')[:MAX_EVENTS_PER_POLL]
+        )
+        return list(events), False
+
+    def poll(self, last_event_id=None) -> str:
+        """
+        Nội dung text/event-stream cho một lần kết nối: các sự kiện sau last_event_id
+        (mặc định: không có gì, bắt đầu từ bây giờ) và một heartbeat mang id để lần sau nối tiếp.
+        """
+        chunks = [f'retry: {RETRY_MS}\n\n']
+        try:
+            last_id = int(last_event_id)
+        except (TypeError, ValueError):
+            last_id = None
+        if last_id is None:
+            last_id = self.last_id
+        else:
+            events, missed = self.since(last_id)
+            if missed:
+                # Client đứng quá lâu (hoặc id lạ): không bù được, yêu cầu tải lại toàn bộ khung nhìn
+                chunks.append(format_event('reset', {}))
+                last_id = self.last_id
+            for event_id, event_type, data in events:
+                chunks.append(format_event(event_type, data, event_id))
+                last_id = event_id
+        chunks.append(format_event('heartbeat', {}, last_id))
+        return ''.join(chunks)
+
+
+hub = EventHub()
+
+
+def publish_vehicle(vehicle):
+    """Trạng thái/vị trí mới của một xe (sau khi lưu)."""
+    hub.publish('vehicle', {
+        'id': vehicle.pk,
+        'status': vehicle.status,
+        'lat': vehicle.latitude,
+        'lng': vehicle.longitude,
+    })
+
+
+def publish_positions(rows):
+    """Vị trí mới của nhiều xe sau một lần ghi telemetry: một sự kiện dạng cột cho cả lô."""
+    if not rows:
+        return
+    ids, lats, lngs = zip(*((vehicle_id, lat, lng) for vehicle_id, lat, lng, *_ in rows))
+    hub.publish('positions', {'id': list(ids), 'lat': list(lats), 'lng': list(lngs)})
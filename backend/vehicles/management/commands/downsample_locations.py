@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from vehicles.history import downsample
+
+
+class Command(BaseCommand):
+    help = "Gộp lịch sử vị trí xe theo tầng lưu trữ (thô -> phút -> giờ), xoá ngày quá hạn, tạo sẵn partition. Chạy định kỳ (cron, VD mỗi giờ)"
+
+    def handle(self, *args, **options):
+        result = downsample()
+        self.stdout.write(self.style.SUCCESS(
+            f"Đã gộp {result['minute']} ngày theo phút, {result['hour']} ngày theo giờ, xoá {result['dropped']} ngày."
+        ))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from reviews.models import Review
+from vehicles.cache import bump_fleet_version
+from vehicles.models import Vehicle
+from vehicles.stats import rebuild_rating_stats
+
+
+class Command(BaseCommand):
+    help = "Tính lại thống kê đánh giá (rating_sum, review_count, rating_avg) của mọi xe từ bảng Review"
+
+    def handle(self, *args, **options):
+        updated = rebuild_rating_stats(Vehicle, Review)
+        # UPDATE hàng loạt không phát signal/auto_now -> tự vô hiệu hoá cache response và ETag
+        Vehicle.objects.update(updated_at=timezone.now())
+        bump_fleet_version()
+        self.stdout.write(self.style.SUCCESS(f"Đã cập nhật thống kê đánh giá cho {updated} xe."))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from bookings.models import Booking
+from vehicles.cache import bump_fleet_version
+from vehicles.models import Vehicle
+from vehicles.stats import rebuild_trip_stats
+
+
+class Command(BaseCommand):
+    help = "Tính lại số chuyến hoàn thành (trip_count) và độ phổ biến (popularity) của mọi xe từ bảng Booking. Chạy định kỳ (cron, VD mỗi đêm) để sửa sai lệch"
+
+    def handle(self, *args, **options):
+        updated = rebuild_trip_stats(Vehicle, Booking)
+        # bulk_update không phát signal -> tự vô hiệu hoá cache response
+        bump_fleet_version()
+        self.stdout.write(self.style.SUCCESS(f"Đã cập nhật thống kê chuyến thuê cho {updated} xe."))
@@ -0,0 +1,44 @@
+# Generated by Django 5.1.4 on 2026-10-18 16:17
+
+from django.db import migrations, models
+from django.db.models import Avg, Count, FloatField, IntegerField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def backfill_rating_stats(apps, schema_editor):
+    # Viết lại tại chỗ (không import vehicles.stats): migration phải giữ nguyên khi code app thay đổi
+    Vehicle = apps.get_model('vehicles', 'Vehicle')
+    Review = apps.get_model('reviews', 'Review')
+    reviews = Review.objects.filter(vehicle=OuterRef('pk')).order_by().values('vehicle')
+    Vehicle.objects.update(
+        rating_sum=Coalesce(Subquery(reviews.annotate(s=Sum('rating')).values('s')), 0, output_field=IntegerField()),
+        review_count=Coalesce(Subquery(reviews.annotate(c=Count('id')).values('c')), 0, output_field=IntegerField()),
+        rating_avg=Coalesce(Subquery(reviews.annotate(a=Avg('rating')).values('a')), 0.0, output_field=FloatField()),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vehicles', '0003_alter_vehicle_status'),
+        ('reviews', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vehicle',
+            name='rating_avg',
+            field=models.FloatField(db_index=True, default=0),
+        ),
+        migrations.AddField(
+            model_name='vehicle',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='vehicle',
+            name='review_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_rating_stats, migrations.RunPython.noop),
+    ]
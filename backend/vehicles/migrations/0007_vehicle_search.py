@@ -0,0 +1,83 @@
+# Generated by Django 5.1.4 on 2026-10-18 16:41
+
+import re
+import unicodedata
+
+from django.db import migrations, models
+
+# Index GIN: full-text trên to_tsvector('simple', search_text) (search_text đã bỏ dấu, tự cập nhật
+# khi lưu xe nên index luôn đồng bộ), trigram cho tên gõ sai và biển số gần đúng.
+# Chỉ áp dụng cho PostgreSQL (CSDL khác dùng tìm kiếm dự phòng trong vehicles/search.py).
+SEARCH_INDEX_SQL = """
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX vehicle_search_vector ON vehicles_vehicle USING gin (to_tsvector('simple', search_text));
+CREATE INDEX vehicle_search_text_trgm ON vehicles_vehicle USING gin (search_text gin_trgm_ops);
+CREATE INDEX vehicle_plate_key_trgm ON vehicles_vehicle USING gin (plate_key gin_trgm_ops);
+"""
+DROP_SEARCH_INDEX_SQL = """
+DROP INDEX IF EXISTS vehicle_plate_key_trgm;
+DROP INDEX IF EXISTS vehicle_search_text_trgm;
+DROP INDEX IF EXISTS vehicle_search_vector;
+"""
+
+
+# Bản sao cố định của fold/plate_key/search_document (vehicles/search.py) tại thời điểm viết migration
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+
+def _fold(text):
+    text = unicodedata.normalize('NFD', str(text or ''))
+    text = ''.join(ch for ch in text if unicodedata.category(ch) != 'Mn')
+    return text.replace('đ', 'd').replace('Đ', 'D').lower()
+
+
+def _plate_key(plate):
+    return ''.join(_TOKEN_RE.findall(_fold(plate)))
+
+
+def backfill_search_fields(apps, schema_editor):
+    Vehicle = apps.get_model('vehicles', 'Vehicle')
+    vehicles = list(Vehicle.objects.all())
+    for vehicle in vehicles:
+        parts = [
+            vehicle.name,
+            vehicle.license_plate,
+            _plate_key(vehicle.license_plate),
+            vehicle.get_vehicle_type_display(),
+            vehicle.description,
+        ]
+        vehicle.search_text = ' '.join(_fold(p) for p in parts if p)
+        vehicle.plate_key = _plate_key(vehicle.license_plate)
+    Vehicle.objects.bulk_update(vehicles, ['search_text', 'plate_key'], batch_size=500)
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(SEARCH_INDEX_SQL)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(DROP_SEARCH_INDEX_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vehicles', '0006_vehicle_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vehicle',
+            name='plate_key',
+            field=models.CharField(blank=True, default='', editable=False, max_length=20),
+        ),
+        migrations.AddField(
+            model_name='vehicle',
+            name='search_text',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.RunPython(backfill_search_fields, migrations.RunPython.noop),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.4 on 2026-10-18 18:05
+
+from django.db import migrations, models
+
+from vehicles.geo import geohash
+
+
+def backfill_geo_cell(apps, schema_editor):
+    Vehicle = apps.get_model('vehicles', 'Vehicle')
+    vehicles = list(Vehicle.objects.filter(latitude__isnull=False, longitude__isnull=False))
+    for vehicle in vehicles:
+        vehicle.geo_cell = geohash(vehicle.latitude, vehicle.longitude)
+    Vehicle.objects.bulk_update(vehicles, ['geo_cell'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vehicles', '0007_vehicle_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vehicle',
+            name='geo_cell',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=12),
+        ),
+        migrations.RunPython(backfill_geo_cell, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.1.4 on 2026-10-18 16:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# PostgreSQL: tạo lại bảng (đang rỗng) thành bảng chia partition theo ngày của recorded_at.
+# Khoá chính phải chứa cột partition -> (id, recorded_at); Django vẫn dùng id như khoá chính.
+# Index location_vehicle_time của CreateModel được Django tạo sau cùng (deferred SQL), tức là
+# trên bảng partition mới -> tự có trên mọi partition. Partition từng ngày được tạo khi ghi
+# (vehicles/history.py: ensure_partitions).
+PARTITION_SQL = """
+DROP TABLE vehicles_locationpoint;
+CREATE TABLE vehicles_locationpoint (
+    id bigserial NOT NULL,
+    vehicle_id bigint NOT NULL,
+    recorded_at timestamp with time zone NOT NULL,
+    latitude double precision NOT NULL,
+    longitude double precision NOT NULL,
+    resolution integer NOT NULL CHECK (resolution >= 0),
+    PRIMARY KEY (id, recorded_at)
+) PARTITION BY RANGE (recorded_at);
+"""
+
+
+def partition_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(PARTITION_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vehicles', '0008_vehicle_geo_cell'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LocationPoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('recorded_at', models.DateTimeField()),
+                ('latitude', models.FloatField()),
+                ('longitude', models.FloatField()),
+                ('resolution', models.PositiveIntegerField(default=0)),
+                ('vehicle', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='vehicles.vehicle')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['vehicle', 'recorded_at'], include=('latitude', 'longitude'), name='location_vehicle_time')],
+            },
+        ),
+        # Quay lui: bước CreateModel xoá bảng (kèm các partition)
+        migrations.RunPython(partition_table, migrations.RunPython.noop),
+    ]
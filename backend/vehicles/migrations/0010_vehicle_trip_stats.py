@@ -0,0 +1,55 @@
+# Generated by Django 5.1.4 on 2026-10-18 16:58
+
+from datetime import date
+
+from django.db import migrations, models
+from django.db.models import Count
+from django.utils import timezone
+
+# Cố định tại thời điểm viết migration (vehicles.stats có thể đổi về sau)
+POPULARITY_HALF_LIFE_DAYS = 30
+POPULARITY_EPOCH = date(2025, 1, 1)
+
+
+def backfill_trip_stats(apps, schema_editor):
+    Vehicle = apps.get_model('vehicles', 'Vehicle')
+    Booking = apps.get_model('bookings', 'Booking')
+    trips = {}
+    completed = (
+        Booking.objects.filter(status='completed').order_by()
+        .values_list('vehicle_id', 'end_date').annotate(n=Count('id'))
+    )
+    for vehicle_id, end_date, n in completed:
+        count, score = trips.get(vehicle_id, (0, 0.0))
+        weight = 2.0 ** ((end_date - POPULARITY_EPOCH).days / POPULARITY_HALF_LIFE_DAYS)
+        trips[vehicle_id] = (count + n, score + n * weight)
+
+    now = timezone.now()
+    changed = []
+    for vehicle in Vehicle.objects.filter(pk__in=trips).only('pk'):
+        vehicle.trip_count, vehicle.popularity = trips[vehicle.pk]
+        vehicle.updated_at = now
+        changed.append(vehicle)
+    Vehicle.objects.bulk_update(changed, ['trip_count', 'popularity', 'updated_at'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vehicles', '0009_location_history'),
+        ('bookings', '0005_booking_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vehicle',
+            name='popularity',
+            field=models.FloatField(db_index=True, default=0),
+        ),
+        migrations.AddField(
+            model_name='vehicle',
+            name='trip_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_trip_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-18 17:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vehicles', '0011_geocode_cache'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='vehicle',
+            name='status',
+            field=models.CharField(choices=[('available', 'Available'), ('booked', 'Booked'), ('in_use', 'In Use'), ('maintenance', 'Maintenance')], default='Available', max_length=20),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.1.4 on 2026-10-18 18:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vehicles', '0012_alter_vehicle_status_choices'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='vehicle',
+            name='vehicle_available_price',
+        ),
+        migrations.AddIndex(
+            model_name='vehicle',
+            index=models.Index(condition=models.Q(('status__in', ('available', 'Available'))), fields=['price_per_day'], name='vehicle_available_price'),
+        ),
+    ]
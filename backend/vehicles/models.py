@@ -1,6 +1,8 @@
 from django.db import models
+from django.core.serializers.json import DjangoJSONEncoder
 from users.models import User 
-from datetime import timedelta 
+from .geo import geohash
+from .search import plate_key, search_document
 
 # ============
 # 1. MODEL XE 
@@ -12,6 +14,14 @@ class Vehicle(models.Model):
         ('in_use', 'In Use'),
         ('maintenance', 'Maintenance'),
     ]
+    # Các giá trị status thực tế đang được ghi -> mã chuẩn ở trên: mặc định và trang quản trị ghi
+    # 'Available'/'Booked', API duyệt booking ghi 'rented'. Dùng để đếm gộp đúng (facet)
+    STATUS_ALIASES = {
+        'available': ('available', 'Available'),
+        'booked': ('booked', 'Booked', 'rented'),
+        'in_use': ('in_use',),
+        'maintenance': ('maintenance',),
+    }
 
     VEHICLE_TYPE_CHOICES = [
         ('bike', 'Bike'),
@@ -57,50 +67,115 @@ class Vehicle(models.Model):
     image = models.ImageField(upload_to='vehicles/', null=True, blank=True)
     description = models.TextField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Thời điểm sửa gần nhất: validator cho ETag/Last-Modified của API (xem vehicles/conditional.py)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    # --- THỐNG KÊ ĐÁNH GIÁ (lưu sẵn, cập nhật theo Review: xem reviews/signals.py) ---
+    rating_sum = models.PositiveIntegerField(default=0)
+    review_count = models.PositiveIntegerField(default=0)
+    # Điểm trung bình = rating_sum / review_count, 0 khi chưa có đánh giá (có index để sắp xếp)
+    rating_avg = models.FloatField(default=0, db_index=True)
+
+    # --- THỐNG KÊ CHUYẾN THUÊ (lưu sẵn, cộng khi booking hoàn thành: xem vehicles/stats.py) ---
+    trip_count = models.PositiveIntegerField(default=0)
+    # Độ phổ biến đã neo theo mốc thời gian (chuyến gần đây nặng ký hơn); hiển thị qua stats.popularity_at
+    popularity = models.FloatField(default=0, db_index=True)
+
+    # --- TÌM KIẾM (tự cập nhật trong save(), xem vehicles/search.py) ---
+    # Tên/biển số/loại/mô tả đã bỏ dấu; trên PostgreSQL có index GIN full-text + trigram trên cột này
+    search_text = models.TextField(blank=True, default='', editable=False)
+    # Biển số chỉ gồm chữ/số để so khớp gần đúng ('51H12345' ~ '51H-123.45')
+    plate_key = models.CharField(max_length=20, blank=True, default='', editable=False)
+
+    # --- BẢN ĐỒ (tự cập nhật trong save(), xem vehicles/geo.py) ---
+    # Geohash của toạ độ: API bản đồ lọc theo tiền tố ô phủ khung nhìn, rỗng nếu xe chưa có toạ độ
+    geo_cell = models.CharField(max_length=12, blank=True, default='', editable=False, db_index=True)
+
+    @property
+    def avg_rating(self):
+        """Điểm trung bình làm tròn 1 chữ số, None nếu chưa có đánh giá"""
+        return round(self.rating_avg, 1) if self.review_count else None
+
+    @property
+    def popularity_score(self):
+        """Độ phổ biến hiện tại: số chuyến quy đổi theo độ gần đây (chuyến hôm nay = 1)"""
+        from .stats import popularity_at
+        return popularity_at(self.popularity)
+
+    class Meta:
+        # Index khớp với các query nóng (kiểm tra bằng EXPLAIN trong bookings/tests.py)
+        indexes = [
+            models.Index(fields=['status'], name='vehicle_status'),
+            # Danh sách xe lọc "còn xe": partial index chỉ chứa xe available (cả mã cũ, = STATUS_ALIASES['available']), sắp theo giá
+            models.Index(fields=['price_per_day'], condition=models.Q(status__in=('available', 'Available')), name='vehicle_available_price'),
+            models.Index(fields=['vehicle_type', 'price_per_day'], name='vehicle_type_price'),
+            # Bản đồ: chỉ xe có toạ độ
+            models.Index(
+                fields=['latitude', 'longitude'],
+                condition=models.Q(latitude__isnull=False, longitude__isnull=False),
+                name='vehicle_located_lat_lng',
+            ),
+        ]
+
+    # --- TỰ ĐỘNG XÁC ĐỊNH SỐ CHỖ / NHIÊN LIỆU DỰA TRÊN LOẠI XE ---
+    # Một bảng ánh xạ dùng cho cả property (Python) và biểu thức CASE của số chỗ (SQL: lọc, facet)
+    SEATS_BY_TYPE = {'car_7': 7, 'car_4': 4}
+    DEFAULT_SEATS = 2  # Mặc định cho 'bike'
+    FUEL_BY_TYPE = {'bike': "Điện/Xăng"}
+    DEFAULT_FUEL = "Xăng"
 
-    # --- TỰ ĐỘNG XÁC ĐỊNH SỐ CHỖ DỰA TRÊN LOẠI XE ---
     @property
     def seats(self):
         """Trả về số lượng chỗ ngồi thực tế dựa trên vehicle_type để hiển thị UI"""
-        if self.vehicle_type == 'car_7':
-            return 7
-        elif self.vehicle_type == 'car_4':
-            return 4
-        return 2  # Mặc định cho 'bike'
+        return self.SEATS_BY_TYPE.get(self.vehicle_type, self.DEFAULT_SEATS)
 
-    # --- TỰ ĐỘNG XÁC ĐỊNH NHIÊN LIỆU ---
     @property
     def fuel_display(self):
         """Trả về nhãn nhiên liệu tương ứng với từng loại xe"""
-        if self.vehicle_type == 'bike':
-            return "Điện/Xăng"
-        return "Xăng"
+        return self.FUEL_BY_TYPE.get(self.vehicle_type, self.DEFAULT_FUEL)
+
+    @classmethod
+    def seats_expression(cls):
+        """Số chỗ tính trong SQL, VD: Vehicle.objects.alias(seat_count=Vehicle.seats_expression())"""
+        return models.Case(
+            *[models.When(vehicle_type=t, then=models.Value(n)) for t, n in cls.SEATS_BY_TYPE.items()],
+            default=models.Value(cls.DEFAULT_SEATS),
+            output_field=models.IntegerField(),
+        )
+
+    # Các trường nguồn của search_text/plate_key và của geo_cell
+    SEARCH_SOURCE_FIELDS = {'name', 'license_plate', 'vehicle_type', 'description'}
+    GEO_SOURCE_FIELDS = {'latitude', 'longitude'}
+
+    @staticmethod
+    def geo_cell_for(latitude, longitude) -> str:
+        if latitude is None or longitude is None:
+            return ''
+        return geohash(latitude, longitude)
+
+    def save(self, *args, **kwargs):
+        self.search_text = search_document(self)
+        self.plate_key = plate_key(self.license_plate)
+        self.geo_cell = self.geo_cell_for(self.latitude, self.longitude)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            derived = set()
+            if self.SEARCH_SOURCE_FIELDS.intersection(update_fields):
+                derived |= {'search_text', 'plate_key'}
+            if self.GEO_SOURCE_FIELDS.intersection(update_fields):
+                derived.add('geo_cell')
+            if derived:
+                kwargs['update_fields'] = {*update_fields, *derived}
+        super().save(*args, **kwargs)
 
-    # --- HÀM TÍNH TỔNG TIỀN: DUYỆT TỪNG NGÀY ĐỂ TÍNH PHỤ PHÍ CHÍNH XÁC ---
+    # --- HÀM TÍNH TỔNG TIỀN: DÙNG CHUNG BỘ TÍNH GIÁ (bookings/pricing.py) ---
     def calculate_total_price(self, pickup_date, return_date):
-        """Tính tổng tiền: Từng ngày một + 20% phụ phí nếu rơi vào Thứ 7/CN"""
+        """Tính tổng tiền: ngày thường + 20% phụ phí cho Thứ 7/CN, đếm ngày bằng công thức O(1)"""
         if not pickup_date or not return_date:
             return self.price_per_day
-            
-        delta = return_date - pickup_date
-        total_days = delta.days if delta.days > 0 else 1
-        
-        total_amount = 0
-        current_date = pickup_date
-        daily_price = float(self.price_per_day)
-
-        # Duyệt qua từng ngày trong khoảng thời gian thuê để kiểm tra cuối tuần
-        for i in range(total_days):
-            # weekday() trả về 5 cho Thứ 7 và 6 cho Chủ nhật
-            if current_date.weekday() >= 5:
-                total_amount += daily_price * 1.2  # Áp dụng phụ phí 20% cho ngày này
-            else:
-                total_amount += daily_price  # Giá ngày thường
-            
-            # Nhảy sang ngày tiếp theo để kiểm tra
-            current_date += timedelta(days=1)
-            
-        return total_amount
+
+        from bookings.pricing import total_price
+        return total_price(self.price_per_day, pickup_date, return_date)
 
     def __str__(self):
         return f"{self.name} - {self.license_plate}"
@@ -113,4 +188,82 @@ class VehicleImage(models.Model):
     image = models.ImageField(upload_to='vehicle_gallery/', verbose_name="Ảnh chi tiết")
 
     def __str__(self):
-        return f"Ảnh của xe {self.vehicle.name}"
\ No newline at end of file
+        return f"Ảnh của xe {self.vehicle.name}"
+
+# ==========================
+# 3. LỊCH SỬ VỊ TRÍ XE
+# ==========================
+class LocationPoint(models.Model):
+    """
+    Một điểm trong lịch sử vị trí xe (ghi theo lô từ telemetry, xem vehicles/history.py).
+    Trên PostgreSQL bảng được chia partition theo ngày (UTC); điểm cũ được gộp dần
+    (thô -> theo phút -> theo giờ) và partition quá hạn bị xoá hẳn.
+    """
+
+    # Độ phân giải (giây mỗi bucket) của điểm: 0 = điểm thô
+    RAW = 0
+    MINUTE = 60
+    HOUR = 3600
+
+    # Không FK thật trong DB (partition theo ngày, xoá xe không quét lịch sử); index nằm ở Meta
+    vehicle = models.ForeignKey(
+        Vehicle,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        db_index=False,
+        related_name='+'
+    )
+    recorded_at = models.DateTimeField()
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+    resolution = models.PositiveIntegerField(default=RAW)
+
+    class Meta:
+        indexes = [
+            # Lộ trình một xe trong khoảng thời gian: index-only scan (toạ độ nằm trong index)
+            models.Index(fields=['vehicle', 'recorded_at'], include=['latitude', 'longitude'], name='location_vehicle_time'),
+        ]
+
+    def __str__(self):
+        return f"Xe #{self.vehicle_id} @ {self.recorded_at:%Y-%m-%d %H:%M:%S}"
+
+# ==============================
+# 4. CACHE GEOCODING (ĐỊA CHỈ)
+# ==============================
+class GeocodeResult(models.Model):
+    """
+    Kết quả geocoding đã lưu (xem vehicles/geocoding.py): câu truy vấn đã chuẩn hoá -> toạ độ.
+    Không tìm thấy cũng được lưu (latitude/longitude rỗng) để không hỏi lại nhà cung cấp.
+    """
+
+    query = models.CharField(max_length=255, unique=True)
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+    display_name = models.TextField(blank=True, default='')
+    # Thời điểm lấy từ nhà cung cấp (hết hạn theo TTL) và lần dùng gần nhất (xoá theo LRU)
+    fetched_at = models.DateTimeField()
+    last_used_at = models.DateTimeField(db_index=True)
+
+    @property
+    def found(self):
+        return self.latitude is not None and self.longitude is not None
+
+    def __str__(self):
+        return self.query
+
+# ==============================
+# 5. SỰ KIỆN BẢN ĐỒ TRỰC TIẾP
+# ==============================
+class LiveEvent(models.Model):
+    """
+    Nhật ký sự kiện của bản đồ trực tiếp (xem vehicles/live.py), dùng chung cho mọi worker:
+    id tăng dần là Last-Event-ID của client; chỉ giữ các sự kiện gần nhất.
+    """
+
+    id = models.BigAutoField(primary_key=True)
+    event_type = models.CharField(max_length=30)
+    data = models.JSONField(encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"#{self.id} {self.event_type}"
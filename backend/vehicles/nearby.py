@@ -0,0 +1,183 @@
+import math
+import threading
+import time
+
+import numpy as np
+
+# Kích thước ô lưới (độ) của chỉ mục không gian: 0.01° ~ 1.1km theo vĩ độ
+CELL_DEG = 0.01
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEG = math.pi * EARTH_RADIUS_KM / 180
+# Các worker khác không nhận được signal của nhau -> tự dựng lại sau khoảng này
+INDEX_TTL_SECONDS = 60
+
+
+def haversine_km(lat, lng, lats, lngs):
+    """Khoảng cách (km) từ một điểm tới mảng điểm (độ), tính vector hoá bằng NumPy."""
+    lat1, lng1 = math.radians(lat), math.radians(lng)
+    lat2, lng2 = np.radians(lats), np.radians(lngs)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def _cell(lat: float, lng: float) -> tuple:
+    return math.floor(lat / CELL_DEG), math.floor(lng / CELL_DEG)
+
+
+class _Snapshot:
+    """Toạ độ các xe (mảng NumPy) + lưới ô -> chỉ số hàng của xe trong ô."""
+
+    def __init__(self, vehicle_ids, lats, lngs):
+        self.vehicle_ids = vehicle_ids
+        self.lats = lats
+        self.lngs = lngs
+        self.rows = {vid: i for i, vid in enumerate(vehicle_ids.tolist())}
+        cells = {}
+        for i, (lat, lng) in enumerate(zip(lats.tolist(), lngs.tolist())):
+            cells.setdefault(_cell(lat, lng), []).append(i)
+        self.cells = {key: np.array(rows, dtype=np.int64) for key, rows in cells.items()}
+        if cells:
+            keys = np.array(list(cells))
+            self.min_cell, self.max_cell = keys.min(axis=0), keys.max(axis=0)
+        self.built_at = time.monotonic()
+
+    def ring(self, center: tuple, r: int):
+        """Chỉ số hàng của các xe trong các ô cách ô center đúng r ô (khoảng cách Chebyshev)."""
+        row0, col0 = center
+        if r == 0:
+            keys = [center]
+        else:
+            keys = [(row0 - r, col0 + c) for c in range(-r, r + 1)]
+            keys += [(row0 + r, col0 + c) for c in range(-r, r + 1)]
+            keys += [(row0 + c, col0 - r) for c in range(-r + 1, r)]
+            keys += [(row0 + c, col0 + r) for c in range(-r + 1, r)]
+        found = [self.cells[key] for key in keys if key in self.cells]
+        return np.concatenate(found) if found else None
+
+    def ring_bounds(self, center: tuple) -> tuple:
+        """(vòng đầu tiên có thể có xe, vòng phủ hết các ô có xe) quanh ô center."""
+        row0, col0 = center
+        first = max(0, row0 - self.max_cell[0], self.min_cell[0] - row0, col0 - self.max_cell[1], self.min_cell[1] - col0)
+        last = max(row0 - self.min_cell[0], self.max_cell[0] - row0, col0 - self.min_cell[1], self.max_cell[1] - col0)
+        return int(first), int(last)
+
+
+class NearbyIndex:
+    """
+    Chỉ mục không gian (lưới CELL_DEG) của các xe có toạ độ, trong bộ nhớ tiến trình.
+    Tìm k xe gần nhất bằng cách mở rộng dần từng vòng ô quanh điểm cần tìm, chỉ tính
+    haversine cho xe trong các ô đã duyệt. Dựng lại lười khi xe đổi vị trí hoặc quá INDEX_TTL_SECONDS.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+
+    def invalidate(self):
+        self._snapshot = None
+
+    def vehicle_moved(self, vehicle_id: int, lat, lng):
+        """Gọi sau khi lưu xe: chỉ huỷ chỉ mục nếu toạ độ thực sự khác với toạ độ đang giữ."""
+        snapshot = self._snapshot
+        if snapshot is None:
+            return
+        row = snapshot.rows.get(vehicle_id)
+        if row is None:
+            if lat is not None and lng is not None:
+                self.invalidate()
+            return
+        if lat is None or lng is None or (snapshot.lats[row], snapshot.lngs[row]) != (lat, lng):
+            self.invalidate()
+
+    def _build(self) -> _Snapshot:
+        from .models import Vehicle
+
+        rows = list(
+            Vehicle.objects.filter(latitude__isnull=False, longitude__isnull=False)
+            .order_by('id')
+            .values_list('id', 'latitude', 'longitude')
+        )
+        ids, lats, lngs = zip(*rows) if rows else ((), (), ())
+        return _Snapshot(
+            np.array(ids, dtype=np.int64),
+            np.array(lats, dtype=np.float64),
+            np.array(lngs, dtype=np.float64),
+        )
+
+    @staticmethod
+    def _is_stale(snapshot) -> bool:
+        return snapshot is None or time.monotonic() - snapshot.built_at > INDEX_TTL_SECONDS
+
+    def _current(self) -> _Snapshot:
+        snapshot = self._snapshot
+        if self._is_stale(snapshot):
+            with self._lock:
+                # Kiểm tra lại trong lock: request khác có thể vừa dựng xong trong lúc chờ
+                snapshot = self._snapshot
+                if self._is_stale(snapshot):
+                    snapshot = self._snapshot = self._build()
+        return snapshot
+
+    def nearest(self, lat: float, lng: float, k: int, radius_km: float = None) -> list:
+        """Danh sách (vehicle_id, khoảng cách km) của tối đa k xe gần nhất, tăng dần theo khoảng cách."""
+        snapshot = self._current()
+        if not snapshot.cells or k <= 0:
+            return []
+        center = _cell(lat, lng)
+        first_ring, last_ring = snapshot.ring_bounds(center)
+        found, count = [], 0
+        for r in range(first_ring, last_ring + 1):
+            # Phải duyệt nhiều ô hơn số ô có xe (điểm ở xa đội xe): tính thẳng trên toàn bộ mảng
+            if (2 * r + 1) ** 2 > 4 * len(snapshot.cells):
+                found, count = [np.arange(len(snapshot.vehicle_ids))], len(snapshot.vehicle_ids)
+                break
+            rows = snapshot.ring(center, r)
+            if rows is not None:
+                found.append(rows)
+                count += len(rows)
+            # Xe ngoài r vòng đã duyệt cách điểm tìm ít nhất r ô (cạnh kinh độ co lại theo cos(vĩ độ))
+            edge_lat = min(89.0, abs(lat) + (r + 1) * CELL_DEG)
+            covered_km = r * CELL_DEG * KM_PER_DEG * math.cos(math.radians(edge_lat))
+            if radius_km is not None and covered_km >= radius_km:
+                break
+            if count >= k:
+                rows = np.concatenate(found)
+                distances = haversine_km(lat, lng, snapshot.lats[rows], snapshot.lngs[rows])
+                if np.partition(distances, k - 1)[k - 1] <= covered_km:
+                    break
+        if not found:
+            return []
+        rows = np.concatenate(found)
+        distances = haversine_km(lat, lng, snapshot.lats[rows], snapshot.lngs[rows])
+        if radius_km is not None:
+            keep = distances <= radius_km
+            rows, distances = rows[keep], distances[keep]
+        if len(distances) > k:
+            top = np.argpartition(distances, k - 1)[:k]
+            rows, distances = rows[top], distances[top]
+        order = np.argsort(distances, kind='stable')
+        return list(zip(snapshot.vehicle_ids[rows[order]].tolist(), distances[order].tolist()))
+
+
+index = NearbyIndex()
+
+
+def nearest_vehicles(queryset, lat: float, lng: float, k: int, radius_km: float = None) -> list:
+    """
+    k xe gần nhất thuộc queryset (đã lọc trạng thái/giá/lịch trống...): lấy ứng viên từ chỉ mục,
+    lọc bằng một query theo id (primary key); thiếu thì nới số ứng viên và lặp lại.
+    Trả về danh sách Vehicle theo khoảng cách tăng dần, mỗi xe có thêm thuộc tính distance_km.
+    """
+    want = k
+    while True:
+        candidates = index.nearest(lat, lng, want, radius_km)
+        vehicles = queryset.order_by().in_bulk([vid for vid, _ in candidates])
+        hits = [(vehicles[vid], distance) for vid, distance in candidates if vid in vehicles]
+        if len(hits) >= k or len(candidates) < want:
+            break
+        want *= 4
+    result = []
+    for vehicle, distance in hits[:k]:
+        vehicle.distance_km = round(distance, 3)
+        result.append(vehicle)
+    return result
@@ -0,0 +1,69 @@
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+
+def encode_cursor(values) -> str:
+    """Mã hoá giá trị khoá sắp xếp + id thành cursor dạng chuỗi (opaque với client)."""
+    raw = json.dumps(values, cls=DjangoJSONEncoder, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str) -> list:
+    """Giải mã cursor; raise ValueError nếu cursor không hợp lệ."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, UnicodeError) as exc:
+        raise ValueError('Cursor không hợp lệ') from exc
+    if not isinstance(values, list) or not values:
+        raise ValueError('Cursor không hợp lệ')
+    return values
+
+
+def _cursor_value(queryset, field_name: str, value):
+    """Chuyển giá trị lấy từ cursor về kiểu của trường sắp xếp; raise ValueError nếu sai kiểu."""
+    field = queryset.model._meta.get_field(field_name)
+    if value is None or isinstance(value, (bool, list, dict)):
+        raise ValueError('Cursor không hợp lệ')
+    try:
+        return field.to_python(value)
+    except (ValidationError, TypeError, ValueError) as exc:
+        raise ValueError('Cursor không hợp lệ') from exc
+
+
+def keyset_page(queryset, key: str, descending: bool, cursor: str, page_size: int):
+    """
+    Phân trang keyset theo (key, id): trang nào cũng chỉ là một query
+    WHERE (key, id) > (giá trị cuối trang trước) ORDER BY key, id LIMIT page_size + 1,
+    không COUNT(*) và không OFFSET.
+    Trả về (danh sách bản ghi, cursor trang sau hoặc None).
+    """
+    op = 'lt' if descending else 'gt'
+    if cursor:
+        values = decode_cursor(cursor)
+        if len(values) != (1 if key == 'id' else 2):
+            raise ValueError('Cursor không hợp lệ')
+        last_id = _cursor_value(queryset, 'id', values[-1])
+        if key == 'id':
+            queryset = queryset.filter(**{f'id__{op}': last_id})
+        else:
+            value = _cursor_value(queryset, key, values[0])
+            queryset = queryset.filter(
+                Q(**{f'{key}__{op}': value}) | Q(**{key: value, f'id__{op}': last_id})
+            )
+
+    ordering = [key, 'id'] if key != 'id' else ['id']
+    if descending:
+        ordering = [f'-{field}' for field in ordering]
+    rows = list(queryset.order_by(*ordering)[:page_size + 1])
+
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        next_cursor = encode_cursor([last.id] if key == 'id' else [getattr(last, key), last.id])
+    return rows, next_cursor
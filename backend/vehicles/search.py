@@ -0,0 +1,99 @@
+import re
+import unicodedata
+
+from django.db import connection
+from django.db.models import BooleanField, F, FloatField, Func, Q, Value
+
+# Index GIN full-text/trigram chỉ có trên PostgreSQL: xem migration vehicles/0007_vehicle_search.py
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+
+def fold(text) -> str:
+    """Bỏ dấu tiếng Việt + chữ thường: 'Đà Lạt' -> 'da lat'."""
+    text = unicodedata.normalize('NFD', str(text or ''))
+    text = ''.join(ch for ch in text if unicodedata.category(ch) != 'Mn')
+    return text.replace('đ', 'd').replace('Đ', 'D').lower()
+
+
+def plate_key(plate) -> str:
+    """Biển số chỉ giữ chữ/số: '51H-123.45' -> '51h12345' (so khớp không phụ thuộc dấu ngăn cách)."""
+    return ''.join(_TOKEN_RE.findall(fold(plate)))
+
+
+def search_document(vehicle) -> str:
+    """Văn bản tìm kiếm (đã bỏ dấu) của xe: tên, biển số, loại xe, mô tả."""
+    parts = [
+        vehicle.name,
+        vehicle.license_plate,
+        plate_key(vehicle.license_plate),
+        vehicle.get_vehicle_type_display(),
+        vehicle.description,
+    ]
+    return ' '.join(fold(p) for p in parts if p)
+
+
+class _ToTsVector(Func):
+    """to_tsvector('simple', ...): trùng biểu thức của index GIN vehicle_search_vector."""
+    function = 'to_tsvector'
+    template = "%(function)s('simple', %(expressions)s)"
+
+
+class _ToTsQuery(Func):
+    function = 'to_tsquery'
+    template = "%(function)s('simple', %(expressions)s)"
+
+
+class _Operator(Func):
+    """Toán tử hai ngôi trả về boolean (@@, % và <% của pg_trgm), dùng được trực tiếp trong filter()."""
+    template = '%(expressions)s'
+    output_field = BooleanField()
+
+    def __init__(self, left, operator, right):
+        super().__init__(left, right)
+        self.arg_joiner = f' {operator} '
+
+
+def _tokens(query: str):
+    return _TOKEN_RE.findall(fold(query))
+
+
+def search_vehicles(queryset, query: str, ranked: bool = True):
+    """
+    Lọc queryset xe theo từ khoá (không phân biệt dấu).
+    PostgreSQL: full-text (tiền tố từng từ) + trigram cho tên gõ sai và biển số gần đúng,
+    ranked=True thì sắp theo độ liên quan.
+    CSDL khác (SQLite khi test): mọi từ phải có trong search_text, hoặc biển số chứa từ khoá.
+    """
+    tokens = _tokens(query)
+    if not tokens:
+        return queryset
+    key = ''.join(tokens)
+    plate_match = Q(plate_key__contains=key)
+
+    if connection.vendor != 'postgresql':
+        words = Q()
+        for token in tokens:
+            words &= Q(search_text__contains=token)
+        queryset = queryset.filter(words | plate_match)
+        return queryset.order_by('name', 'id') if ranked else queryset
+
+    # Chỉ gồm [a-z0-9] nên ghép thẳng thành tsquery an toàn
+    tsquery = Value(' & '.join(f'{token}:*' for token in tokens))
+    folded = Value(' '.join(tokens))
+    matches = (
+        Q(_Operator(_ToTsVector(F('search_text')), '@@', _ToTsQuery(tsquery)))
+        | Q(_Operator(folded, '<%%', F('search_text')))
+        | Q(_Operator(F('plate_key'), '%%', Value(key)))
+        | plate_match
+    )
+    queryset = queryset.filter(matches)
+    if not ranked:
+        return queryset
+    return queryset.annotate(
+        search_rank=(
+            Func(_ToTsVector(F('search_text')), _ToTsQuery(tsquery), function='ts_rank', output_field=FloatField())
+            + Func(folded, F('search_text'), function='word_similarity', output_field=FloatField())
+            + Func(F('plate_key'), Value(key), function='similarity', output_field=FloatField())
+        )
+    ).order_by('-search_rank', 'id')
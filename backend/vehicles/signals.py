@@ -0,0 +1,59 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from bookings.models import Booking
+from reviews.models import Review
+from .cache import bump_fleet_version
+from .models import Vehicle, VehicleImage
+from .nearby import index as nearby_index
+from . import live
+
+
+@receiver([post_save, post_delete], sender=Vehicle)
+@receiver([post_save, post_delete], sender=VehicleImage)
+@receiver([post_save, post_delete], sender=Review)
+@receiver([post_save, post_delete], sender=Booking)
+def invalidate_fleet_cache(sender, **kwargs):
+    """
+    Dữ liệu đội xe thay đổi -> tăng phiên bản cache.
+    Tăng ngay (request hiện tại thấy dữ liệu mới) và sau commit
+    (bỏ response mà request khác cache từ dữ liệu trước khi commit).
+    """
+    bump_fleet_version()
+    transaction.on_commit(bump_fleet_version)
+
+
+@receiver([post_save, post_delete], sender=VehicleImage)
+def touch_vehicle_on_image_change(sender, instance, **kwargs):
+    """Ảnh chi tiết nằm trong payload chi tiết xe -> cập nhật updated_at của xe (đổi ETag)."""
+    Vehicle.objects.filter(pk=instance.vehicle_id).update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=Vehicle)
+def refresh_nearby_on_save(sender, instance, **kwargs):
+    """Xe đổi vị trí (hoặc mới có toạ độ) -> dựng lại chỉ mục tìm xe gần ở lần tìm tiếp theo."""
+    transaction.on_commit(lambda: nearby_index.vehicle_moved(instance.pk, instance.latitude, instance.longitude))
+
+
+@receiver(post_delete, sender=Vehicle)
+def refresh_nearby_on_delete(sender, **kwargs):
+    transaction.on_commit(nearby_index.invalidate)
+
+
+# Trường của xe mà bản đồ trực tiếp (SSE) cần biết khi thay đổi
+LIVE_FIELDS = {'status', 'latitude', 'longitude'}
+
+
+@receiver(post_save, sender=Vehicle)
+def publish_vehicle_change(sender, instance, created, update_fields=None, **kwargs):
+    """Trạng thái/vị trí xe đổi (duyệt/huỷ/hoàn thành booking, cập nhật toạ độ) -> đẩy tới bản đồ đang mở."""
+    if update_fields is None or LIVE_FIELDS.intersection(update_fields):
+        transaction.on_commit(lambda: live.publish_vehicle(instance))
+
+
+@receiver(post_delete, sender=Vehicle)
+def publish_vehicle_removed(sender, instance, **kwargs):
+    vehicle_id = instance.pk
+    transaction.on_commit(lambda: live.hub.publish('vehicle_removed', {'id': vehicle_id}))
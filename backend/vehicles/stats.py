@@ -0,0 +1,82 @@
+from datetime import date
+
+from django.db.models import Avg, Case, Count, F, FloatField, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+
+def rebuild_rating_stats(vehicle_model, review_model):
+    """
+    Tính lại rating_sum/review_count/rating_avg cho toàn bộ xe trong một câu UPDATE.
+    Nhận model làm tham số để dùng được cả trong migration (apps.get_model).
+    """
+    reviews = review_model.objects.filter(vehicle=OuterRef('pk')).order_by().values('vehicle')
+    return vehicle_model.objects.update(
+        rating_sum=Coalesce(Subquery(reviews.annotate(s=Sum('rating')).values('s')), 0, output_field=IntegerField()),
+        review_count=Coalesce(Subquery(reviews.annotate(c=Count('id')).values('c')), 0, output_field=IntegerField()),
+        rating_avg=Coalesce(Subquery(reviews.annotate(a=Avg('rating')).values('a')), 0.0, output_field=FloatField()),
+    )
+
+
+# Độ phổ biến = tổng trọng số các chuyến đã hoàn thành, trọng số giảm một nửa sau mỗi
+# POPULARITY_HALF_LIFE_DAYS ngày (tính theo ngày trả xe). Lưu dạng "neo" vào POPULARITY_EPOCH:
+# mỗi chuyến cộng 2^(số ngày từ mốc / chu kỳ bán rã), mọi xe cùng suy giảm theo một hệ số nên
+# giá trị lưu không cần cập nhật theo thời gian và sắp xếp theo cột này = sắp theo độ phổ biến hiện tại
+POPULARITY_HALF_LIFE_DAYS = 30
+POPULARITY_EPOCH = date(2025, 1, 1)
+
+
+def popularity_weight(trip_date: date) -> float:
+    """Trọng số (đã neo) của một chuyến kết thúc vào trip_date."""
+    return 2.0 ** ((trip_date - POPULARITY_EPOCH).days / POPULARITY_HALF_LIFE_DAYS)
+
+
+def popularity_at(score: float, today: date = None) -> float:
+    """Độ phổ biến hiện tại từ giá trị đã neo: số chuyến quy đổi (chuyến hôm nay = 1)."""
+    today = today or timezone.localdate()
+    return round(score / popularity_weight(today), 2)
+
+
+def record_trips(vehicle_model, trips) -> int:
+    """Cộng nhiều chuyến [(vehicle_id, trip_date)] (hoàn thành hàng loạt) trong một câu UPDATE, gom theo xe."""
+    totals = {}
+    for vehicle_id, trip_date in trips:
+        count, score = totals.get(vehicle_id, (0, 0.0))
+        totals[vehicle_id] = (count + 1, score + popularity_weight(trip_date))
+    if not totals:
+        return 0
+    return vehicle_model.objects.filter(pk__in=totals).update(
+        trip_count=F('trip_count') + Case(
+            *(When(pk=pk, then=Value(count)) for pk, (count, _) in totals.items()), output_field=IntegerField(),
+        ),
+        popularity=F('popularity') + Case(
+            *(When(pk=pk, then=Value(score)) for pk, (_, score) in totals.items()), output_field=FloatField(),
+        ),
+        updated_at=timezone.now(),
+    )
+
+
+def rebuild_trip_stats(vehicle_model, booking_model) -> int:
+    """
+    Tính lại trip_count/popularity của toàn bộ xe từ các booking completed; trả về số xe thay đổi.
+    Gom theo (xe, ngày trả) trong SQL rồi cộng trọng số ở Python (phép mũ khác nhau giữa các DB).
+    """
+    trips = {}
+    completed = (
+        booking_model.objects.filter(status='completed').order_by()
+        .values_list('vehicle_id', 'end_date').annotate(n=Count('id'))
+    )
+    for vehicle_id, end_date, n in completed:
+        count, score = trips.get(vehicle_id, (0, 0.0))
+        trips[vehicle_id] = (count + n, score + n * popularity_weight(end_date))
+
+    now = timezone.now()
+    changed = []
+    for vehicle in vehicle_model.objects.only('pk', 'trip_count', 'popularity'):
+        count, score = trips.get(vehicle.pk, (0, 0.0))
+        if (vehicle.trip_count, vehicle.popularity) != (count, score):
+            vehicle.trip_count, vehicle.popularity, vehicle.updated_at = count, score, now
+            changed.append(vehicle)
+    # Chỉ ghi (và đổi updated_at/ETag của) xe có số liệu thay đổi
+    vehicle_model.objects.bulk_update(changed, ['trip_count', 'popularity', 'updated_at'], batch_size=500)
+    return len(changed)
@@ -0,0 +1,243 @@
+import logging
+import math
+import threading
+import time
+
+from django.db import connection
+from django.utils import timezone
+
+from .cache import bump_fleet_version
+from .history import record_positions
+from .live import publish_positions
+from .nearby import index as nearby_index
+
+logger = logging.getLogger(__name__)
+
+# Ghi vị trí xuống DB sau tối đa khoảng này (tính từ điểm cũ nhất đang chờ)
+FLUSH_INTERVAL_SECONDS = 2.0
+# Đủ số xe đang chờ này thì ghi ngay trong request nhận dữ liệu
+MAX_PENDING = 5000
+# Số điểm tối đa mỗi request gửi lên
+MAX_POINTS_PER_BATCH = 10000
+FLUSH_BATCH_SIZE = 500
+# ts của thiết bị vượt giờ server quá khoảng này bị coi là sai (không để một điểm "tương lai" chặn các điểm sau)
+MAX_FUTURE_SKEW_SECONDS = 300
+# vehicle_id phải nằm trong phạm vi khoá chính bigint
+MAX_VEHICLE_ID = 2 ** 63 - 1
+
+
+def parse_point(point):
+    """[vehicle_id, lat, lng, ts] -> tuple đã chuẩn hoá; raise ValueError nếu sai."""
+    try:
+        vehicle_id, lat, lng, ts = point
+        vehicle_id, lat, lng, ts = int(vehicle_id), float(lat), float(lng), float(ts)
+    except (TypeError, ValueError):
+        raise ValueError('Điểm phải dạng [vehicle_id, lat, lng, ts]') from None
+    if not 0 < vehicle_id <= MAX_VEHICLE_ID:
+        raise ValueError('vehicle_id nằm ngoài phạm vi')
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        raise ValueError('Toạ độ nằm ngoài phạm vi')
+    if not math.isfinite(ts) or ts > time.time() + MAX_FUTURE_SKEW_SECONDS:
+        raise ValueError('ts phải là epoch giây hợp lệ, không ở tương lai')
+    return vehicle_id, lat, lng, ts
+
+
+# PostgreSQL: một câu UPDATE ... FROM unnest(mảng) cho cả lô (join theo id),
+# nhanh hơn nhiều so với CASE WHEN của bulk_update khi lô lớn
+_UPDATE_POSITIONS_SQL = """
+UPDATE {table} AS v
+SET {lat} = d.lat, {lng} = d.lng, {cell} = d.cell, {updated_at} = %s
+FROM unnest(%s::bigint[], %s::double precision[], %s::double precision[], %s::varchar[]) AS d(id, lat, lng, cell)
+WHERE v.{pk} = d.id
+"""
+
+
+def _write_positions(rows, now) -> int:
+    """Ghi [(vehicle_id, lat, lng, geo_cell)] + updated_at=now; trả về số dòng đã cập nhật."""
+    from .models import Vehicle
+
+    if connection.vendor != 'postgresql':
+        vehicles = [
+            Vehicle(pk=vehicle_id, latitude=lat, longitude=lng, geo_cell=cell, updated_at=now)
+            for vehicle_id, lat, lng, cell in rows
+        ]
+        return Vehicle.objects.bulk_update(
+            vehicles, ['latitude', 'longitude', 'geo_cell', 'updated_at'], batch_size=FLUSH_BATCH_SIZE
+        )
+
+    quote = connection.ops.quote_name
+
+    def column(name):
+        return quote(Vehicle._meta.get_field(name).column)
+
+    sql = _UPDATE_POSITIONS_SQL.format(
+        table=quote(Vehicle._meta.db_table), pk=column('id'), lat=column('latitude'),
+        lng=column('longitude'), cell=column('geo_cell'), updated_at=column('updated_at'),
+    )
+    ids, lats, lngs, cells = (list(column_values) for column_values in zip(*rows))
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [now, ids, lats, lngs, cells])
+        return cursor.rowcount
+
+
+class TelemetryBuffer:
+    """
+    Bộ đệm ghi trễ (write-behind) vị trí xe trong bộ nhớ tiến trình.
+    Chỉ giữ điểm mới nhất (theo ts) của mỗi xe; định kỳ ghi tất cả trong một lần (_write_positions).
+    Ghi khi: điểm cũ nhất chờ quá flush_interval (timer nền, hoặc request nhận dữ liệu kế tiếp),
+    hoặc số xe đang chờ đạt max_pending.
+    """
+
+    def __init__(self, flush_interval: float = FLUSH_INTERVAL_SECONDS, max_pending: int = MAX_PENDING, background: bool = True):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.background = background
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._timer = None
+        self._pending = {}
+        self._oldest_arrival = None
+        # ts của điểm đã ghi gần nhất mỗi xe: bỏ điểm đến muộn (cũ hơn)
+        self._flushed_ts = {}
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.started_at = time.monotonic()
+        self.received = 0
+        self.rejected = 0
+        self.coalesced = 0
+        self.flushes = 0
+        self.rows_written = 0
+        self.last_flush_at = None
+        self.last_flush_lag = None
+        self.last_flush_duration = None
+
+    def add(self, points) -> dict:
+        """Nhận một lô điểm thô; điểm sai bị bỏ qua và đếm vào rejected."""
+        accepted, rejected = 0, 0
+        now = time.monotonic()
+        with self._lock:
+            for point in points:
+                try:
+                    vehicle_id, lat, lng, ts = parse_point(point)
+                except ValueError:
+                    rejected += 1
+                    continue
+                accepted += 1
+                # Gộp: điểm cũ hơn điểm đang chờ/đã ghi bị bỏ, điểm mới hơn thay điểm đang chờ
+                current = self._pending.get(vehicle_id)
+                latest_ts = current[2] if current is not None else self._flushed_ts.get(vehicle_id)
+                if latest_ts is not None and ts <= latest_ts:
+                    self.coalesced += 1
+                    continue
+                if current is not None:
+                    self.coalesced += 1
+                self._pending[vehicle_id] = (lat, lng, ts)
+            if self._pending and self._oldest_arrival is None:
+                self._oldest_arrival = now
+                self._schedule()
+            self.received += accepted
+            self.rejected += rejected
+            due = len(self._pending) >= self.max_pending or (
+                self._oldest_arrival is not None and now - self._oldest_arrival >= self.flush_interval
+            )
+        flushed = self.flush() if due else 0
+        return {'accepted': accepted, 'rejected': rejected, 'pending': self.pending, 'flushed': flushed}
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def _schedule(self):
+        # Gọi khi đang giữ _lock, lúc bộ đệm chuyển từ rỗng sang có điểm
+        if self.background and self._timer is None:
+            self._timer = threading.Timer(self.flush_interval, self._flush_in_background)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _flush_in_background(self):
+        self._timer = None
+        try:
+            self.flush()
+        finally:
+            # Luồng riêng có kết nối DB riêng
+            connection.close()
+
+    def flush(self) -> int:
+        """Ghi vị trí mới nhất của các xe đang chờ; trả về số dòng đã ghi."""
+        from .models import Vehicle
+
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                oldest, self._oldest_arrival = self._oldest_arrival, None
+            if not pending:
+                return 0
+
+            started = time.monotonic()
+            now = timezone.now()
+            try:
+                # Bỏ điểm của xe không tồn tại ngay tại đây: không ghi, không trả lại bộ đệm
+                known = set(Vehicle.objects.filter(pk__in=list(pending)).values_list('pk', flat=True))
+                pending = {vehicle_id: point for vehicle_id, point in pending.items() if vehicle_id in known}
+                # Không đi qua save(): tự tính các trường suy ra từ toạ độ (geo_cell) và updated_at
+                rows = [
+                    (vehicle_id, lat, lng, Vehicle.geo_cell_for(lat, lng))
+                    for vehicle_id, (lat, lng, ts) in pending.items()
+                ]
+                written = _write_positions(rows, now) if rows else 0
+            except Exception:
+                self._restore(pending, oldest)
+                raise
+
+            with self._lock:
+                for vehicle_id, (lat, lng, ts) in pending.items():
+                    self._flushed_ts[vehicle_id] = ts
+                self.flushes += 1
+                self.rows_written += written
+                self.last_flush_at = timezone.now()
+                self.last_flush_lag = time.monotonic() - oldest
+                self.last_flush_duration = time.monotonic() - started
+
+        # Ghi thẳng không phát signal: tự làm mới cache response, chỉ mục tìm xe gần, bản đồ trực tiếp
+        bump_fleet_version()
+        nearby_index.invalidate()
+        publish_positions(rows)
+        # Lịch sử vị trí: ghi theo lô các điểm vừa ghi (kèm ts của thiết bị). Vị trí hiện tại đã ghi xong,
+        # lỗi ở đây chỉ mất điểm lịch sử của lô này, không làm request nhận dữ liệu lỗi theo
+        try:
+            record_positions([(vehicle_id, lat, lng, ts) for vehicle_id, (lat, lng, ts) in pending.items()], now)
+        except Exception:
+            logger.exception('Không ghi được lịch sử vị trí cho %d xe', len(pending))
+        return written
+
+    def _restore(self, pending: dict, oldest):
+        """Ghi lỗi: trả điểm về bộ đệm (trừ khi đã có điểm mới hơn) để lần sau ghi lại."""
+        with self._lock:
+            for vehicle_id, point in pending.items():
+                current = self._pending.get(vehicle_id)
+                if current is None or current[2] < point[2]:
+                    self._pending[vehicle_id] = point
+            if self._oldest_arrival is None or (oldest is not None and oldest < self._oldest_arrival):
+                self._oldest_arrival = oldest
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        elapsed = now - self.started_at
+        oldest = self._oldest_arrival
+        return {
+            'received': self.received,
+            'rejected': self.rejected,
+            'coalesced': self.coalesced,
+            'pending': self.pending,
+            'flushes': self.flushes,
+            'rows_written': self.rows_written,
+            'ingest_rate_per_second': round(self.received / elapsed, 1) if elapsed > 0 else None,
+            'pending_age_seconds': round(now - oldest, 3) if oldest is not None else None,
+            'last_flush_at': self.last_flush_at,
+            'last_flush_lag_seconds': round(self.last_flush_lag, 3) if self.last_flush_lag is not None else None,
+            'last_flush_duration_ms': round(self.last_flush_duration * 1000, 1) if self.last_flush_duration is not None else None,
+        }
+
+
+buffer = TelemetryBuffer()
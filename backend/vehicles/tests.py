@@ -1,13 +1,22 @@
-from django.test import TestCase, Client
-from django.contrib.auth.models import User
+from django.test import TestCase, TransactionTestCase, Client, override_settings
 from django.urls import reverse
+from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.utils import timezone
 from decimal import Decimal
 import json
 from PIL import Image
 import io
+from datetime import date, timedelta
+from unittest import skipUnless
 
-from .models import Vehicle, Review, VehicleImage
+from bookings.models import Booking
+from reviews.models import Review
+from users.models import User
+
+from .cache import cache_stats
+from .models import Vehicle, VehicleImage
 from .forms import ReviewForm, VehicleImageForm, MultipleImageUploadForm
 
 
@@ -18,27 +27,29 @@ class VehicleModelTest(TestCase):
         """Tạo dữ liệu test"""
         self.vehicle = Vehicle.objects.create(
             name="Toyota Camry 2024",
+            license_plate="51A-111.11",
             price_per_day=1000000,
-            is_available=True
+            status="available"
         )
     
     def test_vehicle_creation(self):
         """Test tạo xe mới"""
         self.assertEqual(self.vehicle.name, "Toyota Camry 2024")
         self.assertEqual(self.vehicle.price_per_day, 1000000)
-        self.assertTrue(self.vehicle.is_available)
+        self.assertEqual(self.vehicle.status, "available")
     
     def test_vehicle_str(self):
         """Test __str__ method"""
-        self.assertEqual(str(self.vehicle), "Toyota Camry 2024")
+        self.assertEqual(str(self.vehicle), "Toyota Camry 2024 - 51A-111.11")
     
     def test_vehicle_default_availability(self):
         """Test trạng thái mặc định là sẵn sàng"""
         vehicle = Vehicle.objects.create(
             name="Honda Civic",
+            license_plate="51A-222.22",
             price_per_day=800000
         )
-        self.assertTrue(vehicle.is_available)
+        self.assertEqual(vehicle.status.lower(), "available")
 
 
 class ReviewModelTest(TestCase):
@@ -155,8 +166,9 @@ class VehicleListAPITest(TestCase):
         for i in range(15):
             Vehicle.objects.create(
                 name=f"Xe số {i+1}",
+                license_plate=f"51L-{i:03d}.00",
                 price_per_day=500000 + (i * 100000),
-                is_available=(i % 2 == 0)
+                status="available" if i % 2 == 0 else "booked"
             )
     
     def test_vehicle_list_api_status_code(self):
@@ -183,14 +195,14 @@ class VehicleListAPITest(TestCase):
         response = self.client.get(reverse('vehicles:vehicle_list_api'), {'availability': 'available'})
         data = json.loads(response.content)
         for vehicle in data['vehicles']:
-            self.assertTrue(vehicle['is_available'])
+            self.assertEqual(vehicle['status'], 'available')
     
     def test_vehicle_list_api_filter_unavailable(self):
         """Test lọc xe đã thuê"""
         response = self.client.get(reverse('vehicles:vehicle_list_api'), {'availability': 'unavailable'})
         data = json.loads(response.content)
         for vehicle in data['vehicles']:
-            self.assertFalse(vehicle['is_available'])
+            self.assertNotEqual(vehicle['status'], 'available')
 
 
 class VehicleDetailAPITest(TestCase):
@@ -262,6 +274,11 @@ class AddReviewAPITest(TestCase):
             name="Toyota Camry 2024",
             price_per_day=1000000
         )
+        # Chỉ người đã hoàn thành chuyến đi mới được đánh giá
+        Booking.objects.create(
+            customer=self.user, vehicle=self.vehicle, start_date=date(2026, 1, 1),
+            end_date=date(2026, 1, 2), total_price=0, status='completed'
+        )
     
     def test_add_review_requires_login(self):
         """Test yêu cầu đăng nhập"""
@@ -398,6 +415,7 @@ class GetVehicleRatingAPITest(TestCase):
         """Test API khi không có review"""
         new_vehicle = Vehicle.objects.create(
             name="Xe mới",
+            license_plate="51A-999.99",
             price_per_day=500000
         )
         response = self.client.get(
@@ -484,4 +502,1016 @@ class MultipleImageUploadFormTest(TestCase):
     def test_form_fields(self):
         """Test form có đúng fields"""
         form = MultipleImageUploadForm()
-        self.assertIn('images', form.fields)
\ No newline at end of file
+        self.assertIn('images', form.fields)
+
+
+class VehicleAvailabilityAPITest(TestCase):
+    """Test cho API lịch bận/trống của một xe"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="khach", password="testpass123")
+        self.vehicle = Vehicle.objects.create(name="Vios", license_plate="51H-444.44", price_per_day=500000)
+        for start, end, status in [
+            (date(2026, 7, 3), date(2026, 7, 4), "approved"),
+            (date(2026, 7, 5), date(2026, 7, 6), "pending"),  # liền kề -> gộp
+            (date(2026, 7, 8), date(2026, 7, 9), "cancelled"),  # không tính
+            (date(2026, 7, 12), date(2026, 7, 20), "pending"),  # vượt biên -> cắt
+        ]:
+            Booking.objects.create(customer=self.user, vehicle=self.vehicle, start_date=start, end_date=end, total_price=0, status=status)
+        self.url = reverse("vehicles:vehicle_availability_api", kwargs={"pk": self.vehicle.pk})
+
+    def test_busy_free_and_earliest_window(self):
+        """Test gộp khoảng bận, phần bù và khoảng trống sớm nhất"""
+        with self.assertNumQueries(2):  # lấy xe + một query booking
+            data = self.client.get(self.url, {"from": "2026-07-01", "days": 15, "length": 4}).json()
+        self.assertEqual(data["busy"], [
+            {"start_date": "2026-07-03", "end_date": "2026-07-06"},
+            {"start_date": "2026-07-12", "end_date": "2026-07-15"},
+        ])
+        self.assertEqual(data["free"], [
+            {"start_date": "2026-07-01", "end_date": "2026-07-02"},
+            {"start_date": "2026-07-07", "end_date": "2026-07-11"},
+        ])
+        self.assertEqual(data["earliest_window"], {"start_date": "2026-07-07", "end_date": "2026-07-10"})
+
+    def test_no_window(self):
+        """Test không có khoảng trống đủ dài"""
+        data = self.client.get(self.url, {"from": "2026-07-01", "days": 15, "length": 6}).json()
+        self.assertIsNone(data["earliest_window"])
+
+    def test_invalid_params(self):
+        """Test tham số sai -> 400"""
+        self.assertEqual(self.client.get(self.url, {"from": "01/07/2026"}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {"days": 0}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {"days": 5, "length": 6}).status_code, 400)
+
+
+class ResponseCacheTest(TestCase):
+    """Test cho cache response theo phiên bản đội xe"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="khach", password="testpass123")
+        self.vehicle = Vehicle.objects.create(name="Vios", license_plate="51K-000.01", price_per_day=500000, latitude=10.77, longitude=106.70)
+        self.url = reverse("vehicles:vehicle_list_api")
+
+    def test_hit_after_miss_without_queries(self):
+        """Test lần gọi thứ hai trả từ cache, không query; thứ tự tham số không ảnh hưởng"""
+        first = self.client.get(self.url, {"sort": "price_asc", "page": "1"})
+        self.assertEqual(first["X-Cache"], "MISS")
+        with self.assertNumQueries(0):
+            second = self.client.get(f"{self.url}?page=1&sort=price_asc")
+        self.assertEqual(second["X-Cache"], "HIT")
+        self.assertEqual(second.json(), first.json())
+        stats = cache_stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+
+    def test_writes_invalidate(self):
+        """Test ghi Vehicle/Booking làm đổi phiên bản -> không trả dữ liệu cũ"""
+        detail = reverse("vehicles:vehicle_detail_api", kwargs={"pk": self.vehicle.pk})
+        self.client.get(self.url)
+        self.client.get(detail)
+        Vehicle.objects.create(name="Accent", license_plate="51K-000.02", price_per_day=600000)
+        response = self.client.get(self.url)
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual(len(response.json()["vehicles"]), 2)
+
+        self.vehicle.status = "maintenance"
+        self.vehicle.save()
+        self.assertEqual(self.client.get(detail).json()["vehicle"]["status"], "maintenance")
+
+        self.client.get(self.url)
+        Booking.objects.create(customer=self.user, vehicle=self.vehicle, start_date=date(2026, 1, 1), end_date=date(2026, 1, 2), total_price=0)
+        self.assertEqual(self.client.get(self.url)["X-Cache"], "MISS")
+
+    def test_errors_not_cached_and_map_cached(self):
+        """Test response lỗi không cache; API bản đồ chỉ query lần đầu"""
+        self.assertEqual(self.client.get(self.url, {"start_date": "x"}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {"start_date": "x"})["X-Cache"], "MISS")
+        map_url = reverse("vehicles:vehicle_map_api")
+        params = {"bbox": "106.6,10.7,106.8,10.8", "zoom": "13"}
+        self.client.get(map_url, params)
+        with self.assertNumQueries(0):
+            response = self.client.get(map_url, params)
+        self.assertEqual(response["X-Cache"], "HIT")
+        self.assertEqual([v["name"] for v in response.json()["vehicles"]], ["Vios"])
+
+    def test_stats_api_staff_only(self):
+        """Test API thống kê cache chỉ dành cho admin"""
+        url = reverse("vehicles:cache_stats_api")
+        self.client.login(username="khach", password="testpass123")
+        self.assertEqual(self.client.get(url).status_code, 403)
+        User.objects.create_user(username="admin", password="testpass123", is_staff=True)
+        self.client.login(username="admin", password="testpass123")
+        self.client.get(self.url)
+        data = self.client.get(url).json()
+        self.assertEqual(data["misses"], 1)
+
+
+class VehicleSearchTest(TestCase):
+    """Test cho tìm kiếm xe không phân biệt dấu và biển số gần đúng"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="khach", password="testpass123")
+        self.lux = Vehicle.objects.create(name="VinFast Lux A2.0", license_plate="51H-123.45", price_per_day=900000, vehicle_type="car_4")
+        self.wave = Vehicle.objects.create(name="Honda Wave", license_plate="59X1-678.90", price_per_day=150000, description="Xe máy đi Đà Lạt")
+        self.vios = Vehicle.objects.create(name="Toyota Vios", license_plate="30A-555.55", price_per_day=700000, vehicle_type="car_4")
+
+    def search(self, q):
+        from vehicles.search import search_vehicles
+        return set(search_vehicles(Vehicle.objects.all(), q).values_list("pk", flat=True))
+
+    def test_fold_and_plate_key(self):
+        from vehicles.search import fold, plate_key
+        self.assertEqual(fold("Đà Lạt Xe Điện"), "da lat xe dien")
+        self.assertEqual(plate_key("51H-123.45"), "51h12345")
+
+    def test_accent_insensitive_and_plate(self):
+        """Test tìm không dấu, tiền tố từ, biển số không có dấu ngăn cách"""
+        self.assertEqual(self.search("da lat"), {self.wave.pk})
+        self.assertEqual(self.search("Đà Lạt"), {self.wave.pk})
+        self.assertEqual(self.search("vinf"), {self.lux.pk})
+        self.assertEqual(self.search("51H12345"), {self.lux.pk})
+        self.assertEqual(self.search("123.45"), {self.lux.pk})
+        self.assertEqual(self.search("toyota vios"), {self.vios.pk})
+
+    def test_search_fields_follow_save(self):
+        """Test search_text cập nhật khi đổi tên, kể cả save(update_fields=...)"""
+        self.vios.name = "Mazda 3"
+        self.vios.save(update_fields=["name"])
+        self.assertEqual(self.search("mazda"), {self.vios.pk})
+        self.assertEqual(self.search("vios"), set())
+
+    def test_list_api_and_pages(self):
+        """Test ?q= ở API danh sách, trang chủ và đơn hàng của tôi"""
+        data = self.client.get(reverse("vehicles:vehicle_list_api"), {"q": "honda"}).json()
+        self.assertEqual([v["id"] for v in data["vehicles"]], [self.wave.pk])
+        response = self.client.get(reverse("frontend:home"), {"q": "vios"})
+        self.assertEqual(list(response.context["featured_vehicles"]), [self.vios])
+        response = self.client.get(reverse("frontend:vehicle_list"), {"q": "51h"})
+        self.assertEqual(list(response.context["vehicles"]), [self.lux])
+
+        Booking.objects.create(customer=self.user, vehicle=self.wave, start_date=date(2026, 1, 1), end_date=date(2026, 1, 2), total_price=0)
+        Booking.objects.create(customer=self.user, vehicle=self.lux, start_date=date(2026, 1, 1), end_date=date(2026, 1, 2), total_price=0)
+        self.client.login(username="khach", password="testpass123")
+        response = self.client.get(reverse("frontend:order_list"), {"q": "wave"})
+        self.assertEqual([b.vehicle_id for b in response.context["bookings"]], [self.wave.pk])
+
+    @skipUnless(connection.vendor == "postgresql", "trigram chỉ có trên PostgreSQL")
+    def test_fuzzy_and_ranked(self):
+        """Test gõ sai vẫn tìm được (trigram), kết quả sắp theo độ liên quan"""
+        from vehicles.search import search_vehicles
+        self.assertIn(self.lux.pk, self.search("vinfst"))
+        self.assertIn(self.lux.pk, self.search("51H12354"))
+        ranked = list(search_vehicles(Vehicle.objects.all(), "toyota vios").values_list("pk", flat=True))
+        self.assertEqual(ranked[0], self.vios.pk)
+
+
+class FacetCountsTest(TestCase):
+    """Test cho facet đếm xe theo loại/trạng thái/số chỗ/khoảng giá"""
+
+    def setUp(self):
+        cache.clear()
+        rows = [
+            ("bike", "available", 150000), ("bike", "booked", 250000), ("car_4", "available", 600000),
+            ("car_4", "available", 800000), ("car_7", "maintenance", 1200000), ("car_7", "available", 2000000),
+        ]
+        for i, (vehicle_type, status, price) in enumerate(rows):
+            Vehicle.objects.create(name=f"Xe {i}", license_plate=f"51F-{i:03d}.00", vehicle_type=vehicle_type, status=status, price_per_day=price)
+        self.url = reverse("vehicles:vehicle_list_api")
+
+    def test_seats_in_sql(self):
+        for v in Vehicle.objects.annotate(seat_count=Vehicle.seats_expression()):
+            self.assertEqual(v.seat_count, v.seats)
+
+    def test_status_facet_groups_legacy_values(self):
+        """Test facet trạng thái gộp 'Available' (mặc định) và 'rented' (API duyệt booking) vào mã chuẩn"""
+        from vehicles.views import _facet_counts
+
+        Vehicle.objects.create(name="Mặc định", license_plate="51F-900.00", price_per_day=100000)
+        Vehicle.objects.create(name="Đã duyệt", license_plate="51F-901.00", price_per_day=100000, status="rented")
+        facets = _facet_counts({})
+        self.assertEqual(facets["status"], {"available": 5, "booked": 2, "in_use": 0, "maintenance": 1})
+
+    def test_status_facet_matches_filtered_list(self):
+        """Test số đếm facet trạng thái bằng số xe trả về khi bấm facet đó (kể cả mã cũ 'Available')"""
+        Vehicle.objects.create(name="Mặc định", license_plate="51F-900.00", price_per_day=100000)
+        data = self.client.get(self.url, {"availability": "available", "facets": "1"}).json()
+        self.assertEqual(len(data["vehicles"]), data["facets"]["status"]["available"])
+        self.assertEqual(len(data["vehicles"]), 5)
+        unavailable = self.client.get(self.url, {"availability": "unavailable"}).json()["vehicles"]
+        self.assertEqual(len(unavailable), sum(n for s, n in data["facets"]["status"].items() if s != "available"))
+
+    def test_counts_one_query(self):
+        """Test facet không lọc chính nó, tính theo các bộ lọc khác, trong một query"""
+        from vehicles.views import _facet_counts
+
+        with self.assertNumQueries(1):
+            facets = _facet_counts({"availability": "available", "vehicle_type": "car_4"})
+        # Loại xe: chỉ theo trạng thái available
+        self.assertEqual(facets["vehicle_type"], {"bike": 1, "car_4": 2, "car_7": 1})
+        # Trạng thái: chỉ theo loại car_4
+        self.assertEqual(facets["status"], {"available": 2, "booked": 0, "in_use": 0, "maintenance": 0})
+        self.assertEqual(facets["seats"], {"2": 0, "4": 2, "7": 0})
+        self.assertEqual(facets["price"], {"under_300k": 0, "300k_700k": 1, "700k_1500k": 1, "over_1500k": 0})
+
+    def test_list_api_facets_and_seat_filter(self):
+        """Test ?facets=1 trả kèm facet; lọc ?seats= bằng biểu thức SQL"""
+        data = self.client.get(self.url, {"seats": "7", "facets": "1"}).json()
+        self.assertEqual({v["seats"] for v in data["vehicles"]}, {7})
+        self.assertEqual(data["facets"]["seats"], {"2": 2, "4": 2, "7": 2})
+        self.assertEqual(data["facets"]["price"]["over_1500k"], 1)
+        self.assertNotIn("facets", self.client.get(self.url).json())
+        self.assertEqual(self.client.get(self.url, {"seats": "x"}).status_code, 400)
+
+
+class VehicleMapAPITest(TestCase):
+    """Test cho API bản đồ theo khung nhìn (geohash trên Vehicle.geo_cell)"""
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse("vehicles:vehicle_map_api")
+        # Lưới 10x10 xe quanh TP.HCM, bước 0.01 độ
+        self.points = {}
+        for i in range(10):
+            for j in range(10):
+                lat, lng = 10.70 + i * 0.01, 106.60 + j * 0.01
+                v = Vehicle.objects.create(name=f"Xe {i}-{j}", license_plate=f"51M-{i}{j:02d}.00", price_per_day=500000, latitude=lat, longitude=lng)
+                self.points[v.id] = (lat, lng)
+        Vehicle.objects.create(name="Chưa định vị", license_plate="51M-999.99", price_per_day=500000)
+
+    def test_geohash_and_save(self):
+        """Test geohash chuẩn; geo_cell tự cập nhật khi lưu, kể cả save(update_fields=...)"""
+        from vehicles.geo import geohash
+
+        self.assertEqual(geohash(57.64911, 10.40744, 11), "u4pruydqqvj")
+        v = Vehicle.objects.get(name="Xe 0-0")
+        self.assertEqual(v.geo_cell, geohash(10.70, 106.60))
+        v.latitude = 21.03
+        v.save(update_fields=["latitude"])
+        v.refresh_from_db()
+        self.assertEqual(v.geo_cell, geohash(21.03, 106.60))
+        self.assertEqual(Vehicle.objects.get(name="Chưa định vị").geo_cell, "")
+
+    def test_bbox_matches_brute_force(self):
+        """Test mọi khung nhìn (nhỏ tới rất lớn) trả đúng tập xe nằm trong khung"""
+        boxes = [
+            (106.625, 10.725, 106.655, 10.745),
+            (106.6, 10.7, 106.69, 10.79),
+            (106.0, 10.0, 107.0, 11.0),
+            (-180, -90, 180, 90),
+        ]
+        for west, south, east, north in boxes:
+            data = self.client.get(self.url, {"bbox": f"{west},{south},{east},{north}", "zoom": "15"}).json()
+            expected = {pk for pk, (lat, lng) in self.points.items() if south <= lat <= north and west <= lng <= east}
+            self.assertEqual({v["id"] for v in data["vehicles"]}, expected, (west, south, east, north))
+            self.assertFalse(data["truncated"])
+
+    def test_truncated_and_errors(self):
+        """Test giới hạn số xe mỗi khung; bbox/zoom sai -> 400"""
+        from unittest import mock
+
+        with mock.patch("vehicles.views.MAP_MAX_RESULTS", 30):
+            data = self.client.get(self.url, {"bbox": "106,10,107,11"}).json()
+        self.assertEqual(len(data["vehicles"]), 30)
+        self.assertTrue(data["truncated"])
+        for params in ({}, {"bbox": "1,2,3"}, {"bbox": "107,10,106,11"}, {"bbox": "a,b,c,d"},
+                       {"bbox": "106,10,107,11", "zoom": "99"}, {"bbox": "106,10,107,11", "zoom": "x"}):
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, 400, params)
+            self.assertIn("detail", response.json())
+
+    def test_clusters_at_low_zoom(self):
+        """Test zoom nhỏ -> cụm gom bằng một query GROUP BY; cụm cộng lại đủ số xe; zoom lớn -> từng xe"""
+        Vehicle.objects.filter(name="Xe 0-0").update(status="booked")
+        # Mã do API duyệt booking ghi và mã mặc định viết hoa: vẫn được gộp vào trạng thái chuẩn
+        Vehicle.objects.filter(name="Xe 0-1").update(status="rented")
+        Vehicle.objects.filter(name="Xe 0-2").update(status="Available")
+        params = {"bbox": "106,10,107,11", "zoom": "9"}
+        with self.assertNumQueries(1):
+            data = self.client.get(self.url, params).json()
+        self.assertNotIn("vehicles", data)
+        clusters = data["clusters"]
+        self.assertEqual(sum(c["count"] for c in clusters), 100)
+        self.assertEqual(sum(c["statuses"].get("booked", 0) for c in clusters), 2)
+        self.assertEqual(sum(c["statuses"].get("available", 0) for c in clusters), 98)
+        self.assertTrue(all(sum(c["statuses"].values()) == c["count"] for c in clusters))
+        self.assertTrue(all(10.7 <= c["lat"] <= 10.8 and 106.6 <= c["lng"] <= 106.7 for c in clusters))
+        self.assertEqual(min(c["min_price"] for c in clusters), 500000)
+
+        # Zoom 12: ô nhỏ hơn -> nhiều cụm hơn
+        finer = self.client.get(self.url, {**params, "zoom": "12"}).json()["clusters"]
+        self.assertGreater(len(finer), len(clusters))
+        self.assertEqual(len(self.client.get(self.url, {**params, "zoom": "13"}).json()["vehicles"]), 100)
+
+    def test_clusters_invalidated_on_move(self):
+        """Test di chuyển xe ra khỏi khung làm cụm đã cache được tính lại"""
+        params = {"bbox": "106,10,107,11", "zoom": "9"}
+        self.client.get(self.url, params)
+        v = Vehicle.objects.get(name="Xe 0-0")
+        v.latitude = 21.03
+        v.save(update_fields=["latitude"])
+        response = self.client.get(self.url, params)
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual(sum(c["count"] for c in response.json()["clusters"]), 99)
+
+    def test_columnar_matches_objects(self):
+        """Test ?format=columnar: cùng dữ liệu với định dạng thường, status mã hoá từ điển, toạ độ số nguyên"""
+        Vehicle.objects.filter(name="Xe 0-0").update(status="in_use")
+        params = {"bbox": "106.6,10.7,106.65,10.75", "zoom": "15"}
+        objects = self.client.get(self.url, params).json()["vehicles"]
+        with self.assertNumQueries(1):
+            data = self.client.get(self.url, {**params, "format": "columnar"}).json()
+        self.assertEqual(data["count"], len(objects))
+        columns, scale = data["columns"], 10 ** data["coord_precision"]
+        self.assertEqual(sorted(data["statuses"]), ["Available", "in operation"])
+        for i, item in enumerate(objects):
+            self.assertEqual(columns["id"][i], item["id"])
+            self.assertEqual((columns["name"][i], columns["plate"][i]), (item["name"], item["plate"]))
+            self.assertIsInstance(columns["lat"][i], int)
+            self.assertAlmostEqual(columns["lat"][i] / scale, item["lat"], places=5)
+            self.assertAlmostEqual(columns["lng"][i] / scale, item["lng"], places=5)
+            self.assertEqual(data["statuses"][columns["status"][i]], item["status"])
+            self.assertEqual((columns["price"][i], columns["rating"][i]), (item["price"], item["rating"]))
+        self.assertEqual(self.client.get(self.url, {**params, "format": "xml"}).status_code, 400)
+
+    def test_map_page_does_not_embed_fleet(self):
+        """Test trang bản đồ không nhúng dữ liệu xe, chỉ trỏ tới API"""
+        response = self.client.get(reverse("frontend:map"))
+        self.assertContains(response, f'data-api-url="{self.url}"')
+        self.assertNotContains(response, "Xe 0-0")
+
+
+class NearestVehicleTest(TestCase):
+    """Test cho tìm xe gần nhất (chỉ mục lưới trong bộ nhớ + haversine)"""
+
+    def setUp(self):
+        import random
+
+        from vehicles.nearby import index
+
+        cache.clear()
+        index.invalidate()
+        rng = random.Random(7)
+        self.points = {}
+        for i in range(300):
+            lat, lng = 10.5 + rng.random() * 0.6, 106.4 + rng.random() * 0.6
+            v = Vehicle.objects.create(
+                name=f"Xe {i}", license_plate=f"51N-{i:03d}.00", latitude=lat, longitude=lng,
+                price_per_day=300000 + (i % 5) * 100000, status="available" if i % 3 else "maintenance",
+            )
+            self.points[v.id] = (lat, lng, v.price_per_day, v.status)
+        Vehicle.objects.create(name="Chưa định vị", license_plate="51N-999.99", price_per_day=100000)
+
+    def brute_force(self, lat, lng, keep=lambda p: True):
+        from vehicles.nearby import haversine_km
+
+        ids = [pk for pk, p in self.points.items() if keep(p)]
+        distances = haversine_km(lat, lng, [self.points[pk][0] for pk in ids], [self.points[pk][1] for pk in ids])
+        return sorted(zip(distances.tolist(), ids))
+
+    def test_index_matches_brute_force(self):
+        """Test k xe gần nhất khớp tính thẳng trên toàn bộ xe, kể cả điểm ở xa đội xe và có bán kính"""
+        from vehicles.nearby import index
+
+        for lat, lng in [(10.8, 106.7), (10.5, 106.4), (21.03, 105.85), (10.81, 106.69)]:
+            for k in (1, 5, 40):
+                expected = self.brute_force(lat, lng)[:k]
+                found = index.nearest(lat, lng, k)
+                self.assertEqual([vid for vid, _ in found], [vid for _, vid in expected], (lat, lng, k))
+        within = [vid for d, vid in self.brute_force(10.8, 106.7) if d <= 5]
+        self.assertEqual([vid for vid, _ in index.nearest(10.8, 106.7, 100, radius_km=5)], within)
+
+    def test_list_api_near_with_filters(self):
+        """Test ?near= trên API danh sách: sắp theo khoảng cách, kết hợp lọc trạng thái/giá"""
+        url = reverse("vehicles:vehicle_list_api")
+        params = {"near": "10.8,106.7", "k": "7", "availability": "available", "max_price": "500000"}
+        data = self.client.get(url, params).json()
+        expected = self.brute_force(10.8, 106.7, lambda p: p[3] == "available" and p[2] <= 500000)[:7]
+        self.assertEqual([v["id"] for v in data["vehicles"]], [vid for _, vid in expected])
+        for item, (distance, _) in zip(data["vehicles"], expected):
+            self.assertAlmostEqual(item["distance_km"], distance, places=2)
+        self.assertFalse(data["pagination"]["has_next"])
+        self.assertNotIn("distance_km", self.client.get(url).json()["vehicles"][0])
+
+    def test_nearest_api_and_refresh_on_move(self):
+        """Test API xe gần nhất; xe di chuyển -> chỉ mục dựng lại; tham số sai -> 400"""
+        url = reverse("vehicles:vehicle_nearest_api")
+        self.client.get(url, {"near": "21.03,105.85", "k": "1"})
+        vehicle = Vehicle.objects.get(name="Xe 10")
+        with self.captureOnCommitCallbacks(execute=True):
+            vehicle.latitude, vehicle.longitude = 21.0301, 105.8501
+            vehicle.save(update_fields=["latitude", "longitude"])
+        data = self.client.get(url, {"near": "21.03,105.85", "k": "1"}).json()
+        self.assertEqual(data["vehicles"][0]["id"], vehicle.id)
+        self.assertLess(data["vehicles"][0]["distance_km"], 0.05)
+        self.assertEqual(self.client.get(url, {"near": "21.03,105.85", "radius_km": "1", "k": "5"}).json()["vehicles"][0]["id"], vehicle.id)
+
+        for params in ({}, {"near": "abc"}, {"near": "91,0"}, {"near": "10,106", "k": "0"},
+                       {"near": "10,106", "k": "x"}, {"near": "10,106", "radius_km": "-1"}):
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 400, params)
+
+    def test_expired_index_rebuilt_once_under_concurrency(self):
+        """Test chỉ mục hết hạn: các request đồng thời chờ lock rồi dùng bản vừa dựng, chỉ dựng lại một lần"""
+        import threading
+        import time
+        from unittest import mock
+
+        import numpy as np
+
+        from vehicles.nearby import NearbyIndex, _Snapshot
+
+        nearby = NearbyIndex()
+        builds = []
+
+        def slow_build():
+            builds.append(1)
+            time.sleep(0.1)
+            return _Snapshot(np.array([], dtype=np.int64), np.array([]), np.array([]))
+
+        with mock.patch.object(nearby, "_build", side_effect=slow_build):
+            threads = [threading.Thread(target=nearby._current) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len(builds), 1)
+
+
+class TelemetryIngestTest(TestCase):
+    """Test cho API nhận vị trí xe theo lô và bộ đệm ghi trễ"""
+
+    def setUp(self):
+        from unittest import mock
+
+        from vehicles.telemetry import TelemetryBuffer
+
+        cache.clear()
+        self.buffer = TelemetryBuffer(flush_interval=3600, max_pending=100, background=False)
+        patcher = mock.patch("vehicles.telemetry.buffer", self.buffer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.vehicles = [
+            Vehicle.objects.create(name=f"Xe {i}", license_plate=f"51T-{i:03d}.00", price_per_day=500000, latitude=10.7, longitude=106.6)
+            for i in range(3)
+        ]
+        User.objects.create_user(username="gps", password="testpass123", is_staff=True)
+        self.client.login(username="gps", password="testpass123")
+        self.url = reverse("vehicles:telemetry_ingest_api")
+
+    def post(self, points):
+        import json
+
+        return self.client.post(self.url, json.dumps({"points": points}), content_type="application/json")
+
+    def test_coalesce_then_flush(self):
+        """Test chỉ giữ điểm mới nhất mỗi xe, chưa ghi DB tới khi flush; flush cập nhật geo_cell và cache"""
+        from vehicles.geo import geohash
+
+        a, b, c = self.vehicles
+        response = self.post([
+            [a.id, 10.80, 106.70, 100], [a.id, 10.81, 106.71, 105], [a.id, 10.79, 106.69, 101],
+            [b.id, 10.75, 106.65, 100], ["x", 1, 2, 3], [c.id, 200, 106, 1],
+        ])
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json(), {"accepted": 4, "rejected": 2, "pending": 2, "flushed": 0})
+        a.refresh_from_db()
+        self.assertEqual(a.latitude, 10.7)
+
+        map_url = reverse("vehicles:vehicle_map_api")
+        bbox = {"bbox": "106.69,10.79,106.72,10.82", "zoom": "15"}
+        self.assertEqual(self.client.get(map_url, bbox).json()["vehicles"], [])
+        old_updated_at = a.updated_at
+        self.assertEqual(self.buffer.flush(), 2)
+        a.refresh_from_db()
+        self.assertEqual((a.latitude, a.longitude, a.geo_cell), (10.81, 106.71, geohash(10.81, 106.71)))
+        self.assertGreater(a.updated_at, old_updated_at)
+        self.assertEqual([v["id"] for v in self.client.get(map_url, bbox).json()["vehicles"]], [a.id])
+
+        # Điểm đến muộn (cũ hơn điểm đã ghi) bị bỏ
+        self.post([[a.id, 1.0, 1.0, 90]])
+        self.assertEqual(self.buffer.pending, 0)
+        stats = self.client.get(reverse("vehicles:telemetry_stats_api")).json()
+        self.assertEqual((stats["received"], stats["rejected"], stats["coalesced"]), (5, 2, 3))
+        self.assertEqual((stats["flushes"], stats["rows_written"], stats["pending"]), (1, 2, 0))
+        self.assertIsNotNone(stats["last_flush_lag_seconds"])
+
+    def test_flush_when_buffer_full(self):
+        """Test đủ max_pending xe thì ghi ngay trong request; xe không tồn tại không làm lỗi lô"""
+        self.buffer.max_pending = 3
+        points = [[v.id, 10.9, 106.9, 1] for v in self.vehicles] + [[999999, 10.9, 106.9, 1]]
+        self.assertEqual(self.post(points).json()["flushed"], 3)
+        self.assertEqual(Vehicle.objects.filter(latitude=10.9).count(), 3)
+
+    def test_rejects_out_of_range_ids_and_timestamps(self):
+        """Test id ngoài bigint, ts không hữu hạn / ở tương lai bị từ chối; xe không tồn tại không quay lại bộ đệm"""
+        import time
+
+        a, b, c = self.vehicles
+        response = self.client.post(
+            self.url,
+            '{"points": [[%d, 10.9, 106.9, 1], [%d, 10.9, 106.9, 1e999], [%d, 10.9, 106.9, %d], [%d, 10.9, 106.9, 1]]}'
+            % (10 ** 20, a.id, b.id, time.time() + 86400, 999999),
+            content_type="application/json",
+        )
+        self.assertEqual(response.json(), {"accepted": 1, "rejected": 3, "pending": 1, "flushed": 0})
+        self.assertEqual(self.buffer.flush(), 0)
+        self.assertEqual(self.buffer.pending, 0)
+        # ts hợp lệ sau đó của a vẫn được nhận
+        self.post([[a.id, 10.9, 106.9, 2]])
+        self.assertEqual(self.buffer.flush(), 1)
+
+    def test_permissions_and_errors(self):
+        """Test chỉ admin được gửi; body sai -> 400"""
+        self.assertEqual(self.client.post(self.url, "khong-phai-json", content_type="application/json").status_code, 400)
+        self.assertEqual(self.client.post(self.url, '{"points": 1}', content_type="application/json").status_code, 400)
+        self.assertEqual(self.client.get(self.url).status_code, 405)
+        self.client.logout()
+        self.assertEqual(self.post([]).status_code, 403)
+
+    def test_session_ingest_requires_csrf_and_json(self):
+        """Test API admin (cookie session) bắt buộc CSRF token và application/json"""
+        body = '{"points": [[%d, 10.5, 106.5, 0]]}' % self.vehicles[0].id
+        self.assertEqual(self.client.post(self.url, body, content_type="text/plain").status_code, 415)
+        csrf_client = Client(enforce_csrf_checks=True)
+        csrf_client.login(username="gps", password="testpass123")
+        self.assertEqual(csrf_client.post(self.url, body, content_type="application/json").status_code, 403)
+        self.assertEqual(self.buffer.pending, 0)
+
+    def test_gateway_token(self):
+        """Test gateway GPS gửi bằng token riêng, không cần session/CSRF; token sai -> 401"""
+        url = reverse("vehicles:telemetry_gateway_api")
+        body = '{"points": [[%d, 10.5, 106.5, 0]]}' % self.vehicles[0].id
+        gateway = Client(enforce_csrf_checks=True)
+        with override_settings(TELEMETRY_TOKENS=["bi-mat"]):
+            ok = gateway.post(url, body, content_type="application/json", HTTP_AUTHORIZATION="Bearer bi-mat")
+            self.assertEqual(ok.status_code, 202)
+            self.assertEqual(ok.json()["accepted"], 1)
+            for header in ({}, {"HTTP_AUTHORIZATION": "Bearer sai"}, {"HTTP_AUTHORIZATION": "bi-mat"}):
+                self.assertEqual(gateway.post(url, body, content_type="application/json", **header).status_code, 401)
+            self.assertEqual(
+                gateway.post(url, body, content_type="text/plain", HTTP_AUTHORIZATION="Bearer bi-mat").status_code, 415
+            )
+        with override_settings(TELEMETRY_TOKENS=[]):
+            self.assertEqual(gateway.post(url, body, content_type="application/json", HTTP_AUTHORIZATION="Bearer ").status_code, 401)
+
+
+class LiveEventsTest(TestCase):
+    """Test cho nhật ký sự kiện dùng chung (bảng LiveEvent) và SSE bản đồ trực tiếp"""
+
+    def setUp(self):
+        from vehicles.live import EventHub
+
+        self.hub = EventHub(history_size=3, prune_every=1)
+        self.vehicle = Vehicle.objects.create(name="Vios", license_plate="51S-000.01", price_per_day=500000, latitude=10.7, longitude=106.6)
+
+    def test_poll_replays_and_resets(self):
+        """Test Last-Event-ID nhận bù sự kiện; lịch sử đã bị xoá hoặc id lạ -> reset"""
+        first = self.hub.publish("vehicle", {"id": 1})
+        second = self.hub.publish("vehicle", {"id": 2})
+        body = self.hub.poll(str(first))
+        self.assertTrue(body.startswith("retry:"))
+        self.assertIn(f'id: {second}\nevent: vehicle\ndata: {{"id":2}}\n\n', body)
+        self.assertNotIn('"id":1}', body)
+
+        for i in range(3, 7):
+            self.hub.publish("vehicle", {"id": i})
+        self.assertIn("event: reset", self.hub.poll(str(first)))
+        self.assertIn("event: reset", self.hub.poll(str(first + 999)))
+
+    def test_poll_heartbeat_carries_cursor(self):
+        """Test mỗi lần poll kết thúc bằng heartbeat mang id; không có/sai Last-Event-ID -> bắt đầu từ bây giờ"""
+        first = self.hub.publish("vehicle", {"id": 1})
+        for cursor in (None, "rac"):
+            body = self.hub.poll(cursor)
+            self.assertNotIn("event: vehicle", body)
+            self.assertNotIn("event: reset", body)
+            self.assertIn(f"id: {first}\nevent: heartbeat", body)
+        self.hub.publish("vehicle", {"id": 2})
+        self.assertIn('"id":2', self.hub.poll(str(first)))
+
+    def test_log_shared_between_workers(self):
+        """Test sự kiện publish ở một worker được poll ở worker khác nhận bù; lịch sử được cắt gọn"""
+        from vehicles.live import EventHub
+        from vehicles.models import LiveEvent
+
+        other = EventHub(history_size=3, prune_every=1)
+        first = self.hub.publish("vehicle", {"id": 1})
+        self.hub.publish("vehicle", {"id": 2})
+        self.assertIn('"id":2', other.poll(str(first)))
+
+        for i in range(3, 10):
+            other.publish("vehicle", {"id": i})
+        self.assertLessEqual(LiveEvent.objects.count(), 3)
+
+    def test_booking_approval_publishes_status(self):
+        """Test duyệt booking -> sự kiện trạng thái xe; endpoint SSE trả text/event-stream"""
+        from unittest import mock
+
+        from vehicles import live
+
+        with mock.patch.object(live, "hub", self.hub):
+            admin = User.objects.create_user(username="admin", password="testpass123", is_staff=True)
+            booking = Booking.objects.create(customer=admin, vehicle=self.vehicle, start_date=date(2030, 1, 1), end_date=date(2030, 1, 2), total_price=0)
+            self.client.login(username="admin", password="testpass123")
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(reverse("bookings:approve_booking", args=[booking.id]))
+            events, _ = self.hub.since(0)
+            self.assertIn(("vehicle", {"id": self.vehicle.id, "status": "rented", "lat": 10.7, "lng": 106.6}), [e[1:] for e in events])
+
+            response = self.client.get(reverse("vehicles:live_events_api"), HTTP_LAST_EVENT_ID="0")
+            self.assertEqual(response["Content-Type"], "text/event-stream")
+            self.assertEqual(response["Cache-Control"], "no-cache")
+            self.assertIn("event: vehicle", response.content.decode())
+
+
+class LocationHistoryTest(TestCase):
+    """Test cho lịch sử vị trí: ghi theo lô từ telemetry, gộp theo tầng, API lộ trình booking"""
+
+    def setUp(self):
+        from vehicles.telemetry import TelemetryBuffer
+
+        self.buffer = TelemetryBuffer(flush_interval=3600, background=False)
+        self.vehicle = Vehicle.objects.create(name="Vios", license_plate="51L-000.01", price_per_day=500000, latitude=10.7, longitude=106.6)
+        self.customer = User.objects.create_user(username="khach", password="testpass123")
+        self.booking = Booking.objects.create(
+            customer=self.customer, vehicle=self.vehicle, total_price=0,
+            start_date=timezone.localdate() - timedelta(days=60), end_date=timezone.localdate() + timedelta(days=1),
+        )
+
+    def test_flush_records_history(self):
+        """Test mỗi lần flush telemetry ghi lịch sử theo ts thiết bị; xe lạ bị bỏ"""
+        from vehicles.models import LocationPoint
+
+        now = timezone.now().timestamp()
+        self.buffer.add([[self.vehicle.id, 10.80, 106.70, now - 30], [999999, 10.8, 106.7, now]])
+        self.buffer.flush()
+        self.buffer.add([[self.vehicle.id, 10.81, 106.71, now - 10]])
+        self.buffer.flush()
+        # ts ở tương lai bị từ chối ngay khi nhận
+        self.assertEqual(self.buffer.add([[self.vehicle.id, 10.82, 106.72, 10 ** 12]])["rejected"], 1)
+        self.buffer.flush()
+        points = list(LocationPoint.objects.order_by("recorded_at").values_list("vehicle_id", "latitude", "recorded_at", "resolution"))
+        self.assertEqual([(p[0], p[1], p[3]) for p in points], [(self.vehicle.id, lat, 0) for lat in (10.80, 10.81)])
+        self.assertEqual(int(points[0][2].timestamp()), int(now - 30))
+
+    def test_drops_stale_and_future_points(self):
+        """Test điểm cũ hơn 1 ngày hoặc ở tương lai bị bỏ, không ghi theo giờ server"""
+        from vehicles import history
+        from vehicles.models import LocationPoint
+
+        now = timezone.now()
+        stale, future, fresh = (now.timestamp() + offset for offset in (-2 * 86400, 3600, -5))
+        points = [[self.vehicle.id, 10.8, 106.7, ts] for ts in (stale, future, fresh, float("nan"))]
+        self.assertEqual(history.record_positions(points, now), 1)
+        self.assertEqual(
+            [int(p.timestamp()) for p in LocationPoint.objects.values_list("recorded_at", flat=True)], [int(fresh)]
+        )
+
+    def test_history_failure_keeps_positions(self):
+        """Test lỗi ghi lịch sử không làm flush lỗi: vị trí hiện tại vẫn được ghi và không bị trả lại bộ đệm"""
+        from unittest import mock
+
+        self.buffer.add([[self.vehicle.id, 10.9, 106.9, timezone.now().timestamp()]])
+        with mock.patch("vehicles.telemetry.record_positions", side_effect=RuntimeError("hỏng")), self.assertLogs("vehicles.telemetry", "ERROR"):
+            self.assertEqual(self.buffer.flush(), 1)
+        self.vehicle.refresh_from_db()
+        self.assertEqual(self.vehicle.latitude, 10.9)
+        self.assertEqual(self.buffer.pending, 0)
+
+    def test_downsample_tiers_and_track(self):
+        """Test gộp thô -> phút (quá 1 ngày) -> giờ (quá 30 ngày), xoá quá 365 ngày; API lộ trình đọc đủ các tầng"""
+        import datetime as dt
+
+        from vehicles import history
+        from vehicles.models import LocationPoint
+
+        utc = dt.timezone.utc
+        now = dt.datetime.combine(timezone.now().astimezone(utc).date(), dt.time(12), tzinfo=utc)
+        old, older, oldest = (now - timedelta(days=days) for days in (3, 40, 400))
+        history.ensure_partitions({moment.date() for moment in (now, old, older, oldest)})
+        LocationPoint.objects.bulk_create([
+            LocationPoint(vehicle=self.vehicle, recorded_at=base + timedelta(seconds=s), latitude=10 + s / 1000, longitude=106, resolution=0)
+            for base in (now, old, older, oldest)
+            for s in (0, 20, 40, 70, 3700)
+        ])
+        self.assertEqual(history.downsample(now), {"minute": 1, "hour": 1, "dropped": 1})
+        # Chạy lại: không còn gì để gộp
+        self.assertEqual(history.downsample(now), {"minute": 0, "hour": 0, "dropped": 0})
+
+        def day(base):
+            points = (
+                LocationPoint.objects.filter(recorded_at__gte=base - timedelta(hours=12), recorded_at__lt=base + timedelta(hours=12))
+                .order_by("recorded_at").values_list("recorded_at", "latitude", "resolution")
+            )
+            return [(moment, round(lat, 6), resolution) for moment, lat, resolution in points]
+
+        self.assertEqual([p[2] for p in day(now)], [0] * 5)
+        self.assertEqual(day(old), [(old, 10.02, 60), (old + timedelta(minutes=1), 10.07, 60), (old + timedelta(hours=1, minutes=1), 13.7, 60)])
+        self.assertEqual(day(older), [(older, 10.0325, 3600), (older + timedelta(hours=1), 13.7, 3600)])
+        self.assertEqual(day(oldest), [])
+
+        self.client.login(username="khach", password="testpass123")
+        data = self.client.get(reverse("bookings:booking_track", args=[self.booking.id])).json()
+        self.assertEqual(data["vehicle"], self.vehicle.id)
+        self.assertEqual(len(data["t"]), 2 + 3 + 5)
+        self.assertEqual(data["t"], sorted(data["t"]))
+        self.assertEqual(data["t"][0], int(older.timestamp()))
+        self.assertEqual([round(lat, 6) for lat in data["lat"][:2]], [10.0325, 13.7])
+
+    def test_track_permissions(self):
+        """Test chỉ khách của booking hoặc admin xem được lộ trình"""
+        url = reverse("bookings:booking_track", args=[self.booking.id])
+        User.objects.create_user(username="khac", password="testpass123")
+        self.client.login(username="khac", password="testpass123")
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.client.login(username="khach", password="testpass123")
+        self.assertEqual(self.client.get(url).json()["t"], [])
+
+
+@skipUnless(connection.vendor == "postgresql", "partition/EXPLAIN chỉ kiểm tra trên PostgreSQL")
+class LocationHistoryPlanTest(TransactionTestCase):
+    """Test query lộ trình là index-only scan (cần VACUUM thật nên không chạy trong transaction)"""
+
+    def test_track_is_index_only(self):
+        """Test query lộ trình: index-only scan trên các partition ngày, không sort lại"""
+        from vehicles import history
+        from vehicles.models import LocationPoint
+
+        now = timezone.now()
+        days = [now - timedelta(days=d) for d in range(3)]
+        history.ensure_partitions({moment.astimezone(history.UTC).date() for moment in days})
+        LocationPoint.objects.bulk_create([
+            LocationPoint(vehicle_id=vid, recorded_at=moment - timedelta(seconds=s), latitude=10, longitude=106)
+            for vid in range(1, 50) for moment in days for s in range(0, 3600, 30)
+        ])
+        with connection.cursor() as cursor:
+            cursor.execute("VACUUM ANALYZE vehicles_locationpoint")
+        plan = history.track(7, now - timedelta(days=3), now).explain()
+        self.assertIn("Index Only Scan", plan, plan)
+        self.assertNotIn("Heap", plan, plan)
+        self.assertNotIn("Sort", plan, plan)
+
+
+class TripStatsTest(TestCase):
+    """Test cho số chuyến hoàn thành và độ phổ biến lưu sẵn trên xe"""
+
+    def setUp(self):
+        self.vehicle = Vehicle.objects.create(name="Vios", license_plate="51P-000.01", price_per_day=500000, latitude=10.77, longitude=106.70)
+        self.other = Vehicle.objects.create(name="Wave", license_plate="51P-000.02", price_per_day=150000, latitude=10.78, longitude=106.71)
+        self.admin = User.objects.create_user(username="admin", password="testpass123", is_staff=True)
+        self.client.login(username="admin", password="testpass123")
+
+    def complete(self, vehicle, end_date):
+        booking = Booking.objects.create(
+            customer=self.admin, vehicle=vehicle, start_date=end_date - timedelta(days=1), end_date=end_date,
+            total_price=0, status="approved",
+        )
+        response = self.client.post(reverse("bookings:complete_booking", args=[booking.id]))
+        self.assertEqual(response.status_code, 200)
+        return booking
+
+    def test_complete_updates_counters_and_map(self):
+        """Test complete_booking cộng trip_count/popularity; bản đồ đọc số liệu thật, không query thêm"""
+        from vehicles.stats import POPULARITY_HALF_LIFE_DAYS
+
+        today = timezone.localdate()
+        self.complete(self.vehicle, today)
+        self.complete(self.vehicle, today - timedelta(days=2 * POPULARITY_HALF_LIFE_DAYS))
+        self.complete(self.other, today)
+        self.vehicle.refresh_from_db()
+        self.assertEqual(self.vehicle.trip_count, 2)
+        self.assertEqual(self.vehicle.popularity_score, 1.25)
+
+        cache.clear()
+        url = reverse("vehicles:vehicle_map_api")
+        params = {"bbox": "106.6,10.7,106.8,10.8", "zoom": "15"}
+        with self.assertNumQueries(1):
+            items = {v["id"]: v for v in self.client.get(url, params).json()["vehicles"]}
+        self.assertEqual((items[self.vehicle.id]["trips"], items[self.vehicle.id]["popularity"]), (2, 1.25))
+        self.assertEqual((items[self.other.id]["trips"], items[self.other.id]["popularity"]), (1, 1.0))
+        columns = self.client.get(url, {**params, "format": "columnar"}).json()["columns"]
+        self.assertEqual(columns["trips"], [2, 1])
+        self.assertEqual(columns["popularity"], [1.25, 1.0])
+
+        vehicles = self.client.get(reverse("vehicles:vehicle_list_api"), {"sort": "popular"}).json()["vehicles"]
+        self.assertEqual([v["id"] for v in vehicles], [self.vehicle.id, self.other.id])
+
+    def test_concurrent_completes_count_once(self):
+        """Test hai lần hoàn thành cùng booking (bản đọc cũ vẫn approved) chỉ cộng một chuyến; trả xe ở frontend cũng cộng"""
+        from bookings import transitions
+
+        booking = self.complete(self.vehicle, date(2026, 3, 1))
+        stale = Booking.objects.get(pk=booking.pk)
+        stale.status = "approved"
+        self.assertFalse(transitions.complete_booking(stale))
+        self.assertEqual(self.client.post(reverse("bookings:complete_booking", args=[booking.id])).status_code, 400)
+        self.vehicle.refresh_from_db()
+        self.assertEqual(self.vehicle.trip_count, 1)
+
+        # Xe của booking approved đang cho thuê: trả xe thì về available
+        Vehicle.objects.filter(pk=self.other.pk).update(status="rented")
+        returned = Booking.objects.create(
+            customer=self.admin, vehicle=self.other, start_date=date(2026, 3, 1), end_date=date(2026, 3, 2),
+            total_price=0, status="approved",
+        )
+        for _ in range(2):
+            self.client.post(reverse("frontend:booking_return", args=[returned.id]))
+        returned.refresh_from_db()
+        self.other.refresh_from_db()
+        self.assertEqual((returned.status, self.other.status, self.other.trip_count), ("completed", "available", 1))
+
+    def test_complete_vehicle_guard(self):
+        """Test hoàn thành booking: xe bảo dưỡng giữ nguyên, xe còn booking approved khác vẫn đang thuê"""
+        Vehicle.objects.filter(pk=self.vehicle.pk).update(status="maintenance")
+        Vehicle.objects.filter(pk=self.other.pk).update(status="rented")
+        Booking.objects.create(
+            customer=self.admin, vehicle=self.other, start_date=date(2026, 4, 1), end_date=date(2026, 4, 2),
+            total_price=0, status="approved",
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.complete(self.vehicle, date(2026, 3, 1))
+            self.complete(self.other, date(2026, 3, 1))
+        self.vehicle.refresh_from_db()
+        self.other.refresh_from_db()
+        self.assertEqual((self.vehicle.status, self.vehicle.trip_count), ("maintenance", 1))
+        self.assertEqual((self.other.status, self.other.trip_count), ("rented", 1))
+
+    def test_rebuild_command(self):
+        """Test lệnh rebuild_trip_stats sửa lại số liệu lệch, khớp với cộng dồn"""
+        from django.core.management import call_command
+
+        self.complete(self.vehicle, date(2026, 3, 1))
+        self.complete(self.vehicle, date(2026, 5, 1))
+        self.vehicle.refresh_from_db()
+        expected = (self.vehicle.trip_count, self.vehicle.popularity)
+        Vehicle.objects.update(trip_count=99, popularity=0)
+        call_command("rebuild_trip_stats", stdout=__import__("io").StringIO())
+        self.vehicle.refresh_from_db()
+        self.other.refresh_from_db()
+        self.assertEqual(self.vehicle.trip_count, expected[0])
+        self.assertAlmostEqual(self.vehicle.popularity, expected[1])
+        self.assertEqual((self.other.trip_count, self.other.popularity), (0, 0))
+
+
+class StubGeocoder:
+    """Nhà cung cấp geocoding giả cho test (settings.GEOCODER): không gọi mạng, đếm số lần gọi"""
+
+    calls = []
+    delay = 0
+    fail = False
+    places = {"12 le loi quan 1": (10.7735, 106.7009, "12 Lê Lợi, Bến Nghé, Quận 1")}
+
+    def geocode(self, query):
+        import time
+
+        from vehicles.geocoding import GeocodingError, normalize_query
+
+        StubGeocoder.calls.append(query)
+        time.sleep(StubGeocoder.delay)
+        if StubGeocoder.fail:
+            raise GeocodingError("upstream down")
+        return StubGeocoder.places.get(normalize_query(query))
+
+
+STUB_GEOCODER = {"BACKEND": "vehicles.tests.StubGeocoder"}
+
+
+@override_settings(GEOCODER=STUB_GEOCODER)
+class GeocodeProxyTest(TestCase):
+    """Test cho proxy geocoding: cache DB theo câu đã chuẩn hoá, TTL, LRU, lỗi nhà cung cấp"""
+
+    def setUp(self):
+        StubGeocoder.calls, StubGeocoder.delay, StubGeocoder.fail = [], 0, False
+        # Lượt trượt cache theo client đếm trong cache
+        cache.clear()
+        self.url = reverse("vehicles:geocode_api")
+
+    def test_repeat_lookup_is_local_hit(self):
+        """Test lần đầu hỏi nhà cung cấp; lần sau (khác hoa/thường, dấu, dấu câu) trúng cache bằng một query"""
+        import time
+
+        first = self.client.get(self.url, {"q": "  12 Lê Lợi,   Quận 1 "})
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.json(), {"lat": 10.7735, "lng": 106.7009, "display_name": "12 Lê Lợi, Bến Nghé, Quận 1", "cached": False})
+        self.assertEqual(StubGeocoder.calls, ["12 Lê Lợi, Quận 1"])
+        self.assertIn("max-age=3600", first["Cache-Control"])
+
+        with self.assertNumQueries(1):
+            started = time.perf_counter()
+            second = self.client.get(self.url, {"q": "12 le loi quan 1"})
+            elapsed = time.perf_counter() - started
+        self.assertEqual(second.json()["cached"], True)
+        self.assertEqual((second.json()["lat"], second.json()["lng"]), (10.7735, 106.7009))
+        self.assertLess(elapsed, 0.05)
+        self.assertEqual(len(StubGeocoder.calls), 1)
+
+    def test_not_found_ttl_and_errors(self):
+        """Test không tìm thấy cũng được cache (404), hết TTL thì hỏi lại; nhà cung cấp lỗi -> dùng kết quả cũ hoặc 502"""
+        from vehicles.geocoding import NOT_FOUND_TTL
+        from vehicles.models import GeocodeResult
+
+        self.assertEqual(self.client.get(self.url, {"q": "Không có"}).status_code, 404)
+        self.assertEqual(self.client.get(self.url, {"q": "khong co"}).status_code, 404)
+        self.assertEqual(len(StubGeocoder.calls), 1)
+
+        GeocodeResult.objects.update(fetched_at=timezone.now() - NOT_FOUND_TTL - timedelta(minutes=1))
+        StubGeocoder.fail = True
+        response = self.client.get(self.url, {"q": "khong co"})
+        self.assertEqual((response.status_code, response.json()["cached"]), (404, True))
+        self.assertEqual(len(StubGeocoder.calls), 2)
+        self.assertEqual(self.client.get(self.url, {"q": "Chưa hỏi bao giờ"}).status_code, 502)
+
+        StubGeocoder.fail = False
+        self.assertEqual(self.client.get(self.url, {"q": "khong co"}).json()["cached"], False)
+        self.assertEqual(self.client.get(self.url, {"q": " ,. "}).status_code, 400)
+        self.assertEqual(self.client.get(self.url).status_code, 400)
+
+    def test_lru_eviction(self):
+        """Test vượt số câu tối đa thì xoá các câu lâu không dùng nhất; chỉ kiểm tra định kỳ khi lưu câu mới"""
+        import itertools
+        from unittest import mock
+
+        from vehicles import geocoding
+        from vehicles.models import GeocodeResult
+
+        now = timezone.now()
+        for i in range(5):
+            GeocodeResult.objects.create(query=f"dia chi {i}", fetched_at=now, last_used_at=now - timedelta(hours=10 - i))
+        self.assertEqual(geocoding.evict(max_entries=3), 2)
+        self.assertEqual(sorted(GeocodeResult.objects.values_list("query", flat=True)), ["dia chi 2", "dia chi 3", "dia chi 4"])
+        self.assertEqual(geocoding.evict(max_entries=3), 0)
+
+        # Lưu câu mới chỉ kiểm tra LRU sau mỗi EVICT_EVERY câu
+        with mock.patch.object(geocoding, "EVICT_EVERY", 2), mock.patch.object(geocoding, "_inserts", itertools.count(1)), \
+                mock.patch.object(geocoding, "evict") as evict:
+            for i in range(5):
+                geocoding.geocode(f"moi {i}")
+        self.assertEqual(evict.call_count, 2)
+
+    def test_miss_rate_limit_per_client(self):
+        """Test mỗi client chỉ được tra MISS_RATE_LIMIT địa chỉ mới mỗi cửa sổ (429); trúng cache không bị tính"""
+        from unittest import mock
+
+        from vehicles import geocoding
+
+        with mock.patch.object(geocoding, "MISS_RATE_LIMIT", 2):
+            self.assertEqual(self.client.get(self.url, {"q": "12 Lê Lợi, Quận 1"}).status_code, 200)
+            self.assertEqual(self.client.get(self.url, {"q": "khong co"}).status_code, 404)
+            for _ in range(3):
+                self.assertEqual(self.client.get(self.url, {"q": "12 le loi quan 1"}).status_code, 200)
+            response = self.client.get(self.url, {"q": "dia chi khac"})
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(response["Retry-After"], str(geocoding.MISS_RATE_WINDOW))
+            # Client khác có lượt riêng
+            self.assertEqual(self.client.get(self.url, {"q": "dia chi khac"}, REMOTE_ADDR="10.0.0.2").status_code, 404)
+        self.assertEqual(len(StubGeocoder.calls), 3)
+
+    def test_nominatim_busy_fails_fast(self):
+        """Test Nominatim: lượt gọi phải chờ quá max_wait -> GeocodingBusy ngay, không ngủ giữ lock; API trả 503"""
+        import time
+        from unittest import mock
+
+        from vehicles import geocoding
+
+        provider = geocoding.NominatimGeocoder(min_interval=1.0, max_wait=0.5)
+        provider._last_call = time.monotonic() + 10
+        started = time.perf_counter()
+        with self.assertRaises(geocoding.GeocodingBusy):
+            provider.geocode("12 Lê Lợi")
+        self.assertLess(time.perf_counter() - started, 0.1)
+
+        with mock.patch.object(StubGeocoder, "geocode", side_effect=geocoding.GeocodingBusy("đầy")):
+            self.assertEqual(self.client.get(self.url, {"q": "dia chi moi"}).status_code, 503)
+
+
+@override_settings(GEOCODER=STUB_GEOCODER)
+class GeocodeCoalescingTest(TransactionTestCase):
+    """Test các request đồng thời cùng địa chỉ chỉ gọi nhà cung cấp một lần (cần nhiều kết nối DB thật)"""
+
+    def test_concurrent_identical_lookups(self):
+        import threading
+
+        from django.db import connection as db_connection
+
+        from vehicles import geocoding
+
+        StubGeocoder.calls, StubGeocoder.delay, StubGeocoder.fail = [], 0.3, False
+        results = []
+
+        def lookup(query):
+            try:
+                entry, _ = geocoding.geocode(query)
+                results.append((entry.latitude, entry.longitude))
+            finally:
+                db_connection.close()
+
+        threads = [threading.Thread(target=lookup, args=(q,)) for q in ["12 Lê Lợi, Quận 1", "12 LE LOI quan 1"] * 4]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [(10.7735, 106.7009)] * 8)
+        self.assertEqual(len(StubGeocoder.calls), 1)
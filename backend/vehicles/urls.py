@@ -8,9 +8,15 @@ urlpatterns = [
     # API: Danh sách xe
     path('api/vehicles/', views.vehicle_list_api, name='vehicle_list_api'),
     
+    # API: Xe gần nhất (?near=lat,lng&k=&radius_km=)
+    path('api/vehicles/nearest/', views.vehicle_nearest_api, name='vehicle_nearest_api'),
+
     # API: Chi tiết xe
     path('api/vehicles/<int:pk>/', views.vehicle_detail_api, name='vehicle_detail_api'),
     
+    # API: Lịch bận/trống của xe
+    path('api/vehicles/<int:pk>/availability/', views.vehicle_availability_api, name='vehicle_availability_api'),
+
     # API: Đánh giá xe
     path('api/vehicles/<int:vehicle_pk>/review/', views.add_review, name='add_review'),
     path('api/reviews/<int:review_pk>/delete/', views.delete_review, name='delete_review'),
@@ -22,6 +28,23 @@ urlpatterns = [
     # API: Lấy rating của xe
     path('api/vehicles/<int:vehicle_pk>/rating/', views.get_vehicle_rating, name='get_vehicle_rating'),
 
+    # API: Xe trong khung nhìn bản đồ (?bbox=west,south,east,north&zoom=)
+    path('api/map/', views.vehicle_map_api, name='vehicle_map_api'),
+
+    # API: Tìm toạ độ địa chỉ (?q=), proxy geocoding có cache
+    path('api/geocode/', views.geocode_api, name='geocode_api'),
+
+    # SSE: thay đổi trạng thái/vị trí xe theo thời gian thực cho bản đồ
+    path('api/live/', views.live_events_api, name='live_events_api'),
+
+    # API (admin/gateway GPS): nhận vị trí xe theo lô + thống kê bộ đệm
+    path('api/telemetry/', views.telemetry_ingest_api, name='telemetry_ingest_api'),
+    path('api/telemetry/gateway/', views.telemetry_gateway_api, name='telemetry_gateway_api'),
+    path('api/telemetry/stats/', views.telemetry_stats_api, name='telemetry_stats_api'),
+
+    # API (admin): thống kê cache response
+    path('api/cache/stats/', views.cache_stats_api, name='cache_stats_api'),
+
     path('api/list/', views.vehicle_list_api, name='vehicle_list_api'),
     path('map/', views.map_view, name='map'),
 ]
@@ -1,59 +1,286 @@
+from django.conf import settings
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.core.paginator import Paginator
-from django.db.models import Avg, Count
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse
 from django.views.decorators.http import require_POST, require_GET
+from django.views.decorators.csrf import csrf_exempt
+from django.utils.cache import patch_cache_control
 from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.db.models import Avg, Count, Max, Min, Q
+from django.db.models.functions import Substr
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+import hmac
 import json
-import random 
+from datetime import date, timedelta
 
 from .models import Vehicle, VehicleImage
+from .pagination import keyset_page
+from .cache import cached_json_response, cache_key, get_or_build, cache_stats
+from .conditional import conditional_view, make_etag
+from .search import search_vehicles
+from .geo import bbox_filter, cluster_precision, parse_bbox, parse_point
+from .nearby import nearest_vehicles
+from .stats import popularity_at
+from . import geocoding, live, telemetry
 from bookings.models import Booking
+from bookings.utils import filter_available, busy_intervals, free_intervals, earliest_window
 from .forms import ReviewForm, VehicleImageForm
 from reviews.models import Review
 
 # ============== 1. API LIST & DETAIL ==============
 
-@require_GET
-def vehicle_list_api(request):
-    """API: Lấy danh sách xe (Có lọc, phân trang VÀ tọa độ cho Map)"""
-    vehicles = Vehicle.objects.annotate(
-        avg_rating=Avg('reviews__rating'),
-        review_count=Count('reviews')
-    )
-    
-    # --- LOGIC LỌC ---
-    availability = request.GET.get('availability')
+PAGE_SIZE = 9
+
+# Khoá sắp xếp cho chế độ cursor: sort -> (trường, giảm dần)
+CURSOR_SORT_KEYS = {
+    'name': ('name', False),
+    'price_asc': ('price_per_day', False),
+    'price_desc': ('price_per_day', True),
+    'rating': ('rating_avg', True),
+    'popular': ('popularity', True),
+}
+
+# Khoảng giá cho facet, [từ, tới) theo VNĐ/ngày
+PRICE_BUCKETS = [
+    ('under_300k', None, 300000),
+    ('300k_700k', 300000, 700000),
+    ('700k_1500k', 700000, 1500000),
+    ('over_1500k', 1500000, None),
+]
+
+
+def _base_vehicles(params, ranked=False):
+    """
+    Queryset xe sau tìm kiếm (?q=) và lọc trống lịch theo ngày: phần chung của danh sách và facet.
+    Trả về (queryset, có lọc theo ngày hay không); raise ValueError(thông báo) nếu tham số sai.
+    """
+    # Điểm/số đánh giá đọc từ cột lưu sẵn trên Vehicle, không JOIN + GROUP BY reviews
+    # Số chỗ tính trong SQL (CASE theo vehicle_type) để lọc/đếm facet
+    vehicles = Vehicle.objects.alias(seat_count=Vehicle.seats_expression())
+
+    # Tìm kiếm theo tên/biển số/mô tả (không phân biệt dấu, biển số gần đúng)
+    query = params.get('q', '').strip()
+    if query:
+        vehicles = search_vehicles(vehicles, query, ranked=ranked)
+
+    # Lọc xe trống lịch trong khoảng ngày (một query NOT EXISTS)
+    start_date = params.get('start_date')
+    end_date = params.get('end_date')
+    by_dates = bool(start_date or end_date)
+    if by_dates:
+        try:
+            s = date.fromisoformat(start_date or '')
+            e = date.fromisoformat(end_date or '')
+        except ValueError:
+            raise ValueError('start_date/end_date phải dạng YYYY-MM-DD') from None
+        if e < s:
+            raise ValueError('end_date phải >= start_date')
+        vehicles = filter_available(vehicles, s, e)
+    return vehicles, by_dates
+
+
+def _facet_filters(params) -> dict:
+    """Bộ lọc theo từng nhóm facet (mỗi nhóm một Q), để đếm mỗi facet theo các bộ lọc còn lại."""
+    filters = {}
+    availability = params.get('availability')
+    # Cùng nhóm mã với facet status (kể cả mã cũ 'Available'): số đếm khớp kết quả khi bấm facet
     if availability == 'available':
-        vehicles = vehicles.filter(status='available') 
+        filters['status'] = Q(status__in=Vehicle.STATUS_ALIASES['available'])
     elif availability == 'unavailable':
-        vehicles = vehicles.exclude(status='available')
-    
+        filters['status'] = ~Q(status__in=Vehicle.STATUS_ALIASES['available'])
+
+    if params.get('vehicle_type'):
+        filters['vehicle_type'] = Q(vehicle_type=params['vehicle_type'])
+
+    if params.get('seats'):
+        try:
+            filters['seats'] = Q(seat_count=int(params['seats']))
+        except ValueError:
+            raise ValueError('seats phải là số nguyên') from None
+
     # Lọc theo giá
-    min_price = request.GET.get('min_price')
-    max_price = request.GET.get('max_price')
-    if min_price:
-        vehicles = vehicles.filter(price_per_day__gte=min_price)
-    if max_price:
-        vehicles = vehicles.filter(price_per_day__lte=max_price)
+    price = Q()
+    if params.get('min_price'):
+        price &= Q(price_per_day__gte=params['min_price'])
+    if params.get('max_price'):
+        price &= Q(price_per_day__lte=params['max_price'])
+    if price:
+        filters['price'] = price
+    return filters
+
+
+def _filter_vehicles(params, ranked=False):
+    """
+    Queryset xe theo mọi bộ lọc của API danh sách (chưa sắp xếp, trừ khi ranked=True: theo độ liên quan của ?q=).
+    Trả về (queryset, có lọc theo ngày hay không); raise ValueError(thông báo) nếu tham số sai.
+    """
+    vehicles, by_dates = _base_vehicles(params, ranked=ranked)
+    return vehicles.filter(*_facet_filters(params).values()), by_dates
+
+
+def _facet_counts(params) -> dict:
+    """
+    Số xe theo loại, trạng thái, số chỗ và khoảng giá trong MỘT query (Count(filter=Q(...))).
+    Mỗi facet tính theo các bộ lọc đang bật của những facet khác (không tự lọc chính nó).
+    """
+    vehicles, _ = _base_vehicles(params)
+    filters = _facet_filters(params)
+    seat_values = sorted({*Vehicle.SEATS_BY_TYPE.values(), Vehicle.DEFAULT_SEATS})
+    facets = {
+        'vehicle_type': [(t, Q(vehicle_type=t)) for t, _ in Vehicle.VEHICLE_TYPE_CHOICES],
+        'status': [(s, Q(status__in=Vehicle.STATUS_ALIASES[s])) for s, _ in Vehicle.STATUS_CHOICES],
+        'seats': [(str(n), Q(seat_count=n)) for n in seat_values],
+        'price': [
+            (key, Q(**{k: v for k, v in (('price_per_day__gte', lo), ('price_per_day__lt', hi)) if v is not None}))
+            for key, lo, hi in PRICE_BUCKETS
+        ],
+    }
+
+    aggregates, slots = {}, []
+    for facet, values in facets.items():
+        others = Q(*[q for name, q in filters.items() if name != facet])
+        for value, value_q in values:
+            alias = f'facet_{len(slots)}'
+            aggregates[alias] = Count('id', filter=others & value_q)
+            slots.append((facet, value, alias))
+
+    row = vehicles.aggregate(**aggregates)
+    counts = {facet: {} for facet in facets}
+    for facet, value, alias in slots:
+        counts[facet][value] = row[alias]
+    return counts
+
+
+# Tìm xe gần (?near=lat,lng&k=&radius_km=)
+NEAREST_DEFAULT_K = 10
+NEAREST_MAX_K = 100
+
+
+def _near_params(params):
+    """(lat, lng, k, radius_km) từ tham số; raise ValueError(thông báo) nếu sai."""
+    lat, lng = parse_point(params.get('near'))
+    try:
+        k = int(params.get('k') or NEAREST_DEFAULT_K)
+    except ValueError:
+        raise ValueError('k phải là số nguyên') from None
+    if not 1 <= k <= NEAREST_MAX_K:
+        raise ValueError(f'k phải trong khoảng 1-{NEAREST_MAX_K}')
+    radius_km = params.get('radius_km')
+    if radius_km:
+        try:
+            radius_km = float(radius_km)
+        except ValueError:
+            radius_km = -1
+        if not radius_km > 0:
+            raise ValueError('radius_km phải là số dương')
+    return lat, lng, k, radius_km or None
+
+
+def _latest(*values):
+    values = [v for v in values if v is not None]
+    return max(values) if values else None
+
+
+# Tham số lọc của API danh sách (sort/page/cursor không đổi tập xe)
+LIST_FILTER_PARAMS = ('q', 'availability', 'vehicle_type', 'seats', 'start_date', 'end_date', 'min_price', 'max_price')
+
+
+def _cached_validators(namespace, params, build, *args):
+    """Validators tính một lần cho mỗi phiên bản đội xe (không tính vào hit/miss của response cache)."""
+    key = cache_key(namespace, params, *args)
+    validators = cache.get(key)
+    if validators is None:
+        validators = build()
+        cache.set(key, validators)
+    return validators
+
+
+def _list_validators(request):
+    """
+    ETag/Last-Modified của danh sách: max(updated_at) + số xe của tập đã lọc.
+    Tính theo bộ lọc nên mọi trang/cách sắp xếp dùng chung một query.
+    """
+    filters = [(name, request.GET.getlist(name)) for name in LIST_FILTER_PARAMS if name in request.GET]
+
+    def build():
+        try:
+            vehicles, by_dates = _filter_vehicles(request.GET)
+        except ValueError:
+            return None
+        stats = vehicles.aggregate(last=Max('updated_at'), total=Count('id'))
+        last = stats['last']
+        if by_dates:
+            # Tập xe trống lịch còn phụ thuộc vào booking
+            last = _latest(last, Booking.objects.aggregate(last=Max('updated_at'))['last'])
+        return stats['total'], last
+
+    stats = _cached_validators('list-validators', filters, build)
+    if stats is None:
+        return None, None
+    total, last = stats
+    return make_etag('list', sorted(request.GET.lists()), total, last), last
+
+
+@require_GET
+@conditional_view(_list_validators)
+@cached_json_response('list')
+def vehicle_list_api(request):
+    """API: Lấy danh sách xe (Có lọc, phân trang VÀ tọa độ cho Map)"""
+    # Có từ khoá tìm kiếm thì mặc định sắp theo độ liên quan
+    searching = bool(request.GET.get('q', '').strip())
+    sort_by = request.GET.get('sort', 'relevance' if searching else 'name')
+    try:
+        vehicles, _ = _filter_vehicles(request.GET, ranked=searching and sort_by == 'relevance')
+        near = _near_params(request.GET) if request.GET.get('near') else None
+    except ValueError as exc:
+        return JsonResponse({'detail': str(exc)}, status=400)
     
-    # Sắp xếp
-    sort_by = request.GET.get('sort', 'name')
+    # Sắp xếp (sort=relevance: giữ thứ tự độ liên quan của search_vehicles)
     if sort_by == 'price_asc':
         vehicles = vehicles.order_by('price_per_day')
     elif sort_by == 'price_desc':
         vehicles = vehicles.order_by('-price_per_day')
     elif sort_by == 'rating':
-        vehicles = vehicles.order_by('-avg_rating')
-    else:
+        vehicles = vehicles.order_by('-rating_avg')
+    elif sort_by == 'popular':
+        vehicles = vehicles.order_by('-popularity')
+    elif not (sort_by == 'relevance' and searching):
         vehicles = vehicles.order_by('name')
     
-    # Phân trang
-    page = request.GET.get('page', 1)
-    paginator = Paginator(vehicles, 9)
-    page_obj = paginator.get_page(page)
+    # Tìm xe gần (?near=): k xe gần nhất trong tập đã lọc, sắp theo khoảng cách, không phân trang
+    if near:
+        lat, lng, k, radius_km = near
+        page_obj = nearest_vehicles(vehicles, lat, lng, k, radius_km)
+        pagination = {'k': k, 'radius_km': radius_km, 'has_next': False}
+    # Phân trang keyset (?cursor=, để trống cho trang đầu): không COUNT(*), không OFFSET
+    elif 'cursor' in request.GET:
+        key, descending = CURSOR_SORT_KEYS.get(sort_by, ('name', False))
+        try:
+            page_obj, next_cursor = keyset_page(vehicles, key, descending, request.GET['cursor'], PAGE_SIZE)
+        except ValueError:
+            return JsonResponse({'detail': 'Cursor không hợp lệ'}, status=400)
+        pagination = {
+            'next_cursor': next_cursor,
+            'has_next': next_cursor is not None,
+        }
+        # Tổng số xe chỉ đếm khi client yêu cầu (?count=1)
+        if request.GET.get('count') == '1':
+            pagination['total'] = vehicles.count()
+    else:
+        # Phân trang
+        page = request.GET.get('page', 1)
+        paginator = Paginator(vehicles, PAGE_SIZE)
+        page_obj = paginator.get_page(page)
+        pagination = {
+            'current_page': page_obj.number,
+            'total_pages': paginator.num_pages,
+            'has_next': page_obj.has_next(),
+            'has_previous': page_obj.has_previous(),
+        }
     
     # --- TRẢ VỀ JSON ---
     data = {
@@ -65,34 +292,50 @@ def vehicle_list_api(request):
                 'price_per_day': float(v.price_per_day),
                 'image': v.image.url if v.image else None,
                 'status': v.status, # Dùng status chuẩn
-                'avg_rating': round(v.avg_rating, 1) if v.avg_rating else None,
+                'vehicle_type': v.vehicle_type,
+                'seats': v.seats,
+                'avg_rating': v.avg_rating,
                 'review_count': v.review_count,
+                'trip_count': v.trip_count,
+                'popularity': v.popularity_score,
                 # Thêm tọa độ cho Map
                 'lat': float(v.latitude) if v.latitude else None,
                 'lng': float(v.longitude) if v.longitude else None,
             }
             for v in page_obj
         ],
-        'pagination': {
-            'current_page': page_obj.number,
-            'total_pages': paginator.num_pages,
-            'has_next': page_obj.has_next(),
-            'has_previous': page_obj.has_previous(),
-        }
+        'pagination': pagination,
     }
+    if near:
+        for item, v in zip(data['vehicles'], page_obj):
+            item['distance_km'] = v.distance_km
+    # Số xe theo từng giá trị bộ lọc (?facets=1), cache cùng response
+    if request.GET.get('facets') == '1':
+        data['facets'] = _facet_counts(request.GET)
     return JsonResponse(data)
 
 
+def _detail_validators(request, pk):
+    """ETag/Last-Modified của chi tiết xe: updated_at của xe + max(updated_at)/số đánh giá, một query."""
+    def build():
+        row = (
+            Vehicle.objects.filter(pk=pk)
+            .annotate(reviews_last=Max('reviews__updated_at'), reviews_total=Count('reviews'))
+            .values_list('updated_at', 'reviews_last', 'reviews_total')
+            .first()
+        )
+        if row is None:
+            return None, None
+        return make_etag('detail', pk, *row), _latest(*row[:2])
+    return _cached_validators('detail-validators', (), build, pk)
+
+
 @require_GET
+@conditional_view(_detail_validators)
+@cached_json_response('detail')
 def vehicle_detail_api(request, pk):
     """API: Lấy chi tiết xe, ảnh và đánh giá"""
-    vehicle = get_object_or_404(
-        Vehicle.objects.annotate(
-            avg_rating=Avg('reviews__rating'),
-            review_count=Count('reviews')
-        ),
-        pk=pk
-    )
+    vehicle = get_object_or_404(Vehicle, pk=pk)
     
     images = vehicle.images.all()
     reviews = vehicle.reviews.select_related('user').order_by('-created_at')
@@ -105,8 +348,10 @@ def vehicle_detail_api(request, pk):
             'price_per_day': float(vehicle.price_per_day),
             'image': vehicle.image.url if vehicle.image else None,
             'status': vehicle.status,
-            'avg_rating': round(vehicle.avg_rating, 1) if vehicle.avg_rating else None,
+            'avg_rating': vehicle.avg_rating,
             'review_count': vehicle.review_count,
+            'trip_count': vehicle.trip_count,
+            'popularity': vehicle.popularity_score,
             'description': vehicle.description,
             'lat': float(vehicle.latitude) if vehicle.latitude else None,
             'lng': float(vehicle.longitude) if vehicle.longitude else None,
@@ -126,52 +371,319 @@ def vehicle_detail_api(request, pk):
     return JsonResponse(data)
 
 
+# Giới hạn số ngày tra cứu lịch trống của một xe
+MAX_AVAILABILITY_DAYS = 365
+
+
+@require_GET
+def vehicle_availability_api(request, pk):
+    """
+    API: Lịch bận/trống của xe trong [from, from + days) và khoảng trống sớm nhất đủ `length` ngày.
+    Dùng cho date picker ở trang chi tiết/thanh toán (một request thay vì dò từng ngày).
+    """
+    vehicle = get_object_or_404(Vehicle, pk=pk)
+    try:
+        start = date.fromisoformat(request.GET['from']) if request.GET.get('from') else timezone.localdate()
+        days = int(request.GET.get('days', 60))
+        length = int(request.GET.get('length', 1))
+    except ValueError:
+        return JsonResponse({'detail': 'from phải dạng YYYY-MM-DD, days/length là số nguyên'}, status=400)
+    if not 1 <= days <= MAX_AVAILABILITY_DAYS or not 1 <= length <= days:
+        return JsonResponse({'detail': f'days trong khoảng 1..{MAX_AVAILABILITY_DAYS}, length trong khoảng 1..days'}, status=400)
+
+    end = start + timedelta(days=days - 1)
+    busy = busy_intervals(vehicle, start, end)
+    free = free_intervals(busy, start, end)
+    window = earliest_window(free, length)
+
+    def fmt(intervals):
+        return [{'start_date': s.isoformat(), 'end_date': e.isoformat()} for s, e in intervals]
+
+    return JsonResponse({
+        'vehicle_id': vehicle.id,
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'busy': fmt(busy),
+        'free': fmt(free),
+        'earliest_window': fmt([window])[0] if window else None,
+    })
+
+
 # ============== 2. MAP VIEW ==============
 
 def map_view(request):
     """
     Render trang bản đồ với dữ liệu chuẩn Rental (Rating, Lượt thuê, Giá)
     """
-    # Lấy xe có tọa độ + Tính toán Rating trung bình
-    vehicles = Vehicle.objects.exclude(latitude__isnull=True).exclude(longitude__isnull=True).annotate(
-        avg_rating=Avg('reviews__rating'),
-        review_count=Count('reviews')
+    # Chuỗi JSON đã cache theo phiên bản đội xe
+    vehicles_json = get_or_build(
+        cache_key('map'), lambda: json.dumps(_map_vehicles(), cls=DjangoJSONEncoder)
     )
-    
-    vehicles_list = []
-    
-    for v in vehicles:
-        # Xử lý trạng thái hiển thị
-        status_display = v.status
-        if status_display == 'in_use':
-            status_display = 'in operation'
-            
-        # 1. Rating giả lập 
-        rating_val = round(v.avg_rating, 1) if v.avg_rating else 5.0
-        
-        # 2. Số lượt thuê giả lập 
-        trips_val = v.review_count * 15 + random.randint(5, 50)
-
-        vehicles_list.append({
-            'id': v.id,
-            'name': v.name,
-            'plate': v.license_plate,
-            'lat': float(v.latitude),
-            'lng': float(v.longitude),
-            'status': status_display, 
-            'price': float(v.price_per_day),
-            
-            # --- CÁC TRƯỜNG MỚI ---
-            'rating': rating_val,
-            'trips': trips_val, 
-        })
-
     context = {
-        'vehicles_json': json.dumps(vehicles_list, cls=DjangoJSONEncoder)
+        'vehicles_json': vehicles_json
     }
     return render(request, 'vehicles/map.html', context)
 
 
+def _map_status(status):
+    # Xử lý trạng thái hiển thị
+    return 'in operation' if status == 'in_use' else status
+
+
+def _map_rating(rating_avg, review_count):
+    # 1. Rating giả lập (5.0 khi chưa có đánh giá)
+    return (round(rating_avg, 1) if review_count else None) or 5.0
+
+
+def _map_popularity(score):
+    # 2. Độ phổ biến hiện tại từ giá trị đã neo (vehicles/stats.py)
+    return popularity_at(score)
+
+
+def _map_item(v):
+    """Dữ liệu một xe cho marker trên bản đồ."""
+    return {
+        'id': v.id,
+        'name': v.name,
+        'plate': v.license_plate,
+        'lat': float(v.latitude),
+        'lng': float(v.longitude),
+        'status': _map_status(v.status), 
+        'price': float(v.price_per_day),
+        'image': v.image.url if v.image else None,
+
+        # --- CÁC TRƯỜNG MỚI ---
+        'rating': _map_rating(v.rating_avg, v.review_count),
+        'trips': v.trip_count,
+        'popularity': _map_popularity(v.popularity),
+    }
+
+
+# Toạ độ dạng columnar: số nguyên lat/lng * 10^COORD_PRECISION (5 chữ số thập phân ~ 1m)
+COORD_PRECISION = 5
+MAP_COLUMNAR_FIELDS = (
+    'id', 'name', 'license_plate', 'latitude', 'longitude', 'status',
+    'price_per_day', 'image', 'rating_avg', 'review_count', 'trip_count', 'popularity',
+)
+
+
+def _map_columnar(vehicles, limit):
+    """
+    Payload bản đồ dạng cột: mỗi trường một mảng song song (không lặp tên key),
+    status mã hoá theo từ điển 'statuses', toạ độ là số nguyên cố định độ chính xác.
+    Dựng thẳng từ values_list(), không khởi tạo model.
+    """
+    rows = list(vehicles.order_by('id').values_list(*MAP_COLUMNAR_FIELDS)[:limit + 1])
+    truncated = len(rows) > limit
+    rows = rows[:limit]
+    scale = 10 ** COORD_PRECISION
+    statuses, codes = [], {}
+
+    def status_code(status):
+        status = _map_status(status)
+        if status not in codes:
+            codes[status] = len(statuses)
+            statuses.append(status)
+        return codes[status]
+
+    ids, names, plates, lats, lngs, status_values, prices, images, ratings, review_counts, trips, popularity = (
+        zip(*rows) if rows else ([],) * len(MAP_COLUMNAR_FIELDS)
+    )
+    return {
+        'format': 'columnar',
+        'count': len(rows),
+        'truncated': truncated,
+        'coord_precision': COORD_PRECISION,
+        'statuses': statuses,
+        'columns': {
+            'id': list(ids),
+            'name': list(names),
+            'plate': list(plates),
+            'lat': [round(lat * scale) for lat in lats],
+            'lng': [round(lng * scale) for lng in lngs],
+            'status': [status_code(status) for status in status_values],
+            # Giá VND: số nguyên nếu không có phần lẻ
+            'price': [int(price) if price % 1 == 0 else float(price) for price in prices],
+            'image': [default_storage.url(image) if image else None for image in images],
+            'rating': [_map_rating(avg, n) for avg, n in zip(ratings, review_counts)],
+            'trips': list(trips),
+            'popularity': [_map_popularity(score) for score in popularity],
+        },
+    }
+
+
+def _map_vehicles():
+    # Lấy xe có tọa độ (Rating trung bình đã lưu sẵn trên Vehicle)
+    vehicles = Vehicle.objects.exclude(latitude__isnull=True).exclude(longitude__isnull=True)
+    return [_map_item(v) for v in vehicles]
+
+
+# Số xe tối đa trả về cho một khung nhìn (khung quá rộng: truncated=true, client nên zoom thêm)
+MAP_MAX_RESULTS = 500
+# ?format=columnar nhẹ hơn nhiều nên cho phép nhiều xe hơn mỗi khung
+MAP_MAX_RESULTS_COLUMNAR = 10000
+MAP_FORMATS = ('objects', 'columnar')
+MAX_ZOOM = 22
+# Zoom nhỏ hơn ngưỡng này (cấp thành phố/quốc gia): trả cụm gom sẵn thay cho từng xe
+CLUSTER_MAX_ZOOM = 13
+
+
+def _map_clusters(vehicles, zoom):
+    """
+    Gom xe theo tiền tố geo_cell (GROUP BY trong SQL, một query): số xe, toạ độ trung bình,
+    số xe theo trạng thái, giá thấp nhất. Cache cùng response, làm mới khi đội xe đổi phiên bản.
+    """
+    statuses = [s for s, _ in Vehicle.STATUS_CHOICES]
+    rows = (
+        vehicles.annotate(cell=Substr('geo_cell', 1, cluster_precision(zoom)))
+        .values('cell')
+        .annotate(
+            count=Count('id'),
+            lat=Avg('latitude'),
+            lng=Avg('longitude'),
+            min_price=Min('price_per_day'),
+            # Gộp mã cũ/mã khác ('Available', 'rented'...) vào mã chuẩn, giống facet trạng thái
+            **{f'status_{s}': Count('id', filter=Q(status__in=Vehicle.STATUS_ALIASES[s])) for s in statuses},
+        )
+        .order_by('cell')
+    )
+    return [
+        {
+            'cell': row['cell'],
+            'count': row['count'],
+            'lat': row['lat'],
+            'lng': row['lng'],
+            'statuses': {s: row[f'status_{s}'] for s in statuses if row[f'status_{s}']},
+            'min_price': float(row['min_price']),
+        }
+        for row in rows
+    ]
+
+
+@require_GET
+@cached_json_response('map-bbox')
+def vehicle_map_api(request):
+    """
+    API: Xe nằm trong khung nhìn bản đồ.
+    ?bbox=west,south,east,north (bắt buộc), ?zoom= (0-22, tuỳ chọn).
+    Lọc theo tiền tố geo_cell (index) rồi lọc chính xác theo lat/lng, không đọc cả đội xe.
+    zoom < CLUSTER_MAX_ZOOM: trả 'clusters' (gom theo ô lưới) thay vì từng xe.
+    ?format=columnar: danh sách xe dạng cột (xem _map_columnar), mặc định 'objects'.
+    """
+    try:
+        west, south, east, north = parse_bbox(request.GET.get('bbox'))
+    except ValueError as exc:
+        return JsonResponse({'detail': str(exc)}, status=400)
+    zoom = request.GET.get('zoom')
+    if zoom is not None:
+        try:
+            zoom = int(zoom)
+        except ValueError:
+            zoom = -1
+        if not 0 <= zoom <= MAX_ZOOM:
+            return JsonResponse({'detail': f'zoom phải là số nguyên 0-{MAX_ZOOM}'}, status=400)
+    payload_format = request.GET.get('format', 'objects')
+    if payload_format not in MAP_FORMATS:
+        return JsonResponse({'detail': f"format phải là một trong: {', '.join(MAP_FORMATS)}"}, status=400)
+
+    in_bbox = Vehicle.objects.filter(bbox_filter(west, south, east, north))
+    if zoom is not None and zoom < CLUSTER_MAX_ZOOM:
+        return JsonResponse({
+            'clusters': _map_clusters(in_bbox, zoom),
+            'bbox': [west, south, east, north],
+            'zoom': zoom,
+        })
+
+    if payload_format == 'columnar':
+        data = _map_columnar(in_bbox, MAP_MAX_RESULTS_COLUMNAR)
+        data.update(bbox=[west, south, east, north], zoom=zoom)
+        return JsonResponse(data, json_dumps_params={'separators': (',', ':')})
+
+    vehicles = list(in_bbox.order_by('id')[:MAP_MAX_RESULTS + 1])
+    truncated = len(vehicles) > MAP_MAX_RESULTS
+    return JsonResponse({
+        'vehicles': [_map_item(v) for v in vehicles[:MAP_MAX_RESULTS]],
+        'truncated': truncated,
+        'bbox': [west, south, east, north],
+        'zoom': zoom,
+    })
+
+
+@require_GET
+def vehicle_nearest_api(request):
+    """
+    API: k xe gần nhất (?near=lat,lng&k=&radius_km=), tăng dần theo khoảng cách.
+    Kết hợp được với bộ lọc của API danh sách (availability, giá, loại xe, start_date/end_date...).
+    """
+    if not request.GET.get('near'):
+        return JsonResponse({'detail': 'Thiếu tham số near=lat,lng'}, status=400)
+    try:
+        vehicles, _ = _filter_vehicles(request.GET)
+        lat, lng, k, radius_km = _near_params(request.GET)
+    except ValueError as exc:
+        return JsonResponse({'detail': str(exc)}, status=400)
+
+    vehicles = nearest_vehicles(vehicles, lat, lng, k, radius_km)
+    return JsonResponse({
+        'near': [lat, lng],
+        'k': k,
+        'radius_km': radius_km,
+        'vehicles': [{**_map_item(v), 'distance_km': v.distance_km} for v in vehicles],
+    })
+
+
+# Kết quả geocoding gần như không đổi: cho trình duyệt dùng lại trong khoảng này
+GEOCODE_BROWSER_MAX_AGE = 3600
+
+
+@require_GET
+def geocode_api(request):
+    """
+    API: toạ độ của một địa chỉ (?q=) qua proxy geocoding có cache DB (vehicles/geocoding.py),
+    thay cho việc mỗi trình duyệt tự gọi Nominatim. Địa chỉ mới (trượt cache) bị giới hạn theo user/IP -> 429;
+    nhà cung cấp quá tải -> 503 ngay thay vì xếp hàng.
+    """
+    client = f'user:{request.user.pk}' if request.user.is_authenticated else f"ip:{request.META.get('REMOTE_ADDR')}"
+    try:
+        result, cached = geocoding.geocode(request.GET.get('q', ''), client=client)
+    except ValueError as exc:
+        return JsonResponse({'detail': str(exc)}, status=400)
+    except geocoding.GeocodingRateLimited as exc:
+        response = JsonResponse({'detail': str(exc)}, status=429)
+        response['Retry-After'] = geocoding.MISS_RATE_WINDOW
+        return response
+    except geocoding.GeocodingBusy:
+        response = JsonResponse({'detail': 'Dịch vụ tìm địa chỉ đang quá tải, thử lại sau'}, status=503)
+        response['Retry-After'] = 1
+        return response
+    except geocoding.GeocodingError:
+        return JsonResponse({'detail': 'Dịch vụ tìm địa chỉ tạm thời không khả dụng'}, status=502)
+
+    if not result.found:
+        response = JsonResponse({'detail': 'Không tìm thấy địa chỉ này', 'cached': cached}, status=404)
+    else:
+        response = JsonResponse({
+            'lat': result.latitude,
+            'lng': result.longitude,
+            'display_name': result.display_name,
+            'cached': cached,
+        })
+    patch_cache_control(response, public=True, max_age=GEOCODE_BROWSER_MAX_AGE)
+    return response
+
+
+@require_GET
+def live_events_api(request):
+    """
+    SSE short polling: thay đổi trạng thái/vị trí xe cho bản đồ đang mở (vehicles/live.py).
+    Trả ngay các sự kiện sau Last-Event-ID rồi đóng (không giữ worker WSGI); EventSource tự kết nối lại sau RETRY_MS.
+    """
+    last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    response = HttpResponse(live.hub.poll(last_event_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
 # ============== 3. API REVIEWS & UPLOAD ==============
 
 @login_required
@@ -263,8 +775,74 @@ def delete_image(request, image_pk):
 @require_GET
 def get_vehicle_rating(request, vehicle_pk):
     vehicle = get_object_or_404(Vehicle, pk=vehicle_pk)
-    stats = vehicle.reviews.aggregate(avg_rating=Avg('rating'), review_count=Count('id'))
     return JsonResponse({
-        'avg_rating': round(stats['avg_rating'], 1) if stats['avg_rating'] else 0,
-        'review_count': stats['review_count']
-    })
\ No newline at end of file
+        'avg_rating': vehicle.avg_rating or 0,
+        'review_count': vehicle.review_count
+    })
+
+
+@login_required
+@require_GET
+def cache_stats_api(request):
+    """API (admin): số lần hit/miss của cache response đội xe"""
+    if not request.user.is_staff:
+        return JsonResponse({'detail': 'Chỉ quản trị viên được xem'}, status=403)
+    return JsonResponse(cache_stats())
+
+
+# ============== 4. TELEMETRY (VỊ TRÍ XE TỪ THIẾT BỊ GPS) ==============
+
+def _ingest_points(request):
+    """Nhận một lô vị trí (body JSON) vào bộ đệm telemetry; dùng chung cho API admin và API gateway."""
+    if request.content_type != 'application/json':
+        return JsonResponse({'detail': 'Content-Type phải là application/json'}, status=415)
+    try:
+        points = json.loads(request.body.decode('utf-8'))['points']
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'detail': 'Body phải là JSON {"points": [[vehicle_id, lat, lng, ts], ...]}'}, status=400)
+    if not isinstance(points, list):
+        return JsonResponse({'detail': 'points phải là danh sách'}, status=400)
+    if len(points) > telemetry.MAX_POINTS_PER_BATCH:
+        return JsonResponse({'detail': f'Tối đa {telemetry.MAX_POINTS_PER_BATCH} điểm mỗi lần gửi'}, status=400)
+    return JsonResponse(telemetry.buffer.add(points), status=202)
+
+
+@require_POST
+def telemetry_ingest_api(request):
+    """
+    API (admin, đăng nhập bằng session): nhận một lô vị trí {"points": [[vehicle_id, lat, lng, ts], ...]}.
+    Không ghi DB từng điểm: chỉ giữ điểm mới nhất mỗi xe trong bộ đệm, ghi gộp định kỳ (vehicles/telemetry.py).
+    Xác thực bằng cookie nên bắt buộc CSRF token và application/json.
+    """
+    if not request.user.is_staff:
+        return JsonResponse({'detail': 'Chỉ quản trị viên được gửi dữ liệu vị trí'}, status=403)
+    return _ingest_points(request)
+
+
+def _gateway_authorized(request) -> bool:
+    """Header Authorization: Bearer <token> khớp một token trong settings.TELEMETRY_TOKENS."""
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'bearer' or not token:
+        return False
+    return any(hmac.compare_digest(token, allowed) for allowed in getattr(settings, 'TELEMETRY_TOKENS', ()))
+
+
+@csrf_exempt
+@require_POST
+def telemetry_gateway_api(request):
+    """
+    API cho gateway GPS (máy gửi, không có session): như telemetry_ingest_api nhưng xác thực bằng
+    token riêng (Authorization: Bearer ...). Không dùng cookie nên không cần CSRF.
+    """
+    if not _gateway_authorized(request):
+        return JsonResponse({'detail': 'Token gateway không hợp lệ'}, status=401)
+    return _ingest_points(request)
+
+
+@login_required
+@require_GET
+def telemetry_stats_api(request):
+    """API (admin): tốc độ nhận điểm, số điểm đang chờ và độ trễ ghi của bộ đệm vị trí"""
+    if not request.user.is_staff:
+        return JsonResponse({'detail': 'Chỉ quản trị viên được xem'}, status=403)
+    return JsonResponse(telemetry.buffer.stats())
@@ -5,10 +5,16 @@ var map;
 var userMarker;
 var searchMarker;
 var allMarkers = [];
+var clusterMarkers = [];
 var isUserAction = false;
 var userLat = null;
 var userLng = null;
 var currentRoute = null;
+var icons = {};
+var currentFilter = "all";
+var viewportRequest = null;
+var viewportTimer = null;
+var liveSource = null;
 
 const DEFAULT_LAT = 10.762622;
 const DEFAULT_LNG = 106.660172;
@@ -37,7 +43,7 @@ function initMap(vehicleData) {
         });
     }
 
-    const icons = {
+    icons = {
         green: createCarIcon("#28a745"),
         blue: createCarIcon("#007bff"),
         red: createCarIcon("#dc3545"),
@@ -46,134 +52,446 @@ function initMap(vehicleData) {
 
     getUserLocation();
 
-    // Vẽ các xe lên bản đồ
-    vehicleData.forEach(function (xe) {
-        xe.lat = xe.latitude || xe.lat;
-        xe.lng = xe.longitude || xe.lng;
+    // Vẽ các xe lên bản đồ (nếu có sẵn), sau đó tải xe theo khung nhìn mỗi lần kéo/zoom
+    vehicleData.forEach(addVehicleMarker);
+    map.on("moveend", scheduleViewportLoad);
+    loadViewport();
+    connectLiveUpdates();
+}
 
-        // Nếu không có tọa độ thì bỏ qua 
-        if (!xe.lat || !xe.lng) {
-            console.warn("Bỏ qua xe do thiếu tọa độ:", xe.name);
-            return;
-        }
+// Cấu hình hiển thị (nhãn, màu, icon, nút) theo trạng thái xe
+function getStatusConfig(xe) {
+    // Chuẩn hóa trạng thái
+    var rawStatus = xe.status ? xe.status.toString() : "available";
+    var statusNormal = rawStatus.toLowerCase().trim().replace(/_/g, " ");
+
+    // 1. CẤU HÌNH MẶC ĐỊNH: AVAILABLE (SẴN SÀNG)
+    var statusConfig = {
+        label: "Sẵn sàng",
+        color: "#28a745",
+        icon: icons.green,
+        btnText: "THUÊ NGAY",
+        btnColor: "#28a745",
+        isBookable: true,
+        bookingAction: "book_now",
+        note: "✅ Xe đang rảnh, có thể nhận ngay!",
+    };
 
-        // Chuẩn hóa trạng thái
-        var rawStatus = xe.status ? xe.status.toString() : "available";
-        var statusNormal = rawStatus.toLowerCase().trim().replace(/_/g, " ");
-        var bookingUrl = "/thue-xe/" + xe.id + "/";
-
-        // 1. CẤU HÌNH MẶC ĐỊNH: AVAILABLE (SẴN SÀNG)
-        var statusConfig = {
-            label: "Sẵn sàng",
-            color: "#28a745",
-            icon: icons.green,
-            btnText: "THUÊ NGAY",
-            btnColor: "#28a745",
+    // 2. XỬ LÝ CÁC TRẠNG THÁI KHÁC
+    if (statusNormal === "maintenance" || statusNormal === "bao tri") {
+        statusConfig = {
+            label: "Bảo trì",
+            color: "#dc3545",
+            icon: icons.red,
+            btnText: "ĐANG BẢO TRÌ",
+            btnColor: "#dc3545",
+            isBookable: false, 
+            bookingAction: null,
+            note: "⚠️ Xe đang bảo dưỡng. Vui lòng chọn xe khác.",
+        };
+    } else if (
+        statusNormal === "in operation" ||
+        statusNormal === "dang hoat dong" ||
+        statusNormal === "in use"
+    ) {
+        var returnTime = new Date();
+        returnTime.setHours(returnTime.getHours() + 4);
+        var timeStr = returnTime.getHours() + ":00 hôm nay";
+
+        statusConfig = {
+            label: "Đang hoạt động",
+            color: "#007bff",
+            icon: icons.blue,
+            btnText: "ĐẶT LỊCH",
+            btnColor: "#007bff", 
+            isBookable: true, 
+            bookingAction: "book_later",
+            note: `🔵 Khách trả xe lúc <b>${timeStr}</b>. Bạn có thể đặt sau giờ này.`,
+        };
+    } else if (statusNormal === "booked" || statusNormal === "da dat") {
+        var today = new Date();
+        var endDate = new Date(today);
+        endDate.setDate(today.getDate() + 3);
+        var dateStr = `${today.getDate()}/${today.getMonth() + 1} - ${endDate.getDate()}/${endDate.getMonth() + 1}`;
+
+        statusConfig = {
+            label: "Đã có khách",
+            color: "#ffc107",
+            icon: icons.yellow,
+            btnText: "CHỌN NGÀY KHÁC",
+            btnColor: "#e0a800",
             isBookable: true,
-            bookingAction: "book_now",
-            note: "✅ Xe đang rảnh, có thể nhận ngay!",
+            bookingAction: "book_alternative",
+            note: `🟡 Kín lịch đến <b>${dateStr}</b>. Hãy chọn ngày khác.`,
         };
+    }
 
-        // 2. XỬ LÝ CÁC TRẠNG THÁI KHÁC
-        if (statusNormal === "maintenance" || statusNormal === "bao tri") {
-            statusConfig = {
-                label: "Bảo trì",
-                color: "#dc3545",
-                icon: icons.red,
-                btnText: "ĐANG BẢO TRÌ",
-                btnColor: "#dc3545",
-                isBookable: false, 
-                bookingAction: null,
-                note: "⚠️ Xe đang bảo dưỡng. Vui lòng chọn xe khác.",
-            };
-        } else if (
-            statusNormal === "in operation" ||
-            statusNormal === "dang hoat dong" ||
-            statusNormal === "in use"
-        ) {
-            var returnTime = new Date();
-            returnTime.setHours(returnTime.getHours() + 4);
-            var timeStr = returnTime.getHours() + ":00 hôm nay";
-
-            statusConfig = {
-                label: "Đang hoạt động",
-                color: "#007bff",
-                icon: icons.blue,
-                btnText: "ĐẶT LỊCH",
-                btnColor: "#007bff", 
-                isBookable: true, 
-                bookingAction: "book_later",
-                note: `🔵 Khách trả xe lúc <b>${timeStr}</b>. Bạn có thể đặt sau giờ này.`,
-            };
-        } else if (statusNormal === "booked" || statusNormal === "da dat") {
-            var today = new Date();
-            var endDate = new Date(today);
-            endDate.setDate(today.getDate() + 3);
-            var dateStr = `${today.getDate()}/${today.getMonth() + 1} - ${endDate.getDate()}/${endDate.getMonth() + 1}`;
-
-            statusConfig = {
-                label: "Đã có khách",
-                color: "#ffc107",
-                icon: icons.yellow,
-                btnText: "CHỌN NGÀY KHÁC",
-                btnColor: "#e0a800",
-                isBookable: true,
-                bookingAction: "book_alternative",
-                note: `🟡 Kín lịch đến <b>${dateStr}</b>. Hãy chọn ngày khác.`,
-            };
-        }
+    return statusConfig;
+}
 
-        var safeName = xe.name.replace(/'/g, "\\'").replace(/"/g, "&quot;");
+function addVehicleMarker(xe) {
+    xe.lat = xe.latitude || xe.lat;
+    xe.lng = xe.longitude || xe.lng;
 
-        // Tạo Marker
-        var marker = L.marker([xe.lat, xe.lng], { icon: statusConfig.icon }).addTo(map);
-        
-        // Gán ID và Status vào marker để dùng cho chức năng Lọc (Filter)
-        marker.id = xe.id;
-        marker.status = xe.status;
-        allMarkers.push(marker);
-
-        // XỬ LÝ URL THÔNG MINH
-        var smartBookingUrl = bookingUrl;
-        if (statusConfig.bookingAction) {
-            smartBookingUrl += "?action=" + statusConfig.bookingAction;
-        }
+    // Nếu không có tọa độ thì bỏ qua 
+    if (!xe.lat || !xe.lng) {
+        console.warn("Bỏ qua xe do thiếu tọa độ:", xe.name);
+        return;
+    }
 
-        var popupContent = `
-        <div style="font-family: 'Segoe UI', Roboto, sans-serif; min-width: 250px; padding: 5px;">
-            <h3 style="margin: 0 0 5px 0; font-size: 16px; color: #2c3e50; font-weight: 700;">${xe.name}</h3>
-            <div style="margin-bottom: 8px; display: flex; justify-content: space-between; align-items: center;">
-                <span style="background: #fff; border: 1px solid ${statusConfig.color}; color: ${statusConfig.color}; padding: 2px 8px; border-radius: 12px; font-size: 11px; font-weight: 700;">
-                    ${statusConfig.label}
-                </span>
-                <div style="font-size: 12px; color: #666;">
-                    <span style="color: #f1c40f;">⭐</span> <b>${xe.rating || 5.0}</b> (${xe.trips || 0})
-                </div>
-            </div>
-            <div style="background: #f8f9fa; padding: 10px; border-radius: 6px; margin-bottom: 10px; border-left: 4px solid ${statusConfig.color};">
-                <div style="color: #d63031; font-size: 18px; font-weight: bold; line-height: 1;">
-                    ${parseInt(xe.price).toLocaleString("vi-VN")}đ 
-                </div>
-                <div style="font-size: 12px; color: #666; margin-top: 4px;">Giá thuê 1 ngày (24h)</div>
-            </div>
-            <div style="font-size: 12px; margin-bottom: 12px; padding: 5px; background: #f1f1f1; border-radius: 4px; color: #333;">
-                ${statusConfig.note}
+    var statusConfig = getStatusConfig(xe);
+    var bookingUrl = "/thue-xe/" + xe.id + "/";
+    var safeName = xe.name.replace(/'/g, "\\'").replace(/"/g, "&quot;");
+
+    // Tạo Marker
+    var marker = L.marker([xe.lat, xe.lng], { icon: statusConfig.icon }).addTo(map);
+    
+    // Gán ID và Status vào marker để dùng cho chức năng Lọc (Filter)
+    marker.id = xe.id;
+    marker.status = xe.status;
+    marker.vehicle = xe;
+    allMarkers.push(marker);
+
+    // XỬ LÝ URL THÔNG MINH
+    var smartBookingUrl = bookingUrl;
+    if (statusConfig.bookingAction) {
+        smartBookingUrl += "?action=" + statusConfig.bookingAction;
+    }
+
+    var popupContent = `
+    <div style="font-family: 'Segoe UI', Roboto, sans-serif; min-width: 250px; padding: 5px;">
+        <h3 style="margin: 0 0 5px 0; font-size: 16px; color: #2c3e50; font-weight: 700;">${xe.name}</h3>
+        <div style="margin-bottom: 8px; display: flex; justify-content: space-between; align-items: center;">
+            <span style="background: #fff; border: 1px solid ${statusConfig.color}; color: ${statusConfig.color}; padding: 2px 8px; border-radius: 12px; font-size: 11px; font-weight: 700;">
+                ${statusConfig.label}
+            </span>
+            <div style="font-size: 12px; color: #666;">
+                <span style="color: #f1c40f;">⭐</span> <b>${xe.rating || 5.0}</b> · ${xe.trips || 0} chuyến
             </div>
-            <div style="display: flex; gap: 5px;">
-                <button onclick="openLocationModal('${safeName}', ${xe.lat}, ${xe.lng})" style="flex: 1; cursor:pointer; background: #fff; color: #17a2b8; border: 1px solid #17a2b8; padding: 8px 0; border-radius: 4px; font-weight: 600; font-size: 13px;">📍 Vị trí</button>
-                <button onclick="openTermsModal('${safeName}', ${xe.price})" style="flex: 1; cursor:pointer; background: #6c757d; color: white; border: none; padding: 8px 0; border-radius: 4px; font-weight: 600; font-size: 13px;">📄 HĐ</button>
-                
-                <button onclick="${statusConfig.isBookable ? `window.location.href='${smartBookingUrl}'` : "return false;"}" 
-                        style="flex: 2; cursor: ${statusConfig.isBookable ? "pointer" : "not-allowed"}; background: ${statusConfig.btnColor}; color: white; border: none; padding: 8px 0; border-radius: 4px; font-weight: 600; font-size: 13px;">
-                    ${statusConfig.btnText}
-                </button>
+        </div>
+        <div style="background: #f8f9fa; padding: 10px; border-radius: 6px; margin-bottom: 10px; border-left: 4px solid ${statusConfig.color};">
+            <div style="color: #d63031; font-size: 18px; font-weight: bold; line-height: 1;">
+                ${parseInt(xe.price).toLocaleString("vi-VN")}đ 
             </div>
+            <div style="font-size: 12px; color: #666; margin-top: 4px;">Giá thuê 1 ngày (24h)</div>
+        </div>
+        <div style="font-size: 12px; margin-bottom: 12px; padding: 5px; background: #f1f1f1; border-radius: 4px; color: #333;">
+            ${statusConfig.note}
+        </div>
+        <div style="display: flex; gap: 5px;">
+            <button onclick="openLocationModal('${safeName}', ${xe.lat}, ${xe.lng})" style="flex: 1; cursor:pointer; background: #fff; color: #17a2b8; border: 1px solid #17a2b8; padding: 8px 0; border-radius: 4px; font-weight: 600; font-size: 13px;">📍 Vị trí</button>
+            <button onclick="openTermsModal('${safeName}', ${xe.price})" style="flex: 1; cursor:pointer; background: #6c757d; color: white; border: none; padding: 8px 0; border-radius: 4px; font-weight: 600; font-size: 13px;">📄 HĐ</button>
+            
+            <button onclick="${statusConfig.isBookable ? `window.location.href=withDelivery('${smartBookingUrl}')` : "return false;"}" 
+                    style="flex: 2; cursor: ${statusConfig.isBookable ? "pointer" : "not-allowed"}; background: ${statusConfig.btnColor}; color: white; border: none; padding: 8px 0; border-radius: 4px; font-weight: 600; font-size: 13px;">
+                ${statusConfig.btnText}
+            </button>
         </div>
+    </div>
     `;
-        marker.bindPopup(popupContent);
+    marker.bindPopup(popupContent);
+}
+
+// ===================================================
+// 1b. TẢI XE THEO KHUNG NHÌN (API /vehicles/api/map/)
+// ===================================================
+
+// Làm tròn khung nhìn ra ngoài 0.01° (~1km): kéo nhẹ bản đồ vẫn trùng URL -> trúng cache server
+function roundBbox(bounds) {
+    const step = 100;
+    return [
+        Math.max(-180, Math.floor(bounds.getWest() * step) / step),
+        Math.max(-90, Math.floor(bounds.getSouth() * step) / step),
+        Math.min(180, Math.ceil(bounds.getEast() * step) / step),
+        Math.min(90, Math.ceil(bounds.getNorth() * step) / step),
+    ].join(",");
+}
+
+// Gộp các lần kéo/zoom liên tiếp thành một request
+function scheduleViewportLoad() {
+    clearTimeout(viewportTimer);
+    viewportTimer = setTimeout(loadViewport, 250);
+}
+
+function loadViewport() {
+    const apiUrl = map.getContainer().dataset.apiUrl;
+    if (!apiUrl) return;
+
+    // Huỷ request của khung nhìn cũ còn đang chờ
+    if (viewportRequest) viewportRequest.abort();
+    viewportRequest = new AbortController();
+
+    const url = `${apiUrl}?bbox=${roundBbox(map.getBounds())}&zoom=${map.getZoom()}&format=columnar`;
+    fetch(url, { signal: viewportRequest.signal })
+        .then((res) => {
+            if (!res.ok) throw new Error(`HTTP ${res.status}`);
+            return res.json();
+        })
+        .then((data) => renderViewport(data))
+        .catch((err) => {
+            if (err.name !== "AbortError") console.error("Lỗi tải xe theo khung nhìn:", err);
+        });
+}
+
+// Giải mã payload dạng cột (?format=columnar) thành danh sách xe như định dạng thường
+function decodeColumnar(data) {
+    const c = data.columns;
+    const scale = Math.pow(10, data.coord_precision);
+    return c.id.map((id, i) => ({
+        id: id,
+        name: c.name[i],
+        plate: c.plate[i],
+        lat: c.lat[i] / scale,
+        lng: c.lng[i] / scale,
+        status: data.statuses[c.status[i]],
+        price: c.price[i],
+        image: c.image[i],
+        rating: c.rating[i],
+        trips: c.trips[i],
+        popularity: c.popularity[i],
+    }));
+}
+
+// Chỉ thêm/xoá marker thay đổi so với khung nhìn trước (giữ nguyên marker còn trong khung)
+function renderViewport(data) {
+    clusterMarkers.forEach((marker) => map.removeLayer(marker));
+    clusterMarkers = [];
+
+    // Zoom nhỏ: server trả cụm gom sẵn thay cho từng xe
+    if (data.clusters) {
+        allMarkers.forEach((marker) => map.removeLayer(marker));
+        allMarkers = [];
+        data.clusters.forEach(addClusterMarker);
+        renderVehicleList([], false);
+        applyStatusFilter(currentFilter);
+        return;
+    }
+
+    const vehicles = data.format === "columnar" ? decodeColumnar(data) : data.vehicles;
+    const incoming = {};
+    vehicles.forEach((xe) => { incoming[xe.id] = xe; });
+
+    allMarkers = allMarkers.filter((marker) => {
+        const xe = incoming[marker.id];
+        if (xe && xe.status === marker.status) {
+            delete incoming[marker.id];
+            return true;
+        }
+        map.removeLayer(marker);
+        return false;
+    });
+    Object.values(incoming).forEach(addVehicleMarker);
+
+    renderVehicleList(vehicles, data.truncated);
+    applyStatusFilter(currentFilter);
+}
+
+// Icon tròn ghi số xe, to dần theo số lượng
+function createClusterIcon(count) {
+    const size = Math.min(64, 30 + Math.round(Math.log10(count) * 12));
+    return L.divIcon({
+        className: "vehicle-cluster-icon",
+        html: `<div style="width: ${size}px; height: ${size}px; border-radius: 50%; background: rgba(0, 123, 255, 0.85); border: 3px solid white; color: white; font-weight: 700; font-size: 13px; display: flex; align-items: center; justify-content: center; box-shadow: 0 2px 6px rgba(0,0,0,0.3);">${count}</div>`,
+        iconSize: [size, size],
+        iconAnchor: [size / 2, size / 2],
     });
 }
 
+// Số xe của cụm khớp bộ lọc trạng thái đang chọn
+function clusterCount(cluster, filter) {
+    return Object.entries(cluster.statuses).reduce(
+        (total, [status, count]) => total + (matchesFilter(status, filter) ? count : 0), 0
+    );
+}
+
+function addClusterMarker(cluster) {
+    const marker = L.marker([cluster.lat, cluster.lng], { icon: createClusterIcon(cluster.count) }).addTo(map);
+    marker.cluster = cluster;
+    marker.bindTooltip(`${cluster.count} xe • từ ${parseInt(cluster.min_price).toLocaleString("vi-VN")}đ/ngày`);
+    // Bấm vào cụm: phóng to vào khu vực đó
+    marker.on("click", () => map.flyTo([cluster.lat, cluster.lng], Math.min(map.getZoom() + 2, 19), { duration: 0.8 }));
+    clusterMarkers.push(marker);
+}
+
+// =======================================================
+// 1c. CẬP NHẬT TRỰC TIẾP (SSE /vehicles/api/live/)
+// =======================================================
+function connectLiveUpdates() {
+    const liveUrl = map.getContainer().dataset.liveUrl;
+    if (!liveUrl || typeof EventSource === "undefined") return;
+
+    // Máy chủ trả sự kiện mới rồi đóng kết nối; EventSource tự kết nối lại (retry)
+    // và gửi Last-Event-ID để nhận tiếp từ sự kiện cuối đã thấy
+    liveSource = new EventSource(liveUrl);
+    liveSource.addEventListener("vehicle", (e) => patchVehicle(JSON.parse(e.data)));
+    liveSource.addEventListener("positions", (e) => {
+        const data = JSON.parse(e.data);
+        data.id.forEach((id, i) => patchVehicle({ id: id, lat: data.lat[i], lng: data.lng[i] }));
+    });
+    liveSource.addEventListener("vehicle_removed", (e) => {
+        const id = JSON.parse(e.data).id;
+        allMarkers = allMarkers.filter((marker) => {
+            if (marker.id !== id) return true;
+            map.removeLayer(marker);
+            return false;
+        });
+        refreshVehicleList();
+    });
+    // Bị lỡ quá nhiều sự kiện: tải lại khung nhìn
+    liveSource.addEventListener("reset", () => loadViewport());
+}
+
+// Sửa marker tại chỗ theo thay đổi (trạng thái và/hoặc vị trí) của một xe
+function patchVehicle(change) {
+    // Đang hiển thị cụm: chỉ đổi trạng thái mới làm lệch số liệu cụm, tải lại khung nhìn
+    if (clusterMarkers.length) {
+        if (change.status) scheduleViewportLoad();
+        return;
+    }
+
+    const marker = allMarkers.find((m) => m.id === change.id);
+    const hasPosition = change.lat != null && change.lng != null;
+    if (!marker) {
+        // Xe mới đi vào khung nhìn
+        if (hasPosition && map.getBounds().contains([change.lat, change.lng])) scheduleViewportLoad();
+        return;
+    }
+    if (hasPosition && !map.getBounds().contains([change.lat, change.lng])) {
+        allMarkers = allMarkers.filter((m) => m !== marker);
+        map.removeLayer(marker);
+        refreshVehicleList();
+        return;
+    }
+
+    const xe = Object.assign({}, marker.vehicle);
+    if (hasPosition) {
+        xe.lat = change.lat;
+        xe.lng = change.lng;
+    }
+    if (change.status && change.status !== xe.status) {
+        // Đổi trạng thái: vẽ lại marker (icon + popup theo trạng thái mới)
+        xe.status = change.status;
+        allMarkers = allMarkers.filter((m) => m !== marker);
+        map.removeLayer(marker);
+        addVehicleMarker(xe);
+    } else if (hasPosition) {
+        marker.setLatLng([xe.lat, xe.lng]);
+        marker.vehicle = xe;
+    }
+    refreshVehicleList();
+}
+
+// Dựng lại sidebar từ các marker đang có
+function refreshVehicleList() {
+    const truncated = document.getElementById("vehicle-list")?.dataset.truncated;
+    renderVehicleList(allMarkers.map((m) => m.vehicle), truncated);
+    applyStatusFilter(currentFilter);
+}
+
+function escapeHtml(text) {
+    const div = document.createElement("div");
+    div.textContent = text == null ? "" : String(text);
+    return div.innerHTML;
+}
+
+// Danh sách thẻ xe ở sidebar cho các xe trong khung nhìn
+function renderVehicleList(vehicles, truncated) {
+    const list = document.getElementById("vehicle-list");
+    if (!list) return;
+    const placeholder = map.getContainer().dataset.placeholder || "";
+
+    list.innerHTML = vehicles.map((xe) => {
+        const status = (xe.status || "").toLowerCase();
+        const statusConfig = getStatusConfig(xe);
+        let badge = "";
+        if (status === "maintenance") {
+            badge = `<div class="absolute inset-0 bg-black/60 flex items-center justify-center">
+                        <span class="text-[10px] text-white font-bold uppercase bg-slate-600 px-2 py-0.5 rounded border border-white/20">Bảo trì</span>
+                    </div>`;
+        } else if (matchesFilter(status, "booked")) {
+            badge = `<div class="absolute inset-0 bg-black/40 flex items-center justify-center">
+                        <span class="text-[10px] text-white font-bold uppercase bg-red-600 px-2 py-0.5 rounded">Đã thuê</span>
+                    </div>`;
+        }
+        return `
+        <div class="bg-white dark:bg-[#16222b] rounded-lg p-3 shadow-sm border border-slate-100 dark:border-gray-800 cursor-pointer hover:border-primary transition-all vehicle-card"
+             onclick="focusVehicle(${xe.lat}, ${xe.lng})" data-id="${xe.id}" data-status="${escapeHtml(status)}">
+            <div class="flex gap-4">
+                <div class="w-28 h-20 bg-gray-100 rounded-md overflow-hidden relative shrink-0">
+                    <img class="w-full h-full object-cover" src="${escapeHtml(xe.image || placeholder)}" alt="${escapeHtml(xe.name)}" />
+                    ${badge}
+                </div>
+                <div class="flex flex-col flex-1 justify-between">
+                    <div>
+                        <h3 class="font-bold text-slate-900 dark:text-white leading-tight">${escapeHtml(xe.name)}</h3>
+                        <p class="text-xs text-slate-500 dark:text-slate-400 mt-1">Vị trí thực • ${statusConfig.label}</p>
+                    </div>
+                    <div class="flex justify-between items-end mt-2">
+                        <p class="text-primary font-bold text-lg">${parseInt(xe.price).toLocaleString("vi-VN")}đ</p>
+                        <a href="javascript:void(0)"
+                           onclick="focusVehicle(${xe.lat}, ${xe.lng}); event.stopPropagation();"
+                           class="bg-primary/10 text-primary hover:bg-primary hover:text-white px-3 py-1.5 rounded-md text-xs font-bold transition-colors">
+                           Xem
+                        </a>
+                    </div>
+                </div>
+            </div>
+        </div>`;
+    }).join("");
+    list.dataset.truncated = truncated ? "1" : "";
+}
+
+// "booked" gồm cả xe đang được thuê (in_use / in operation)
+function matchesFilter(status, filter) {
+    if (filter === "all") return true;
+    if (filter === "available") return status === "available";
+    if (filter === "booked") return ["booked", "rented", "in_use", "in operation"].includes(status);
+    return status === filter;
+}
+
+// Lọc marker trên bản đồ và thẻ xe ở sidebar theo trạng thái
+function applyStatusFilter(filter) {
+    currentFilter = filter;
+    allMarkers.forEach((marker) => {
+        const status = (marker.status || "").toLowerCase().trim();
+        if (matchesFilter(status, filter)) {
+            if (!map.hasLayer(marker)) map.addLayer(marker);
+        } else if (map.hasLayer(marker)) {
+            map.removeLayer(marker);
+        }
+    });
+
+    let visibleCount = 0;
+    document.querySelectorAll(".vehicle-card").forEach((card) => {
+        const show = matchesFilter(card.dataset.status || "", filter);
+        card.style.display = show ? "block" : "none";
+        if (show) visibleCount++;
+    });
+
+    // Cụm: cập nhật số xe theo bộ lọc, ẩn cụm không còn xe nào
+    let clusteredCount = 0;
+    clusterMarkers.forEach((marker) => {
+        const count = clusterCount(marker.cluster, filter);
+        clusteredCount += count;
+        if (count) {
+            marker.setIcon(createClusterIcon(count));
+            if (!map.hasLayer(marker)) map.addLayer(marker);
+        } else if (map.hasLayer(marker)) {
+            map.removeLayer(marker);
+        }
+    });
+
+    const vehicleCount = document.getElementById("vehicle-count");
+    if (vehicleCount) {
+        const truncated = document.getElementById("vehicle-list")?.dataset.truncated;
+        if (clusterMarkers.length) {
+            vehicleCount.textContent = `${clusteredCount} xe trong khu vực (phóng to để xem từng xe)`;
+        } else {
+            vehicleCount.textContent = `${visibleCount} xe tìm thấy` + (truncated ? " (phóng to để xem thêm)" : "");
+        }
+    }
+}
+
 // =========================
 // 2. LẤY VỊ TRÍ NGƯỜI DÙNG
 // =========================
@@ -214,6 +532,22 @@ function getUserLocation() {
 // ===================================
 // 3. TÍNH TOÁN LỘ TRÌNH & DỊCH THUẬT
 // ===================================
+// Vị trí người dùng làm điểm giao xe: server tự báo giá lại khi thanh toán
+window.withDelivery = function (url) {
+    if (userLat === null || userLng === null) return url;
+    const point = `${userLat.toFixed(6)},${userLng.toFixed(6)}`;
+    return url + (url.includes("?") ? "&" : "?") + "delivery=" + encodeURIComponent(point);
+};
+
+// Phí giao xe theo báo giá của server (ma trận kho -> ô lưới), không tự tính ở trình duyệt
+function fetchDeliveryQuote() {
+    const quoteUrl = map.getContainer().dataset.deliveryQuoteUrl;
+    const point = `${userLat.toFixed(6)},${userLng.toFixed(6)}`;
+    return fetch(`${quoteUrl}?to=${encodeURIComponent(point)}`)
+        .then((response) => (response.ok ? response.json() : null))
+        .catch(() => null);
+}
+
 window.calculateRoute = function (destLat, destLng) {
     if (userLat === null || userLng === null) {
         alert("Đang tìm vị trí của bạn... Vui lòng bật GPS và thử lại sau giây lát.");
@@ -245,7 +579,6 @@ window.calculateRoute = function (destLat, destLng) {
         var summary = route.summary;
         var distanceInKm = (summary.totalDistance / 1000).toFixed(2);
         var timeInMinutes = Math.round(summary.totalTime / 60);
-        var shipCost = Math.round(distanceInKm * 30000).toLocaleString("vi-VN");
 
         var summaryHTML = `
         <div style="font-family: 'Segoe UI', sans-serif;">
@@ -257,13 +590,20 @@ window.calculateRoute = function (destLat, destLng) {
                 <span style="font-size: 20px; margin-right: 10px;">⏳</span> 
                 <div><div style="font-size: 13px; color: #666;">Thời gian</div><strong style="font-size: 16px;">${timeInMinutes} phút</strong></div>
             </div>
-            <div style="margin-top: 12px; padding-top: 10px; border-top: 1px dashed #ccc; display: flex; align-items: center;">
+            <div id="delivery-quote" style="margin-top: 12px; padding-top: 10px; border-top: 1px dashed #ccc; display: flex; align-items: center;">
                 <span style="font-size: 20px; margin-right: 10px;">🚚</span> 
-                <div><div style="font-size: 13px; color: #666;">Phí giao xe (30k/km)</div><strong style="font-size: 18px; color: #d63031;">${shipCost}đ</strong></div>
+                <div><div style="font-size: 13px; color: #666;">Phí giao xe</div><strong style="font-size: 18px; color: #d63031;">Đang tính...</strong></div>
             </div>
         </div>
       `;
         document.getElementById("route-summary").innerHTML = summaryHTML;
+        fetchDeliveryQuote().then(function (quote) {
+            var box = document.getElementById("delivery-quote");
+            if (!box) return;
+            box.querySelector("strong").textContent = quote
+                ? `${parseInt(quote.fee).toLocaleString("vi-VN")}đ`
+                : "Ngoài khu vực giao xe";
+        });
 
         // BỘ DỊCH THUẬT
         var instructions = route.instructions;
@@ -438,24 +778,9 @@ document.addEventListener("DOMContentLoaded", function () {
     // ==================
     // A. KHỞI TẠO BẢN ĐỒ
     // ==================
-    const dataScript = document.getElementById("vehicles-data");
-    if (dataScript) {
-        try {
-            var vehicleData = JSON.parse(dataScript.textContent);
-            if (typeof vehicleData === "string") vehicleData = JSON.parse(vehicleData);
-            
-            console.log("Dữ liệu xe chuẩn:", vehicleData);
-            
-            if (Array.isArray(vehicleData)) {
-                initMap(vehicleData);
-            } else {
-                console.error("Lỗi: Dữ liệu xe không đúng định dạng danh sách.");
-            }
-        } catch (e) {
-            console.error("Lỗi dữ liệu:", e);
-        }
-    } else {
-        console.warn("Không tìm thấy dữ liệu xe (ID: vehicles-data)");
+    // Xe được tải theo khung nhìn (xem loadViewport), trang không nhúng sẵn dữ liệu đội xe
+    if (document.getElementById("map")) {
+        initMap([]);
     }
 
     // ========================
@@ -472,17 +797,23 @@ document.addEventListener("DOMContentLoaded", function () {
                 const address = this.value;
                 if (!address) return;
 
-                fetch(`https://nominatim.openstreetmap.org/search?format=json&q=${encodeURIComponent(address)}`)
-                    .then((res) => res.json())
+                // Qua proxy geocoding của server (có cache), không gọi thẳng Nominatim
+                const geocodeUrl = map.getContainer().dataset.geocodeUrl;
+                fetch(`${geocodeUrl}?q=${encodeURIComponent(address)}`)
+                    .then((res) => {
+                        if (res.status === 404) return null;
+                        if (!res.ok) throw new Error(`HTTP ${res.status}`);
+                        return res.json();
+                    })
                     .then((data) => {
-                        if (data.length > 0) {
-                            const lat = parseFloat(data[0].lat);
-                            const lon = parseFloat(data[0].lon);
+                        if (data) {
+                            const lat = data.lat;
+                            const lon = data.lng;
 
                             if (searchMarker) map.removeLayer(searchMarker);
                             searchMarker = L.marker([lat, lon])
                                 .addTo(map)
-                                .bindPopup(`<b>Vị trí tìm thấy:</b><br>${address}`)
+                                .bindPopup(`<b>Vị trí tìm thấy:</b><br>${escapeHtml(address)}`)
                                 .openPopup();
 
                             // Xóa marker khi đóng popup
@@ -523,18 +854,7 @@ document.addEventListener("DOMContentLoaded", function () {
             filterBtn.classList.add("bg-primary", "text-white");
 
             // Lọc Marker và Danh sách Sidebar
-            allMarkers.forEach((marker) => {
-                const vehicleStatus = (marker.status || "").toLowerCase().trim();
-                const sidebarItem = document.querySelector(`.vehicle-item[data-id="${marker.id}"]`);
-
-                if (filterValue === "all" || vehicleStatus === filterValue) {
-                    if (!map.hasLayer(marker)) map.addLayer(marker);
-                    if (sidebarItem) sidebarItem.style.display = "flex";
-                } else {
-                    if (map.hasLayer(marker)) map.removeLayer(marker);
-                    if (sidebarItem) sidebarItem.style.display = "none";
-                }
-            });
+            applyStatusFilter(filterValue);
             return;
         }
 
@@ -545,58 +865,6 @@ document.addEventListener("DOMContentLoaded", function () {
         }
     });
 
-    // Lọc trên Danh sách Xe (Vehicle Cards)
-    const vehiclesDataEl = document.getElementById("vehicles-data");
-    if (vehiclesDataEl) {
-        const vehicles = JSON.parse(vehiclesDataEl.textContent);
-        const vehicleCards = document.querySelectorAll(".vehicle-card");
-        const filterButtons = document.querySelectorAll(".filter-btn");
-        const vehicleCount = document.getElementById("vehicle-count");
-
-        function applyFilter(filter) {
-            let visibleCount = 0;
-
-            vehicleCards.forEach((card, index) => {
-                const vehicle = vehicles[index];
-                if (!vehicle) return;
-
-                const status = vehicle.status ? vehicle.status.toString() : "";
-                const statusLower = status.toLowerCase();
-                const filterLower = filter.toLowerCase();
-
-                let show = false;
-
-                if (filterLower === "all") {
-                    show = true;
-                } else if (filterLower === "available" && statusLower === "available") {
-                    show = true;
-                } else if (filterLower === "booked" && (statusLower === "booked" || statusLower === "in_use")) {
-                    show = true;
-                }
-
-                card.style.display = show ? "block" : "none";
-                if (show) visibleCount++;
-            });
-
-            if (vehicleCount) {
-                vehicleCount.textContent = `${visibleCount} xe tìm thấy`;
-            }
-        }
-
-        filterButtons.forEach(btn => {
-            btn.addEventListener("click", function () {
-                filterButtons.forEach(b => {
-                    b.classList.remove("bg-primary", "text-white");
-                    b.classList.add("bg-slate-100");
-                });
-                this.classList.add("bg-primary", "text-white");
-
-                const filter = this.dataset.filter;
-                applyFilter(filter);
-            });
-        });
-    }
-
     // =========================
     // D. VÔ HIỆU HÓA SIDEBAR LEAFLET
     // =========================
@@ -3,10 +3,11 @@ from django.contrib.auth import logout, login
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib import messages
 from django.urls import reverse
-from django.db.models import Q, Sum
+from django.db.models import Sum
 from django.db.models.functions import ExtractMonth
 from django.http import JsonResponse
 from datetime import datetime, timedelta
+from decimal import Decimal
 
 # Import Forms
 from .forms import (
@@ -25,6 +26,16 @@ except ImportError:
     Booking = None
     User = None
 
+from bookings import transitions
+from bookings.delivery import matrix as delivery_matrix
+from bookings.pricing import quote, CENT
+from bookings.utils import filter_available, create_booking_atomic, BookingOverlapError
+from vehicles.geo import parse_point
+from vehicles.search import search_vehicles
+
+# Thuế/phí dịch vụ cộng vào tổng tiền trên trang thanh toán
+TAX_RATE = Decimal("0.10")
+
 # Hàm kiểm tra quyền Admin chuyên sâu
 def is_admin(user):
     return user.is_authenticated and user.is_staff
@@ -34,49 +45,28 @@ def is_admin(user):
 # ==========================================
 
 def home(request):
-    if Vehicle:
-        vehicles = Vehicle.objects.all().order_by('-id')[:8]
-    else:
-        vehicles = []
+    if not Vehicle:
+        return render(request, 'pages/home.html', {'featured_vehicles': []})
 
+    vehicles = Vehicle.objects.order_by('-id')
     vehicle_name = request.GET.get('q')
     vehicle_type = request.GET.get('type')
 
-    if vehicle_name and vehicles:
-        vehicles = vehicles.filter(name__icontains=vehicle_name)
-    if vehicle_type and vehicles: 
+    # Lọc trước khi cắt 8 xe; tìm theo tên/biển số không phân biệt dấu
+    if vehicle_name:
+        vehicles = search_vehicles(vehicles, vehicle_name)
+    if vehicle_type: 
         vehicles = vehicles.filter(vehicle_type=vehicle_type) 
 
-    return render(request, 'pages/home.html', {'featured_vehicles': vehicles})
+    return render(request, 'pages/home.html', {'featured_vehicles': vehicles[:8]})
 
 def map_view(request):
-    if not Vehicle:
-        return render(request, 'pages/map.html', {'vehicles': [], 'vehicles_json': []})
-
-    vehicles = Vehicle.objects.exclude(Q(latitude__isnull=True) | Q(longitude__isnull=True))
-    vehicles_json = []
-    
-    for v in vehicles:
-        lat = getattr(v, 'latitude', 0) or getattr(v, 'lat', 0)
-        lng = getattr(v, 'longitude', 0) or getattr(v, 'lng', 0)
-        
-        vehicles_json.append({
-            'id': v.id,
-            'name': getattr(v, 'name', 'Xe'),
-            'lat': float(lat),
-            'lng': float(lng),
-            'status': getattr(v, 'status', 'Available'),
-            'status_display': v.get_status_display() if hasattr(v, 'get_status_display') else str(v.status),
-            'image_url': v.image.url if v.image else '/static/img/placeholder.jpg',
-            'detail_url': reverse('frontend:vehicle_detail', args=[v.id]),
-            'price': float(getattr(v, 'price_per_day', 0) or getattr(v, 'daily_rate', 0)),
-            'rating': 4.8, 
-            'trips': 12 
-        })
-
+    # Không nhúng cả đội xe vào trang: map_logic.js tải xe theo khung nhìn khi kéo/zoom
     return render(request, 'pages/map.html', {
-        'vehicles': vehicles, 
-        'vehicles_json': vehicles_json
+        'map_api_url': reverse('vehicles:vehicle_map_api'),
+        'live_url': reverse('vehicles:live_events_api'),
+        'geocode_url': reverse('vehicles:geocode_api'),
+        'delivery_quote_url': reverse('bookings:delivery_quote'),
     })
 
 def vehicle_list(request):
@@ -87,6 +77,20 @@ def vehicle_list(request):
     if vehicle_type:
         vehicles = vehicles.filter(vehicle_type=vehicle_type)
 
+    # ===== TÌM KIẾM (tên, biển số, không phân biệt dấu) =====
+    search_query = request.GET.get('q', '').strip()
+    if search_query:
+        vehicles = search_vehicles(vehicles, search_query, ranked=False)
+
+    # ===== LỌC XE TRỐNG LỊCH THEO NGÀY =====
+    try:
+        start_date = datetime.strptime(request.GET.get('start_date', ''), "%Y-%m-%d").date()
+        end_date = datetime.strptime(request.GET.get('end_date', ''), "%Y-%m-%d").date()
+    except ValueError:
+        start_date = end_date = None
+    if start_date and end_date and start_date <= end_date:
+        vehicles = filter_available(vehicles, start_date, end_date)
+
     # ===== SẮP XẾP =====
     sort_by = request.GET.get('sort')
     if sort_by == 'price_asc':
@@ -104,20 +108,17 @@ def vehicle_list(request):
 
 def vehicle_detail(request, vehicle_id):
     from reviews.models import Review
-    from django.db.models import Avg
     vehicle = get_object_or_404(Vehicle, pk=vehicle_id)
     reviews = Review.objects.filter(vehicle=vehicle).order_by('-created_at')
     
-    avg_rating = reviews.aggregate(Avg('rating'))['rating__avg']
-    avg_rating = round(avg_rating, 1) if avg_rating else 0
-    
-    review_count = reviews.count()
-    
+    # Điểm/số đánh giá đã lưu sẵn trên Vehicle
     return render(request, 'vehicles/detail.html', {
         'vehicle': vehicle,
         'reviews': reviews,
-        'avg_rating': avg_rating,
-        'review_count': review_count,
+        'avg_rating': vehicle.avg_rating or 0,
+        'review_count': vehicle.review_count,
+        # Điểm giao xe chọn trên bản đồ (lat,lng), chuyển tiếp sang trang thanh toán
+        'delivery': request.GET.get('delivery', ''),
     })
 
 # ==========================================
@@ -140,40 +141,50 @@ def vehicle_payment(request, vehicle_id):
         r_date = p_date + timedelta(days=1) 
 
     # --- LOGIC TÍNH TOÁN ĐỒNG BỘ VỚI UI (SURGE PRICING 20%) ---
-    weekday_count = 0
-    weekend_count = 0
-    daily_rate = float(vehicle.price_per_day)
-    
-    current_date = p_date
-    while current_date < r_date:
-        if current_date.weekday() >= 5: # 5 là Thứ 7, 6 là Chủ nhật
-            weekend_count += 1
-        else:
-            weekday_count += 1
-        current_date += timedelta(days=1)
-
-    weekday_total = weekday_count * daily_rate
-    weekend_rate = daily_rate * 1.2
-    weekend_total = weekend_count * weekend_rate
-    base_total = weekday_total + weekend_total
-    tax_fee = base_total * 0.1
-    final_total = base_total + tax_fee
-
-    # Xử lý xác nhận thanh toán
-    if request.method == 'POST' and 'payment_method' in request.POST:
+    price = quote(vehicle.price_per_day, p_date, r_date)
+    base_total = price['total']
+    tax_fee = (base_total * TAX_RATE).quantize(CENT)
+
+    # Phí giao xe tính ở server từ ma trận kho -> ô lưới (không tin số liệu trình duyệt gửi lên)
+    delivery = request.POST.get('delivery') or request.GET.get('delivery', '')
+    delivery_point = delivery_quote = None
+    if delivery:
+        try:
+            delivery_point = parse_point(delivery)
+            delivery_quote = delivery_matrix.quote(*delivery_point)
+        except ValueError:
+            pass
+        if delivery_quote is None:
+            messages.warning(request, "Điểm giao xe nằm ngoài khu vực phục vụ, vui lòng nhận xe tại kho.")
+            delivery = ''
+            delivery_point = None
+    delivery_fee = delivery_quote['fee'] if delivery_quote else Decimal('0')
+    final_total = base_total + tax_fee + delivery_fee
+
+    # Xử lý xác nhận thanh toán. Khách chọn giao xe mà không báo giá được: không đặt,
+    # hiển thị lại trang (nhận tại kho) để khách xác nhận tổng tiền mới
+    if request.method == 'POST' and 'payment_method' in request.POST and not (
+        request.POST.get('delivery') and delivery_quote is None
+    ):
         try:
-            Booking.objects.create(
+            create_booking_atomic(
+                vehicle,
+                p_date,
+                r_date,
                 customer=request.user,
-                vehicle=vehicle,
-                start_date=p_date,
-                end_date=r_date,
                 total_price=final_total,
+                delivery_lat=delivery_point[0] if delivery_point else None,
+                delivery_lng=delivery_point[1] if delivery_point else None,
+                delivery_fee=delivery_fee,
                 status='pending'
             )
             vehicle.status = 'Booked'
             vehicle.save()
             messages.success(request, "Thanh toán thành công! Đơn hàng đang chờ xác nhận.")
             return redirect('/my-orders/') 
+        except BookingOverlapError:
+            messages.error(request, "Xe bị trùng lịch trong khoảng ngày đã chọn. Vui lòng chọn ngày khác.")
+            return redirect(f'/thue-xe/{vehicle_id}/')
         except Exception as e:
             messages.error(request, f"Lỗi hệ thống: {str(e)}")
             return redirect(f'/thue-xe/{vehicle_id}/')
@@ -182,13 +193,17 @@ def vehicle_payment(request, vehicle_id):
         'vehicle': vehicle,
         'pickup_date': p_date,
         'return_date': r_date,
-        'days': weekday_count + weekend_count,
-        'weekday_count': weekday_count,
-        'weekend_count': weekend_count, # Đảm bảo biến này được truyền để UI hiển thị số ngày cuối tuần
-        'weekday_total': weekday_total,
-        'weekend_total': weekend_total,
-        'weekend_rate': weekend_rate,
+        'days': price['days'],
+        'weekday_count': price['weekday_count'],
+        'weekend_count': price['weekend_count'], # Đảm bảo biến này được truyền để UI hiển thị số ngày cuối tuần
+        'weekday_total': price['weekday_total'],
+        'weekend_total': price['weekend_total'],
+        'weekend_rate': price['weekend_rate'],
+        'rule_surcharge': price['rule_surcharge'],
         'tax_fee': tax_fee,
+        'delivery': delivery,
+        'delivery_quote': delivery_quote,
+        'delivery_fee': delivery_fee,
         'final_total': final_total
     })
 
@@ -205,7 +220,7 @@ def order_list(request):
         if status_filter and status_filter != 'all':
             bookings_qs = bookings_qs.filter(status=status_filter)
         if search_query:
-            bookings_qs = bookings_qs.filter(Q(vehicle__name__icontains=search_query) | Q(vehicle__license_plate__icontains=search_query))
+            bookings_qs = bookings_qs.filter(vehicle__in=search_vehicles(Vehicle.objects.all(), search_query, ranked=False))
 
         reviewed_vehicle_ids = list(Review.objects.filter(user=request.user).values_list('vehicle_id', flat=True))
 
@@ -226,11 +241,10 @@ def order_list(request):
 def booking_return(request, booking_id):
     booking = get_object_or_404(Booking, pk=booking_id, customer=request.user)
     if request.method == 'POST':
-        booking.status = 'completed'
-        booking.vehicle.status = 'Available' 
-        booking.vehicle.save()
-        booking.save()
-        messages.success(request, "Trả xe thành công!")
+        if transitions.complete_booking(booking):
+            messages.success(request, "Trả xe thành công!")
+        else:
+            messages.error(request, "Chỉ trả được xe của đơn đã duyệt.")
         return redirect('/my-orders/')
     return render(request, 'bookings/return.html', {'booking': booking})
 